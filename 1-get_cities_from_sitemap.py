@@ -2,25 +2,13 @@
 We will just get them with a beautiful regex
 
 WARN : This does not work, the sitemap is not properly updated
-"""
-
-import json
-import re
 
+Kept for the old command line, see `bdmv sitemap`
+"""
 
-WEBSITE_PATTERN = re.compile(r"https:\/\/www.bien-dans-ma-ville.fr\/(.*?)\/")
+from bdmv.cli import main
 
-def main():
-    with open("data/sitemap-ville.xml", "r", encoding="utf-8") as file:
-        sitemap_str = file.read()
-        
-    matches = WEBSITE_PATTERN.finditer(sitemap_str)
-    websites = [m.group() for m in matches]
-    
-    print(len(websites))
-    
-    # with open("websites.json", "w", encoding="utf-8") as file:
-    #     json.dump(websites, file)
+WEBSITE_PATTERN = r"https:\/\/www.bien-dans-ma-ville.fr\/(.*?)\/"
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(["sitemap", "--sitemap", "data/sitemap-ville.xml", "--pattern", WEBSITE_PATTERN])
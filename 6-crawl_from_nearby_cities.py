@@ -0,0 +1,12 @@
+"""Download all the "avis.html" pages, starting from the sitemap and following
+the nearby cities of each page
+
+Kept for the old command line, same as `bdmv crawl`
+"""
+
+import sys
+
+from bdmv.cli import main
+
+if __name__ == "__main__":
+    main(["crawl", *sys.argv[1:]])
@@ -0,0 +1,2 @@
+"""Shared code for the bien-dans-ma-ville scrapping scripts
+"""
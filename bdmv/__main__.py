@@ -0,0 +1,3 @@
+from bdmv.cli import main
+
+main()
@@ -0,0 +1,227 @@
+"""Prefix index of the city names and postal codes, for autocompletion
+
+Names and queries are folded the same way: no accents, no case, and words
+separated by single spaces ("Saint-Étienne" and "saint etienne" are both
+"saint etienne"). The folded names and the postal codes are kept in a
+single sorted list, where a query is two binary searches, instead of a
+scan of all the names per keystroke.
+
+Cities with scores come first: each key starts with the tier of its city
+("0" with scores, "1" without), so the matches of a prefix are found in
+the scored tier, then in the other one, already in alphabetical order.
+
+Usage:
+    python -m bdmv.autocomplete build <scrape output folder> [--output !autocomplete.npz]
+    python -m bdmv.autocomplete query <index> <text> [-k 10]
+    python -m bdmv.autocomplete bench [--cities 35000] [--queries 10000]
+"""
+
+from argparse import ArgumentParser
+from bisect import bisect_left
+from dataclasses import asdict, dataclass
+from pathlib import Path
+import random
+import re
+import time
+from typing import Iterable, List, Set
+import unicodedata
+
+import numpy as np
+
+from bdmv.bench_report import latency_report, print_table
+from bdmv.outputs import read_city_infos
+from bdmv.scraping import CityInformation
+
+AUTOCOMPLETE_FILENAME = "!autocomplete.npz"
+
+DEFAULT_K = 10
+
+SCORED_TIER = "0"
+UNSCORED_TIER = "1"
+
+# Above all the characters of the folded keys, ends the range of a prefix
+KEY_END = "\U0010ffff"
+
+# Letters that NFKD does not split into a base letter and an accent
+LIGATURES = str.maketrans({"œ": "oe", "Œ": "oe", "æ": "ae", "Æ": "ae", "ß": "ss"})
+
+def fold(text: str) -> str:
+    """"Saint-Étienne-d'Œuvre" -> "saint etienne d oeuvre"
+    """
+    text = unicodedata.normalize("NFKD", text.translate(LIGATURES))
+    text = text.encode("ascii", "ignore").decode("ascii").lower()
+    return " ".join(re.split(r"[^a-z0-9]+", text)).strip()
+
+@dataclass
+class Suggestion:
+    name: str
+    postal_code: str
+    insee_code: str
+    contains_scores: bool
+
+class PrefixIndex:
+    """`keys[i]` (tier + folded name or postal code) leads to the city `rows[i]`
+    """
+    def __init__(self, names: List[str], postal_codes: List[str], insee_codes: List[str],
+                 contains_scores: List[bool], keys: List[str], rows: List[int]):
+        self.names = names
+        self.postal_codes = postal_codes
+        self.insee_codes = insee_codes
+        self.contains_scores = contains_scores
+        self.keys = keys
+        self.rows = rows
+
+    @classmethod
+    def from_cities(cls, names: List[str], postal_codes: List[str], insee_codes: List[str],
+                    contains_scores: List[bool]) -> "PrefixIndex":
+        entries = []
+        for row, (name, postal_code, scored) in enumerate(zip(names, postal_codes, contains_scores)):
+            tier = SCORED_TIER if scored else UNSCORED_TIER
+            entries.append((tier + fold(name), row))
+            entries.append((tier + postal_code, row))
+        entries.sort()
+        return cls(names, postal_codes, insee_codes, contains_scores,
+                   [key for key, _ in entries], [row for _, row in entries])
+
+    @classmethod
+    def from_city_infos(cls, infos: Iterable[CityInformation]) -> "PrefixIndex":
+        builder = PrefixIndexBuilder()
+        for info in infos:
+            builder.add(info)
+        return builder.build()
+
+    def save(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(path, names=np.array(self.names, dtype=str),
+                            postal_codes=np.array(self.postal_codes, dtype=str),
+                            insee_codes=np.array(self.insee_codes, dtype=str),
+                            contains_scores=np.array(self.contains_scores, dtype=np.bool_),
+                            keys=np.array(self.keys, dtype=str), rows=np.array(self.rows, dtype=np.int64))
+
+    @classmethod
+    def load(cls, path: Path) -> "PrefixIndex":
+        """The arrays are turned back into lists, `bisect` on a list is faster
+        than NumPy for a single query
+        """
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["names"].tolist(), data["postal_codes"].tolist(), data["insee_codes"].tolist(),
+                       data["contains_scores"].tolist(), data["keys"].tolist(), data["rows"].tolist())
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def query(self, text: str, k: int = DEFAULT_K) -> List[Suggestion]:
+        """The `k` first cities whose name or postal code starts with `text`,
+        the cities with scores first, then alphabetically
+        """
+        prefix = fold(text)
+        if not prefix:
+            return []
+        suggestions: List[Suggestion] = []
+        seen: Set[int] = set()
+        for tier in (SCORED_TIER, UNSCORED_TIER):
+            start = bisect_left(self.keys, tier + prefix)
+            end = bisect_left(self.keys, tier + prefix + KEY_END, start)
+            for row in self.rows[start:end]:
+                if row in seen:
+                    continue
+                seen.add(row)
+                suggestions.append(Suggestion(self.names[row], self.postal_codes[row],
+                                              self.insee_codes[row], self.contains_scores[row]))
+                if len(suggestions) == k:
+                    return suggestions
+        return suggestions
+
+class PrefixIndexBuilder:
+    """Collects the cities as they are scraped
+    """
+    def __init__(self):
+        self.names: List[str] = []
+        self.postal_codes: List[str] = []
+        self.insee_codes: List[str] = []
+        self.contains_scores: List[bool] = []
+
+    def add(self, info: CityInformation):
+        self.names.append(info.name)
+        self.postal_codes.append(info.postal_code)
+        self.insee_codes.append(info.insee_code)
+        self.contains_scores.append(info.contains_scores)
+
+    def build(self) -> PrefixIndex:
+        return PrefixIndex.from_cities(self.names, self.postal_codes, self.insee_codes, self.contains_scores)
+
+# ==== Benchmark ====
+
+def bench(city_count: int, query_count: int, k: int):
+    # Imported here, the synthetic cities are only needed by the benchmark
+    from bdmv.synthetic import generate_cities
+    cities = generate_cities(city_count)
+    rnd = random.Random(1)
+    scored = [rnd.random() < 0.6 for _ in cities]
+    index = PrefixIndex.from_cities([c.name for c in cities], [c.postal_code for c in cities],
+                                    [c.insee_code for c in cities], scored)
+    # What is typed: the 1 to 8 first letters of a name, or of a postal code
+    queries = []
+    for _ in range(query_count):
+        city = rnd.choice(cities)
+        text = city.name if rnd.random() < 0.8 else city.postal_code
+        queries.append(text[:rnd.randint(1, min(8, len(text)))])
+    print(f"{city_count} cities, {query_count} queries, k = {k}\n")
+
+    folded = [fold(c.name) for c in cities]
+    def scan(text: str) -> List[int]:
+        # What the index replaces: a startswith on every city, then the scored ones first
+        prefix = fold(text)
+        rows = [i for i, (name, city) in enumerate(zip(folded, cities))
+                if name.startswith(prefix) or city.postal_code.startswith(prefix)]
+        rows.sort(key=lambda i: (not scored[i], folded[i]))
+        return rows[:k]
+
+    reports = []
+    for label, func, count in (("PrefixIndex.query", lambda q: index.query(q, k), query_count),
+                               ("startswith scan", scan, min(query_count, 500))):
+        durations = []
+        for text in queries[:count]:
+            start = time.perf_counter()
+            func(text)
+            durations.append((time.perf_counter() - start) * 1_000_000)
+        report = asdict(latency_report(label, durations))
+        # Microseconds for this benchmark
+        reports.append({key.replace("_ms", "_us"): value for key, value in report.items()})
+    print_table(reports)
+
+def main():
+    parser = ArgumentParser("autocomplete")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = commands.add_parser("build", help="Build the index from the output of the scrape script")
+    build_parser.add_argument("scrape_output_path")
+    build_parser.add_argument("--output", help=f"The index file ({AUTOCOMPLETE_FILENAME} in the scrape output by default)")
+
+    query_parser = commands.add_parser("query", help="Show the cities starting with the given text")
+    query_parser.add_argument("index_path")
+    query_parser.add_argument("text")
+    query_parser.add_argument("-k", type=int, default=DEFAULT_K)
+
+    bench_parser = commands.add_parser("bench", help="Measure the query latency on synthetic cities")
+    bench_parser.add_argument("--cities", type=int, default=35000)
+    bench_parser.add_argument("--queries", type=int, default=10000)
+    bench_parser.add_argument("-k", type=int, default=DEFAULT_K)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        output_path = Path(args.scrape_output_path)
+        index = PrefixIndex.from_city_infos(read_city_infos(output_path))
+        index_path = Path(args.output) if args.output else output_path / AUTOCOMPLETE_FILENAME
+        index.save(index_path)
+        print(f"{len(index)} cities indexed in {index_path}")
+    elif args.command == "query":
+        index = PrefixIndex.load(Path(args.index_path))
+        for suggestion in index.query(args.text, args.k):
+            scored = "" if suggestion.contains_scores else "  (no scores)"
+            print(f"{suggestion.postal_code}  {suggestion.name}  [{suggestion.insee_code}]{scored}")
+    else:
+        bench(args.cities, args.queries, args.k)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""Reports of the benchmarks: latency percentiles and plain text tables
+
+Shared by `bdmv.benchmark` and the bench commands of the other modules
+(`bdmv.download`, `bdmv.service`, `bdmv.similar`, `bdmv.autocomplete`),
+without loading the scrapping code and the synthetic corpus.
+"""
+
+from dataclasses import dataclass
+import statistics
+from typing import Dict, List
+
+@dataclass
+class LatencyReport:
+    step: str
+    p50_ms: float
+    p90_ms: float
+    p99_ms: float
+    mean_ms: float
+
+def latency_report(step: str, durations: List[float]) -> LatencyReport:
+    """Percentiles of a list of durations, in milliseconds
+    """
+    if not durations:
+        raise ValueError(f"No durations for {step}")
+    if len(durations) == 1:
+        # statistics.quantiles needs at least 2 durations
+        return LatencyReport(step, durations[0], durations[0], durations[0], durations[0])
+    percentiles = statistics.quantiles(durations, n=100, method="inclusive")
+    return LatencyReport(step, percentiles[49], percentiles[89], percentiles[98],
+                         statistics.fmean(durations))
+
+def print_table(rows: List[Dict]):
+    if not rows:
+        return
+    columns = list(rows[0].keys())
+    cells = [[c for c in columns]] + [
+        [f"{row[c]:.3f}" if isinstance(row[c], float) else str(row[c]) for c in columns]
+        for row in rows
+    ]
+    widths = [max(len(r[i]) for r in cells) for i in range(len(columns))]
+    for row in cells:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)))
+    print()
@@ -0,0 +1,466 @@
+"""Benchmarks of the scrapping code, on a synthetic corpus
+
+Reports, for the same generated corpus:
+    - the latency percentiles of each extraction step (parsing and find_*)
+    - the pages/sec and peak memory of the whole scrapping, for each
+      combination of parser backend, engine and number of workers
+
+Everything runs offline, and the corpus only depends on its size and seed,
+so two runs (or two branches) can be compared.
+
+With --startup, measures instead the cold start of each `bdmv` command.
+With --memory, measures instead the memory taken by the scraped cities kept
+for the csv (France has about 35k cities): with the records as they were
+before (unslotted, with a normalized copy of the scores), as parsed now,
+and with their nearby cities shared by a `NearbyCityRegistry`.
+With --check, checks instead the scrapping results on the corpus (and exits
+with an error when one is wrong): the broken pages are quarantined, a page
+only mentioning the scores block in its stylesheet is malformed, several
+workers write the same files as one, the pages are read lazily, the
+similar cities query accepts the cities that are not indexed, and the
+removed cities are deleted from a --delta output.
+
+Usage:
+    python -m bdmv.benchmark --pages 1000 --parsers html.parser lxml --workers 1 4
+    python -m bdmv.benchmark --startup [--runs 10]
+    python -m bdmv.benchmark --memory [--cities 35000] [--nearby 15]
+    python -m bdmv.benchmark --check [--pages 300]
+"""
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from itertools import product
+import json
+import multiprocessing
+from pathlib import Path
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, List, Optional
+import zlib
+
+from bdmv.bench_report import LatencyReport, latency_report, print_table
+from bdmv.outputs import JsonOutput, read_city_infos
+from bdmv.scraping import (DEFAULT_PARSER, ENGINES, PARSERS, PENDING_CHUNKS_PER_WORKER, CityInformation,
+                           NearbyCity, NearbyCityRegistry, Scores, find_city, find_nearby_cities,
+                           find_postal_code, find_scores, get_file_content, load_soup,
+                           scrape_city_files, scrape_stored_pages, to_website_url)
+from bdmv.stream_extract import scan_city_page
+from bdmv.synthetic import SCORED_RATIO, generate_cities, render_broken_pages, write_corpus
+from bdmv.triage import MALFORMED, QUARANTINE_FILENAME, Quarantine, classify_page
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+@dataclass
+class RunReport:
+    parser: str
+    targeted: bool
+    engine: str
+    workers: int
+    pages: int
+    seconds: float
+    pages_per_sec: float
+    peak_rss_mb: Optional[float]
+
+@dataclass
+class StartupReport:
+    command: str
+    best_ms: float
+    median_ms: float
+    heavy_imports: str
+
+@dataclass
+class MemoryReport:
+    layout: str
+    cities: int
+    # The NearbyCity objects kept alive, one per reference unless shared
+    nearby_city_objects: int
+    peak_rss_growth_mb: Optional[float]
+    bytes_per_city: Optional[float]
+
+# The layouts of the cities measured by bench_memory
+MEMORY_LAYOUTS = ("before", "as parsed", "shared")
+
+# The records of the scraped cities as they were before being slotted, kept
+# here as the baseline of bench_memory
+
+@dataclass
+class LegacyScores:
+    security: float = -1.0
+    education: float = -1.0
+    hobbies: float = -1.0
+    environment: float = -1.0
+    practicality: float = -1.0
+
+    def normalize(self, max: float = 5.0) -> "LegacyScores":
+        return LegacyScores(self.security / max, self.education / max, self.hobbies / max,
+                            self.environment / max, self.practicality / max)
+
+@dataclass
+class LegacyNearbyCity:
+    url: str
+    name: str
+    contains_scores: bool
+
+@dataclass
+class LegacyCityInformation:
+    url: str
+    title: str
+    name: str
+    postal_code: str
+    insee_code: str
+    contains_scores: bool
+    scores: LegacyScores
+    normalized_scores: LegacyScores
+    nearby_cities: List[LegacyNearbyCity]
+
+# The dependencies that each take from tens to hundreds of milliseconds to import
+HEAVY_MODULES = ("requests", "bs4", "numpy", "pandas", "pyarrow")
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident memory of this process and of its finished children
+    """
+    if resource is None:
+        return None
+    usage = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+             + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Kilobytes on Linux, bytes on macOS
+    return usage / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+def measure_latencies(step: str, func: Callable, inputs: List) -> LatencyReport:
+    durations = []
+    for item in inputs:
+        start = time.perf_counter()
+        func(item)
+        durations.append((time.perf_counter() - start) * 1000)
+    return latency_report(step, durations)
+
+def bench_extractors(paths: List[Path], parsers: List[str]) -> List[LatencyReport]:
+    htmls = [get_file_content(p) for p in paths]
+    reports = [measure_latencies("read file", get_file_content, paths)]
+    for parser, targeted in product(parsers, (False, True)):
+        label = f"load_soup[{parser}{', targeted' if targeted else ''}]"
+        reports.append(measure_latencies(label, lambda h: load_soup(h, parser, targeted), htmls))
+
+    soups = [load_soup(h, DEFAULT_PARSER) for h in htmls]
+    for func in (find_city, find_postal_code, find_scores, find_nearby_cities):
+        reports.append(measure_latencies(func.__name__, func, soups))
+    reports.append(measure_latencies("scan_city_page", scan_city_page, htmls))
+    return reports
+
+def bench_run(paths: List[Path], parser: str, targeted: bool, engine: str, workers: int) -> RunReport:
+    """Meant to run in a fresh process, so that the peak memory is its own
+    """
+    start = time.perf_counter()
+    count = sum(1 for _ in scrape_city_files(paths, workers, parser=parser,
+                                             targeted=targeted, engine=engine))
+    seconds = time.perf_counter() - start
+    return RunReport(parser, targeted, engine, workers, count, seconds, count / seconds, peak_rss_mb())
+
+def bench_memory(city_count: int, nearby_count: int, layout: str, seed: int = 0) -> MemoryReport:
+    """Keeps `city_count` cities with `nearby_count` nearby cities each, built
+    from new strings like the parsed pages are, in one of `MEMORY_LAYOUTS`:
+    the records from before they were slotted, the records as parsed, or
+    their nearby cities shared through a `NearbyCityRegistry` like the json
+    output does. Meant to run in a fresh process, so that the peak memory is
+    its own.
+    """
+    cities = generate_cities(city_count, seed)
+    rnd = random.Random(seed)
+    registry = NearbyCityRegistry()
+    legacy = layout == "before"
+    start_mb = peak_rss_mb()
+    infos = []
+    for city in cities:
+        nearby_cities = []
+        for nearby in rnd.sample(cities, min(nearby_count, len(cities))):
+            # A neighbour is scored or not whatever the page listing it
+            scored = zlib.crc32(nearby.title.encode("utf-8")) % 100 < SCORED_RATIO * 100
+            # encode/decode gives new strings, as each parsed page does
+            nearby_cities.append((LegacyNearbyCity if legacy else NearbyCity)(
+                to_website_url(nearby.title).encode().decode(), nearby.name.encode().decode(), scored))
+        scores = [rnd.uniform(1, 5) for _ in range(5)]
+        if legacy:
+            info = LegacyCityInformation(to_website_url(city.title), city.title, city.name,
+                                         city.postal_code, city.insee_code, True,
+                                         LegacyScores(*scores), LegacyScores(*scores).normalize(),
+                                         nearby_cities)
+        else:
+            info = CityInformation(to_website_url(city.title), city.title, city.name, city.postal_code,
+                                   city.insee_code, True, Scores(*scores), nearby_cities)
+        infos.append(registry.intern(info) if layout == "shared" else info)
+    end_mb = peak_rss_mb()
+    growth_mb = None if start_mb is None else end_mb - start_mb
+    return MemoryReport(layout, len(infos), len({id(n) for info in infos for n in info.nearby_cities}),
+                        growth_mb, None if growth_mb is None else growth_mb * 1024 * 1024 / len(infos))
+
+def bench_startup(runs: int) -> List[StartupReport]:
+    """Time of a new interpreter running `bdmv <command> --help`, which
+    imports everything a command needs before it starts working (the
+    dependencies of its options are imported when they are given)
+    """
+    # Imported here, so the module is not already loaded by this process
+    from bdmv.cli import COMMANDS
+    reports = []
+    for command in ("", *COMMANDS):
+        # The first line is the interpreter alone, for reference
+        args = ["bdmv", command, "--help"] if command else ["pass"]
+        argv = [sys.executable, "-m", *args] if command else [sys.executable, "-c", "pass"]
+        durations = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            subprocess.run(argv, stdout=subprocess.DEVNULL, check=True)
+            durations.append((time.perf_counter() - start) * 1000)
+        # -X importtime lists every imported module on stderr, with its nesting
+        lines = subprocess.run([sys.executable, "-X", "importtime", *argv[1:]], stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE, text=True, check=True).stderr.splitlines()
+        imported = {line.rsplit("|", 1)[-1].strip() for line in lines}
+        heavy = [module for module in HEAVY_MODULES if module in imported]
+        reports.append(StartupReport(" ".join(args[:2]) if command else "python -c pass",
+                                     min(durations), statistics.median(durations),
+                                     ", ".join(heavy) or "-"))
+    return reports
+
+# ==== Checks ====
+
+def check_broken_pages(paths: List[Path], seed: int) -> List[str]:
+    """With a quarantine, the broken pages of the corpus are set aside, with
+    both engines, and the run goes on with the other pages. Returns the
+    problems found.
+    """
+    broken_titles = set(render_broken_pages(seed))
+    problems = []
+    for engine in ENGINES:
+        quarantine = Quarantine()
+        try:
+            scraped = [info.title for info in scrape_city_files(paths, engine=engine, quarantine=quarantine)
+                       if info is not None]
+        except Exception as e:
+            problems.append(f"{engine}: the run stopped on {type(e).__name__}: {e}")
+            continue
+        quarantined = {page.title for page in quarantine.pages}
+        if quarantined != broken_titles:
+            problems.append(f"{engine}: quarantined {sorted(quarantined)}, expected {sorted(broken_titles)}")
+        if len(scraped) != len(paths) - len(broken_titles):
+            problems.append(f"{engine}: {len(scraped)} pages scraped out of {len(paths) - len(broken_titles)}")
+    return problems
+
+def check_stylesheet_marker(paths: List[Path], seed: int) -> List[str]:
+    """The page without scores block still has the class in its stylesheet,
+    it must be classified as malformed and not as a scored page. Returns
+    the problems found.
+    """
+    html = render_broken_pages(seed)["sans-bloc-99001"]
+    if ".bloc_notemoyenne" not in html:
+        return ["the broken page has no stylesheet mentioning the scores block"]
+    page_class = classify_page(html)
+    return [] if page_class == MALFORMED else [f"classified as {page_class}"]
+
+def check_parallel_outputs(paths: List[Path], seed: int) -> List[str]:
+    """With 2 workers, the json files, the csv and the quarantine are the
+    same as with one, byte for byte, with both engines. Returns the problems
+    found.
+    """
+    problems = []
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        for engine in ENGINES:
+            outputs = []
+            for workers in (1, 2):
+                output_path = Path(tmp_folder) / f"{engine}-{workers}"
+                quarantine = Quarantine()
+                with JsonOutput(output_path) as output:
+                    for info in scrape_city_files(paths, workers, engine=engine, quarantine=quarantine):
+                        if info is not None:
+                            output.write(info)
+                quarantine.save(output_path / QUARANTINE_FILENAME)
+                outputs.append({path.name: path.read_bytes() for path in output_path.iterdir()})
+            serial, parallel = outputs
+            different = sorted(name for name in serial.keys() | parallel.keys()
+                               if serial.get(name) != parallel.get(name))
+            if different:
+                problems.append(f"{engine}: {len(different)} of {len(serial)} files differ "
+                                f"with 2 workers, like {different[0]}")
+    return problems
+
+def check_lazy_input(paths: List[Path], seed: int) -> List[str]:
+    """The pages given to the scrapping (like the ones read from a page
+    store) are read as they are needed, with 1 and 2 workers: at most a few
+    chunks ahead of the results. Returns the problems found.
+    """
+    problems = []
+    chunksize = 4
+    for workers in (1, 2):
+        read_count = 0
+        def read_pages():
+            nonlocal read_count
+            for path in paths:
+                read_count += 1
+                yield path.stem, get_file_content(path)
+
+        results = scrape_stored_pages(read_pages(), len(paths), workers, chunksize, quarantine=Quarantine())
+        next(results)
+        read_before_first = read_count
+        scraped = 1 + sum(1 for _ in results)
+        max_read = workers * PENDING_CHUNKS_PER_WORKER * chunksize if workers > 1 else 1
+        if read_before_first > max_read:
+            problems.append(f"{workers} workers: {read_before_first} pages read before the first result, "
+                            f"{max_read} at most")
+        if scraped != len(paths):
+            problems.append(f"{workers} workers: {scraped} results for {len(paths)} pages")
+    return problems
+
+def check_similar_query(paths: List[Path], seed: int) -> List[str]:
+    """`python -m bdmv.similar query` answers for a scored city, and says
+    that an unscored and an unknown city are not indexed. Returns the
+    problems found.
+    """
+    # Imported here, NumPy is only needed by this check
+    from bdmv.similar import SimilarCityIndex
+    infos = [info for info in scrape_city_files(paths, quarantine=Quarantine()) if info is not None]
+    scored = next(info.insee_code for info in infos if info.contains_scores)
+    unscored = next(info.insee_code for info in infos if not info.contains_scores)
+    unknown = "99999"
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        index_path = Path(tmp_folder) / "index.npz"
+        SimilarCityIndex.from_city_infos(infos).save(index_path)
+        process = subprocess.run([sys.executable, "-m", "bdmv.similar", "query", str(index_path),
+                                  scored, unscored, unknown, "-k", "3"], capture_output=True, text=True)
+    if process.returncode != 0:
+        return [f"The query failed: {process.stderr.strip().splitlines()[-1:]}"]
+    lines = process.stdout.splitlines()
+    problems = []
+    if len(lines) != 3:
+        return [f"{len(lines)} lines for 3 cities"]
+    if "not indexed" in lines[0] or lines[0].count("(") != 3:
+        problems.append(f"Scored city: {lines[0]}")
+    for code, line in zip((unscored, unknown), lines[1:]):
+        if not line.startswith(code) or "not indexed" not in line:
+            problems.append(f"Not indexed city: {line}")
+    return problems
+
+def check_delta_removed(paths: List[Path], seed: int) -> List[str]:
+    """A city missing from the next --delta run is no longer read from the
+    output folder. Returns the problems found.
+    """
+    # Imported here, NumPy is only needed by this check
+    from bdmv.snapshots import DeltaOutput
+    infos = [info for info in scrape_city_files(paths, quarantine=Quarantine()) if info is not None]
+    removed = infos[len(infos) // 2]
+    problems = []
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        output_path = Path(tmp_folder)
+        for run_infos in (infos, [info for info in infos if info is not removed]):
+            with DeltaOutput(output_path) as output:
+                for info in run_infos:
+                    output.write(info)
+        if output.counts["removed"] != 1:
+            problems.append(output.summary())
+        titles = {info.title for info in read_city_infos(output_path)}
+        if removed.title in titles:
+            problems.append(f"{removed.title} was removed, but is still read from the output")
+        if len(titles) != len(infos) - 1:
+            problems.append(f"{len(titles)} cities read from the output, {len(infos) - 1} expected")
+    return problems
+
+def run_checks(paths: List[Path], seed: int) -> bool:
+    """Prints the outcome of each check, returns whether they all passed
+    """
+    passed = True
+    for name, check in (("broken pages are quarantined", check_broken_pages),
+                        ("the scores class in a stylesheet is malformed", check_stylesheet_marker),
+                        ("2 workers write the same files as 1", check_parallel_outputs),
+                        ("the pages are read lazily", check_lazy_input),
+                        ("similar query of cities not indexed", check_similar_query),
+                        ("removed cities leave a --delta output", check_delta_removed)):
+        problems = check(paths, seed)
+        print(f"{'ok' if not problems else 'FAILED'}  {name}")
+        for problem in problems:
+            print(f"    {problem}")
+        passed = passed and not problems
+    return passed
+
+def main():
+    parser = ArgumentParser("benchmark")
+    parser.add_argument("--pages", type=int, default=500, help="The size of the synthetic corpus")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus", help="Where the corpus is written (a temporary folder by default)")
+    parser.add_argument("--parsers", nargs="+", choices=PARSERS, default=[DEFAULT_PARSER])
+    parser.add_argument("--engines", nargs="+", choices=ENGINES, default=list(ENGINES))
+    parser.add_argument("--workers", nargs="+", type=int, default=[1])
+    parser.add_argument("--targeted", action="store_true",
+                        help="Also run the whole scrapping with targeted parsing")
+    parser.add_argument("--json", help="Write the reports in this json file")
+    parser.add_argument("--check", action="store_true",
+                        help="Only check the scrapping results on the corpus (with a few broken pages added)")
+    parser.add_argument("--startup", action="store_true",
+                        help="Only measure the cold start of each bdmv command")
+    parser.add_argument("--runs", type=int, default=10,
+                        help="With --startup, the number of runs of each command")
+    parser.add_argument("--memory", action="store_true",
+                        help="Only measure the memory taken by the scraped cities")
+    parser.add_argument("--cities", type=int, default=35_000,
+                        help="With --memory, the number of cities")
+    parser.add_argument("--nearby", type=int, default=15,
+                        help="With --memory, the number of nearby cities of each city")
+    args = parser.parse_args()
+
+    if args.memory:
+        spawn = multiprocessing.get_context("spawn")
+        memory = []
+        for layout in MEMORY_LAYOUTS:
+            with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+                memory.append(executor.submit(bench_memory, args.cities, args.nearby, layout, args.seed).result())
+        print_table([asdict(r) for r in memory])
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as file:
+                json.dump({"memory": [asdict(r) for r in memory]}, file, indent=2)
+        return
+
+    if args.startup:
+        startups = bench_startup(args.runs)
+        print_table([asdict(r) for r in startups])
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as file:
+                json.dump({"startup": [asdict(r) for r in startups]}, file, indent=2)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_folder:
+        corpus_path = Path(args.corpus) if args.corpus else Path(tmp_folder)
+        paths = sorted(write_corpus(corpus_path, args.pages, args.seed, broken=args.check))
+        print(f"Corpus of {len(paths)} pages (seed {args.seed})\n")
+        if args.check:
+            if not run_checks(paths, args.seed):
+                sys.exit(1)
+            return
+
+        latencies = bench_extractors(paths, args.parsers)
+        print_table([asdict(r) for r in latencies])
+
+        runs = []
+        spawn = multiprocessing.get_context("spawn")
+        for parser_name, targeted, engine, workers in product(
+                args.parsers, (False, True) if args.targeted else (False,), args.engines, args.workers):
+            with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+                future = executor.submit(bench_run, paths, parser_name, targeted, engine, workers)
+                runs.append(future.result())
+        print_table([asdict(r) for r in runs])
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump({
+                "pages": args.pages,
+                "seed": args.seed,
+                "latencies": [asdict(r) for r in latencies],
+                "runs": [asdict(r) for r in runs],
+            }, file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Indexed city database, built from the output of a scrape
+
+The json of each city is kept as is in a single SQLite file, indexed by
+INSEE code, title and postal code, so a city is found without loading the
+"!scores.csv" or opening thousands of files. The json is returned as text:
+it can be sent as is by `bdmv.service`.
+"""
+
+import json
+from pathlib import Path
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from bdmv.scraping import CityInformation
+
+CITY_DB_FILENAME = "!cities.sqlite"
+
+# Maximum number of parameters of a single query, SQLite allows 999 in older versions
+IN_BATCH_SIZE = 500
+
+class CityDatabase:
+    """Read only once built. Each thread has its own connection, so it can
+    be shared by the threads of a server.
+    """
+    def __init__(self, path: Path):
+        if not path.exists():
+            raise FileNotFoundError(f"No city database at {path}")
+        self.path = path
+        self._local = threading.local()
+
+    @classmethod
+    def build(cls, path: Path, infos: Iterable[CityInformation]) -> "CityDatabase":
+        """Replaces the database at `path` with the given cities
+        """
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.unlink(missing_ok=True)
+        connection = sqlite3.connect(path)
+        connection.executescript("""
+            CREATE TABLE cities (
+                insee_code TEXT PRIMARY KEY,
+                title TEXT NOT NULL,
+                postal_code TEXT NOT NULL,
+                data TEXT NOT NULL
+            ) WITHOUT ROWID;
+        """)
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO cities VALUES (?, ?, ?, ?)",
+                ((info.insee_code, info.title, info.postal_code, json.dumps(info.to_json()))
+                 for info in infos)
+            )
+        # Built after the inserts, it is faster than keeping them up to date
+        connection.executescript("""
+            CREATE UNIQUE INDEX cities_title ON cities (title);
+            CREATE INDEX cities_postal_code ON cities (postal_code);
+        """)
+        connection.close()
+        return cls(path)
+
+    @property
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True,
+                                         check_same_thread=False)
+            self._local.connection = connection
+        return connection
+
+    def __len__(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM cities").fetchone()[0]
+
+    def keys(self) -> List[Tuple[str, str, str]]:
+        """The INSEE code, title and postal code of every city
+        """
+        return self._connection.execute("SELECT insee_code, title, postal_code FROM cities").fetchall()
+
+    def get(self, insee_code: str) -> Optional[str]:
+        """The json of a city, by INSEE code
+        """
+        row = self._connection.execute(
+            "SELECT data FROM cities WHERE insee_code = ?", (insee_code,)).fetchone()
+        return None if row is None else row[0]
+
+    def get_many(self, insee_codes: Sequence[str]) -> Dict[str, str]:
+        """The json of the cities that were found, by INSEE code
+        """
+        found: Dict[str, str] = {}
+        for start in range(0, len(insee_codes), IN_BATCH_SIZE):
+            batch = insee_codes[start:start + IN_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            found.update(self._connection.execute(
+                f"SELECT insee_code, data FROM cities WHERE insee_code IN ({placeholders})", batch))
+        return found
+
+    def insee_code_of_title(self, title: str) -> Optional[str]:
+        row = self._connection.execute(
+            "SELECT insee_code FROM cities WHERE title = ?", (title,)).fetchone()
+        return None if row is None else row[0]
+
+    def insee_codes_of_postal_code(self, postal_code: str) -> List[str]:
+        """Several cities can share a postal code
+        """
+        return [code for code, in self._connection.execute(
+            "SELECT insee_code FROM cities WHERE postal_code = ? ORDER BY insee_code", (postal_code,))]
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
@@ -0,0 +1,59 @@
+"""The `bdmv` command, with a subcommand per step of the scrapping
+
+Only the module of the subcommand that is run is imported, and each one
+imports its heavy dependencies (requests, bs4, pandas, NumPy, pyarrow) only
+when they are needed, so a command starts quickly enough to be called from
+cron or a shell loop. `python -m bdmv.benchmark --startup` measures it.
+
+Usage:
+    bdmv sitemap [--list]
+    bdmv download <output folder> [--from-folders <wget folder>] [--scrape <output folder>]
+    bdmv crawl <output folder> [--scrape <output folder>]
+    bdmv scrape <html folder, page store or page> [<output folder>]
+    bdmv export <output folder> <scrape output folder>... [--format parquet]
+"""
+
+from argparse import ArgumentParser
+import importlib
+import os
+import sys
+from typing import List, Optional
+
+# Command -> help, the code of each command is in bdmv/commands/<command>.py
+COMMANDS = {
+    "sitemap": "Count or list the cities of the sitemap",
+    "download": "Download the pages of the cities, and optionally scrape them",
+    "crawl": "Download the pages from the sitemap and the nearby cities of each page",
+    "scrape": "Scrape downloaded pages (or print the data of a single page)",
+    "export": "Convert or merge scrape outputs, and build the indexes on them",
+}
+
+def print_usage():
+    print("usage: bdmv <command> [options]\n\ncommands:")
+    for command, help in COMMANDS.items():
+        print(f"  {command:<10}{help}")
+    print("\nSee bdmv <command> --help for the options of a command")
+
+def main(argv: Optional[List[str]] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ("-h", "--help"):
+        print_usage()
+        return
+    command, *arguments = argv
+    if command not in COMMANDS:
+        print_usage()
+        sys.exit(f"\nbdmv: unknown command {command}")
+
+    module = importlib.import_module(f"bdmv.commands.{command}")
+    parser = ArgumentParser(f"bdmv {command}", description=COMMANDS[command])
+    module.add_arguments(parser)
+    try:
+        module.run(parser.parse_args(arguments), parser)
+    except BrokenPipeError:
+        # The output was piped to a command that stopped reading (like head),
+        # stdout is closed quietly instead of printing a traceback
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
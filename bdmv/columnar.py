@@ -0,0 +1,131 @@
+"""Columnar export of the scrapping results, as Parquet files
+
+The cities are written in a first table (one column per score), and the
+nearby cities relations in a second one, as edges between INSEE codes.
+Rows are buffered and written by row groups, so the whole corpus is never
+kept in memory.
+
+`pyarrow` is needed for this export, it is not installed by default.
+"""
+
+from pathlib import Path
+from typing import Dict, Iterator, List
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from bdmv.outputs import DEFAULT_ROW_GROUP_SIZE
+from bdmv.scraping import CityInformation, NearbyCity, Scores, insee_code_from_url
+
+CITIES_FILENAME = "!cities.parquet"
+NEARBY_CITIES_FILENAME = "!nearby_cities.parquet"
+
+SCORE_FIELDS = ("security", "education", "hobbies", "environment", "practicality")
+
+CITIES_SCHEMA = pa.schema(
+    [
+        ("insee_code", pa.string()),
+        ("title", pa.string()),
+        ("name", pa.string()),
+        ("url", pa.string()),
+        ("postal_code", pa.string()),
+        ("contains_scores", pa.bool_()),
+    ]
+    + [(f"score_{f}", pa.float64()) for f in SCORE_FIELDS]
+    + [(f"normalized_score_{f}", pa.float64()) for f in SCORE_FIELDS]
+)
+
+NEARBY_CITIES_SCHEMA = pa.schema([
+    ("insee_code", pa.string()),
+    ("nearby_insee_code", pa.string()),
+    ("nearby_name", pa.string()),
+    ("nearby_url", pa.string()),
+    ("nearby_contains_scores", pa.bool_()),
+])
+
+class _TableWriter:
+    def __init__(self, path: Path, schema: pa.Schema, row_group_size: int):
+        self.schema = schema
+        self.row_group_size = row_group_size
+        self.columns: Dict[str, List] = {name: [] for name in schema.names}
+        self.row_count = 0
+        self._writer = pq.ParquetWriter(path, schema)
+        
+    def append(self, row: tuple):
+        for column, value in zip(self.columns.values(), row):
+            column.append(value)
+        self.row_count += 1
+        if len(self.columns[self.schema.names[0]]) >= self.row_group_size:
+            self.flush()
+    
+    def flush(self):
+        if not self.columns[self.schema.names[0]]:
+            return
+        batch = pa.record_batch(list(self.columns.values()), schema=self.schema)
+        self._writer.write_batch(batch)
+        for column in self.columns.values():
+            column.clear()
+    
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+class ColumnarWriter:
+    """Writes the cities and the nearby cities edges in the output folder
+    """
+    def __init__(self, output_folder_path: Path, row_group_size: int = DEFAULT_ROW_GROUP_SIZE):
+        output_folder_path.mkdir(parents=True, exist_ok=True)
+        self.cities = _TableWriter(output_folder_path / CITIES_FILENAME, 
+                                   CITIES_SCHEMA, row_group_size)
+        self.nearby_cities = _TableWriter(output_folder_path / NEARBY_CITIES_FILENAME, 
+                                          NEARBY_CITIES_SCHEMA, row_group_size)
+    
+    def write(self, info: CityInformation):
+        scores = info.scores
+        normalized = info.normalized_scores
+        self.cities.append((
+            info.insee_code,
+            info.title,
+            info.name,
+            info.url,
+            info.postal_code,
+            info.contains_scores,
+            *(getattr(scores, f) for f in SCORE_FIELDS),
+            *(getattr(normalized, f) for f in SCORE_FIELDS),
+        ))
+        for nearby in info.nearby_cities:
+            self.nearby_cities.append((
+                info.insee_code,
+                insee_code_from_url(nearby.url),
+                nearby.name,
+                nearby.url,
+                nearby.contains_scores,
+            ))
+    
+    def close(self):
+        self.cities.close()
+        self.nearby_cities.close()
+        
+    def __enter__(self) -> "ColumnarWriter":
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+def read_city_infos(output_folder_path: Path) -> Iterator[CityInformation]:
+    """Reads back the cities written by `ColumnarWriter`, one row group at a time
+    """
+    nearby_by_city: Dict[str, List[NearbyCity]] = {}
+    edges = pq.read_table(output_folder_path / NEARBY_CITIES_FILENAME,
+                          columns=["insee_code", "nearby_url", "nearby_name", "nearby_contains_scores"])
+    for insee_code, url, name, contains_scores in zip(*(c.to_pylist() for c in edges.columns)):
+        nearby_by_city.setdefault(insee_code, []).append(NearbyCity(url, name, contains_scores))
+    
+    cities = pq.ParquetFile(output_folder_path / CITIES_FILENAME)
+    for batch in cities.iter_batches(columns=["url", "title", "name", "postal_code", "insee_code",
+                                              "contains_scores", *(f"score_{f}" for f in SCORE_FIELDS)]):
+        for row in batch.to_pylist():
+            yield CityInformation(row["url"], row["title"], row["name"], row["postal_code"],
+                                  row["insee_code"], row["contains_scores"],
+                                  Scores(*(row[f"score_{f}"] for f in SCORE_FIELDS)),
+                                  nearby_by_city.pop(row["insee_code"], []))
@@ -0,0 +1,4 @@
+"""The subcommands of `bdmv` (see `bdmv.cli`)
+
+Each module has an `add_arguments(parser)` and a `run(args, parser)`.
+"""
@@ -0,0 +1,105 @@
+"""`bdmv crawl`: download all the "avis.html" pages, starting from the
+sitemap and following the nearby cities of each page, so the cities missing
+from the sitemap are found too (no need for a wget spider).
+
+The crawl can be stopped and started again, it resumes where it was.
+"""
+
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+
+from tqdm import tqdm
+
+from bdmv.download import DEFAULT_MAX_IN_FLIGHT, DEFAULT_PER_HOST
+from bdmv.fetch import DEFAULT_POOL_SIZE, FetchSession
+from bdmv.frontier import DONE, FAILED, QUEUED, Frontier, crawl
+from bdmv.manifest import CrawlManifest
+from bdmv.metrics import DISABLED, METRICS_REFRESH_EVERY, Metrics
+from bdmv.outputs import DEFAULT_ROW_GROUP_SIZE, OUTPUT_FORMATS, open_output
+from bdmv.page_store import PageStore
+from bdmv.pipeline import DEFAULT_QUEUE_SIZE
+from bdmv.rate_control import DEFAULT_MAX_RETRIES, AdaptiveConcurrency, RetryPolicy
+from bdmv.sitemap import AVIS_SITEMAP_PATH, AVIS_URL_PATTERN, iter_sitemap_urls
+from bdmv.triage import QUARANTINE_FILENAME, Quarantine
+
+def add_arguments(parser: ArgumentParser):
+    parser.add_argument("output_path", help="The folder where the pages and the frontier will go")
+    parser.add_argument("--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT,
+                        help="The maximum number of requests running at the same time")
+    parser.add_argument("--per-host", type=int, default=DEFAULT_PER_HOST,
+                        help="The maximum number of requests running at the same time on one host")
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE,
+                        help="The number of connections kept alive")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Adapt the number of requests in flight (up to --max-in-flight) to the website errors")
+    parser.add_argument("--max-retries", type=int, default=DEFAULT_MAX_RETRIES,
+                        help="The number of retries of a page throttled by the website (429, 5xx, timeout)")
+    parser.add_argument("--store", action="store_true",
+                        help="Pack the pages in a single archive instead of one html file per city")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="The number of processes parsing pages")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="The maximum number of downloaded pages waiting to be parsed")
+    parser.add_argument("--max-depth", type=int,
+                        help="Do not follow links further than this number of pages from the sitemap")
+    parser.add_argument("--scrape", metavar="OUTPUT_PATH",
+                        help="Also write the scrapping results in this folder")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="json",
+                        help="With --scrape, the format of the results")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="Time each stage, show the rates in the progress bar and write a json report here")
+
+def run(args: Namespace, parser: ArgumentParser):
+    output_path = Path(args.output_path)
+    scrape_path = Path(args.scrape) if args.scrape else None
+    metrics_path = Path(args.metrics) if args.metrics else None
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    frontier = Frontier.in_folder(output_path)
+    seeded = frontier.add_all(iter_sitemap_urls(AVIS_SITEMAP_PATH, AVIS_URL_PATTERN))
+    print(f"{seeded} new cities from the sitemap, {frontier.count(QUEUED)} cities to visit")
+
+    manifest = CrawlManifest.in_folder(output_path)
+    store = PageStore.in_folder(output_path) if args.store else None
+    metrics = Metrics() if metrics_path else DISABLED
+    quarantine = Quarantine()
+    output = None
+    if scrape_path is not None:
+        output = open_output(scrape_path, args.format, DEFAULT_ROW_GROUP_SIZE, sort_by_title=True)
+
+    concurrency = AdaptiveConcurrency(args.max_in_flight) if args.adaptive else None
+    with FetchSession(args.pool_size) as session:
+        results = crawl(session, frontier, output_path, args.max_in_flight, args.per_host,
+                        manifest, store, args.workers, args.queue_size, args.max_depth,
+                        concurrency=concurrency, retry=RetryPolicy(args.max_retries),
+                        metrics=metrics, quarantine=quarantine, engine="stream")
+        with tqdm(unit="page") as pbar:
+            for result, city_info in results:
+                pbar.set_description(f"Crawl url \"{result.url}\"")
+                pbar.update()
+                pbar.total = len(frontier)
+                if metrics.enabled and pbar.n % METRICS_REFRESH_EVERY == 0:
+                    pbar.set_postfix(metrics.postfix(), refresh=False)
+                if not result.ok:
+                    print(f"An error happened on url {result.url} : {result.error or result.status_code}")
+                if city_info is not None:
+                    quarantine.count(city_info)
+                if output is not None and city_info is not None:
+                    with metrics.stage("write"):
+                        output.write(city_info)
+        print(session.stats.summary())
+        if concurrency is not None:
+            print(concurrency.summary())
+
+    print(f"{len(frontier)} cities found, {frontier.count(DONE)} downloaded, {frontier.count(FAILED)} failed")
+    print(quarantine.summary())
+    # Next to the scraped cities when there are some, like `bdmv download --scrape`
+    quarantine.save((scrape_path or output_path) / QUARANTINE_FILENAME)
+    if output is not None:
+        with metrics.stage("close_output"):
+            output.close()
+    metrics.write_report(metrics_path)
+    frontier.close()
+    manifest.close()
+    if store is not None:
+        store.close()
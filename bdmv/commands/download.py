@@ -0,0 +1,154 @@
+"""`bdmv download`: download all the "avis.html" pages
+
+The cities come from the sitemap (which misses some of them, see `bdmv
+crawl`), or from the folders of a wget spider run with --from-folders.
+With --scrape, the pages are also scraped while they are downloaded, so
+the parsing overlaps with the network.
+"""
+
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from typing import Iterator, Tuple
+
+from tqdm import tqdm
+
+from bdmv.download import DEFAULT_MAX_IN_FLIGHT, DEFAULT_PER_HOST, download_pages
+from bdmv.fetch import (DEFAULT_CONNECT_TIMEOUT, DEFAULT_POOL_SIZE, DEFAULT_READ_TIMEOUT,
+                        FetchSession)
+from bdmv.manifest import CrawlManifest
+from bdmv.metrics import DISABLED, METRICS_REFRESH_EVERY, Metrics
+from bdmv.outputs import DEFAULT_ROW_GROUP_SIZE, OUTPUT_FORMATS, open_output
+from bdmv.page_store import PageStore
+from bdmv.pipeline import DEFAULT_QUEUE_SIZE, scrape_downloads
+from bdmv.rate_control import DEFAULT_MAX_RETRIES, AdaptiveConcurrency, RetryPolicy
+from bdmv.scraping import DEFAULT_ENGINE, ENGINES, to_website_url
+from bdmv.sharding import in_shard, parse_shard
+from bdmv.sitemap import AVIS_SITEMAP_PATH, AVIS_URL_PATTERN, iter_sitemap_urls
+from bdmv.triage import QUARANTINE_FILENAME, Quarantine
+
+def add_arguments(parser: ArgumentParser):
+    parser.add_argument("output_path", help="The folder where the pages will go")
+    parser.add_argument("--from-folders", metavar="WGET_FOLDER",
+                        help="Download the cities of the folders made by wget --spider, instead of the sitemap")
+    parser.add_argument("--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT,
+                        help="The maximum number of requests running at the same time")
+    parser.add_argument("--per-host", type=int, default=DEFAULT_PER_HOST,
+                        help="The maximum number of requests running at the same time on one host")
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE,
+                        help="The number of connections kept alive")
+    parser.add_argument("--connect-timeout", type=float, default=DEFAULT_CONNECT_TIMEOUT,
+                        help="The connect timeout of a request, in seconds")
+    parser.add_argument("--read-timeout", type=float, default=DEFAULT_READ_TIMEOUT,
+                        help="The read timeout of a request, in seconds")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Adapt the number of requests in flight (up to --max-in-flight) to the website errors")
+    parser.add_argument("--max-retries", type=int, default=DEFAULT_MAX_RETRIES,
+                        help="The number of retries of a page throttled by the website (429, 5xx, timeout)")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Check again the pages already downloaded, using conditional requests")
+    parser.add_argument("--store", action="store_true",
+                        help="Pack the pages in a single archive instead of one html file per city")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="Time each stage, show the rates in the progress bar and write a json report here")
+    parser.add_argument("--scrape", metavar="OUTPUT_PATH",
+                        help="Also scrape the pages while they are downloaded, the results go in this folder")
+    parser.add_argument("--no-html", action="store_true",
+                        help="With --scrape, do not keep the html of the pages (all pages are then downloaded)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="With --scrape, the number of processes parsing pages")
+    parser.add_argument("--queue-size", type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="With --scrape, the maximum number of downloaded pages waiting to be parsed")
+    parser.add_argument("--engine", choices=ENGINES, default=DEFAULT_ENGINE,
+                        help="With --scrape, how pages are read")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="json",
+                        help="With --scrape, the format of the results")
+    parser.add_argument("--shard", metavar="INDEX/COUNT",
+                        help="Only download the cities of this shard, e.g. 0/4 to 3/4 on 4 machines")
+
+def iter_folder_urls(folder_path: Path) -> Iterator[Tuple[str, str]]:
+    """The (name, url) of the cities of a wget spider run, which made a
+    folder per city
+    """
+    for path in folder_path.iterdir():
+        yield path.name, to_website_url(path.name)
+
+def run(args: Namespace, parser: ArgumentParser):
+    if args.no_html and not args.scrape:
+        parser.error("--no-html needs --scrape")
+    try:
+        shard = parse_shard(args.shard) if args.shard else None
+    except ValueError as e:
+        parser.error(str(e))
+    output_path = Path(args.output_path)
+    scrape_path = Path(args.scrape) if args.scrape else None
+    metrics_path = Path(args.metrics) if args.metrics else None
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # The websites are read lazily, so downloads start with the first city
+    if args.from_folders:
+        websites = iter_folder_urls(Path(args.from_folders))
+    else:
+        websites = iter_sitemap_urls(AVIS_SITEMAP_PATH, AVIS_URL_PATTERN)
+    if shard is not None:
+        websites = in_shard(websites, shard)
+
+    if args.no_html:
+        # Nothing is kept from one run to another, every page is downloaded
+        pages_path, manifest, store = None, None, None
+    else:
+        pages_path = output_path
+        manifest = CrawlManifest.in_folder(output_path)
+        store = PageStore.in_folder(output_path) if args.store else None
+        # When scraping, unchanged pages are still needed: they are checked
+        # with conditional requests and read back from the disk
+        if not args.refresh and scrape_path is None:
+            websites = manifest.pending(websites, output_path, store)
+
+    metrics = Metrics() if metrics_path else DISABLED
+    output = None
+    quarantine = Quarantine()
+    if scrape_path is not None:
+        # Sorted like the page store, the pages arrive in any order
+        output = open_output(scrape_path, args.format, DEFAULT_ROW_GROUP_SIZE, sort_by_title=True)
+
+    concurrency = AdaptiveConcurrency(args.max_in_flight) if args.adaptive else None
+    retry = RetryPolicy(args.max_retries)
+    not_modified_count = 0
+    with FetchSession(args.pool_size, args.connect_timeout, args.read_timeout) as session:
+        results = download_pages(session, websites, pages_path,
+                                 args.max_in_flight, args.per_host, manifest, store, metrics,
+                                 keep_html=output is not None, concurrency=concurrency, retry=retry)
+        if output is None:
+            results = ((result, None) for result in results)
+        else:
+            results = scrape_downloads(results, args.workers, args.queue_size, store, metrics,
+                                       quarantine, engine=args.engine)
+        with tqdm(unit="page") as pbar:
+            for result, city_info in results:
+                pbar.set_description(f"Fetch url \"{result.url}\"")
+                pbar.update()
+                if metrics.enabled and pbar.n % METRICS_REFRESH_EVERY == 0:
+                    pbar.set_postfix(metrics.postfix(), refresh=False)
+                if result.status_code == 304:
+                    not_modified_count += 1
+                if not result.ok:
+                    print(f"An error happened on url {result.url} : {result.error or result.status_code}")
+                if city_info is not None:
+                    quarantine.count(city_info)
+                    with metrics.stage("write"):
+                        output.write(city_info)
+        print(f"{not_modified_count} pages not modified")
+        print(session.stats.summary())
+        if concurrency is not None:
+            print(concurrency.summary())
+
+    if output is not None:
+        print(quarantine.summary())
+        quarantine.save(scrape_path / QUARANTINE_FILENAME)
+        with metrics.stage("close_output"):
+            output.close()
+    metrics.write_report(metrics_path)
+    if manifest is not None:
+        manifest.close()
+    if store is not None:
+        store.close()
@@ -0,0 +1,61 @@
+"""`bdmv export`: write scrape outputs in another format, or merge them
+
+The cities of all the given scrape outputs (in any format) are written once
+to a new output, sorted by title (see `bdmv.sharding` for the duplicates).
+The indexes of the other modules can then be built on the new output.
+"""
+
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+
+from bdmv.outputs import OUTPUT_FORMATS, read_city_infos
+from bdmv.sharding import DUPLICATES_FILENAME, merge_shards
+
+def add_arguments(parser: ArgumentParser):
+    parser.add_argument("output_path", help="The new output folder")
+    parser.add_argument("scrape_output_paths", nargs="+",
+                        help="The scrape output folders, the first one wins for the cities found twice")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="json",
+                        help="The format of the new output")
+    parser.add_argument("--score-table", action="store_true",
+                        help="Also write the scores of all cities in a NumPy array (!scores.npy)")
+    parser.add_argument("--autocomplete", action="store_true",
+                        help="Also write a prefix index of the city names and postal codes (!autocomplete.npz)")
+    parser.add_argument("--similar", action="store_true",
+                        help="Also build the index of the most similar cities (!similar_cities.npz)")
+    parser.add_argument("--sqlite", action="store_true",
+                        help="Also pack the cities in an indexed SQLite file for the query service (!cities.sqlite)")
+
+def run(args: Namespace, parser: ArgumentParser):
+    output_path = Path(args.output_path)
+    scrape_output_paths = [Path(p) for p in args.scrape_output_paths]
+    if output_path in scrape_output_paths:
+        parser.error("The new output must be a new folder")
+
+    city_count, duplicates = merge_shards(scrape_output_paths, output_path, args.format)
+    print(f"{city_count} cities written to {output_path}")
+    if duplicates:
+        conflicts = sum(not d.identical for d in duplicates)
+        print(f"{len(duplicates)} duplicates ({conflicts} different), "
+              f"listed in {output_path / DUPLICATES_FILENAME}")
+
+    # Each index reads the new output again, their modules are only imported when asked
+    if args.score_table:
+        from bdmv.score_table import SCORE_TABLE_FILENAME, ScoreTableBuilder
+        builder = ScoreTableBuilder()
+        for info in read_city_infos(output_path):
+            builder.add(info)
+        builder.build().save(output_path / SCORE_TABLE_FILENAME)
+        print(f"Scores written to {output_path / SCORE_TABLE_FILENAME}")
+    if args.autocomplete:
+        from bdmv.autocomplete import AUTOCOMPLETE_FILENAME, PrefixIndex
+        PrefixIndex.from_city_infos(read_city_infos(output_path)).save(output_path / AUTOCOMPLETE_FILENAME)
+        print(f"Prefix index written to {output_path / AUTOCOMPLETE_FILENAME}")
+    if args.similar:
+        from bdmv.similar import SIMILAR_INDEX_FILENAME, SimilarCityIndex
+        SimilarCityIndex.from_scrape_output(output_path).save(output_path / SIMILAR_INDEX_FILENAME)
+        print(f"Similar cities index written to {output_path / SIMILAR_INDEX_FILENAME}")
+    if args.sqlite:
+        from bdmv.city_db import CITY_DB_FILENAME, CityDatabase
+        CityDatabase.build(output_path / CITY_DB_FILENAME, read_city_infos(output_path)).close()
+        print(f"Database written to {output_path / CITY_DB_FILENAME}")
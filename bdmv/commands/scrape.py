@@ -0,0 +1,184 @@
+"""`bdmv scrape`: get all wanted data from the downloaded html pages
+
+The pages are a folder of html files or a page store. Given a single html
+file instead, its data is printed as json (or written to the output folder
+like the one page of a folder, if one is given).
+"""
+
+from argparse import ArgumentParser, Namespace
+import json
+from pathlib import Path
+from typing import Optional
+
+from tqdm import tqdm
+
+from bdmv.jsonl import DEFAULT_BUFFER_SIZE, DEFAULT_FLUSH_EVERY, DEFAULT_FSYNC, FSYNC_POLICIES
+from bdmv.metrics import DISABLED, METRICS_REFRESH_EVERY, Metrics
+from bdmv.outputs import DEFAULT_ROW_GROUP_SIZE, OUTPUT_FORMATS, open_output
+from bdmv.page_store import PageStore, is_page_store
+from bdmv.parse_cache import DEFAULT_MAX_ENTRIES, ParseCache, content_hash, scrape_with_cache
+from bdmv.scraping import (DEFAULT_ENGINE, DEFAULT_PARSER, ENGINES, PARSERS, scrape_city_file,
+                           scrape_city_files, scrape_stored_pages)
+from bdmv.triage import QUARANTINE_FILENAME, Quarantine
+
+def add_arguments(parser: ArgumentParser):
+    parser.add_argument("input_path", help="The folder containing all html files, a page store file, "
+                                           "or a single html file")
+    parser.add_argument("output_path", nargs="?",
+                        help="The folder where generated content will go (not needed for a single html file)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="The number of processes parsing pages")
+    parser.add_argument("--chunksize", type=int, default=0,
+                        help="The number of pages sent at once to a worker (0 for automatic)")
+    parser.add_argument("--parser", choices=PARSERS, default=DEFAULT_PARSER,
+                        help="The BeautifulSoup parser backend (lxml has to be installed)")
+    parser.add_argument("--targeted", action="store_true",
+                        help="Only parse the parts of the pages containing wanted data")
+    parser.add_argument("--engine", choices=ENGINES, default=DEFAULT_ENGINE,
+                        help="How pages are read, 'stream' falls back to 'soup' on unexpected pages")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="json",
+                        help="'json' writes one file per city and a csv, "
+                             "'parquet' writes a cities table and a nearby cities table (needs pyarrow), "
+                             "'jsonl' writes all the cities in a single file from a background thread")
+    parser.add_argument("--row-group-size", type=int, default=DEFAULT_ROW_GROUP_SIZE,
+                        help="The number of rows of each parquet row group")
+    parser.add_argument("--compress", action="store_true",
+                        help="Compress the jsonl file with gzip")
+    parser.add_argument("--buffer-size", type=int, default=DEFAULT_BUFFER_SIZE,
+                        help="The number of cities waiting to be written to the jsonl file")
+    parser.add_argument("--flush-every", type=int, default=DEFAULT_FLUSH_EVERY,
+                        help="The number of cities between two flushes of the jsonl file")
+    parser.add_argument("--fsync", choices=FSYNC_POLICIES, default=DEFAULT_FSYNC,
+                        help="When the jsonl file is synced to the disk: never, when closed, or at each flush")
+    parser.add_argument("--cache", action="store_true",
+                        help="Reuse the results of the previous runs for the pages that did not change")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_ENTRIES,
+                        help="The maximum number of pages kept in the cache")
+    # The file names are written out, their modules import NumPy
+    parser.add_argument("--score-table", action="store_true",
+                        help="Also write the scores of all cities in a NumPy array (!scores.npy)")
+    parser.add_argument("--autocomplete", action="store_true",
+                        help="Also write a prefix index of the city names and postal codes (!autocomplete.npz)")
+    parser.add_argument("--delta", action="store_true",
+                        help="Only write the cities that changed since the last run, "
+                             "and keep a snapshot and the list of changes in !snapshots")
+    parser.add_argument("--metrics", metavar="PATH",
+                        help="Time each stage, show the rates in the progress bar and write a json report here")
+
+def show_metrics(pbar: tqdm, metrics: Metrics):
+    if metrics.enabled and pbar.n % METRICS_REFRESH_EVERY == 0:
+        pbar.set_postfix(metrics.postfix(), refresh=False)
+
+def close_inputs(store: Optional[PageStore], cache: Optional[ParseCache]):
+    if store is not None:
+        store.close()
+    if cache is not None:
+        print(f"Parse cache : {cache.hits} pages reused, {cache.misses} parsed")
+        cache.close()
+
+def print_page(page_path: Path, parser: str, targeted: bool, engine: str):
+    city_info = scrape_city_file(page_path, parser=parser, targeted=targeted, engine=engine)
+    print(json.dumps(city_info.to_json(), indent=4, ensure_ascii=False))
+
+def run(args: Namespace, parser: ArgumentParser):
+    input_path = Path(args.input_path)
+    single_page = input_path.suffix == ".html"
+    if single_page and args.output_path is None:
+        print_page(input_path, args.parser, args.targeted, args.engine)
+        return
+    if args.output_path is None:
+        parser.error("the output folder is needed to scrape several pages")
+    if not input_path.exists():
+        parser.error(f"{input_path} does not exist")
+    if input_path.is_file() and not single_page and not is_page_store(input_path):
+        parser.error(f"{input_path} is neither an html page nor a page store")
+    if args.delta and args.format != "json":
+        parser.error("--delta only works with the json format")
+    output_path = Path(args.output_path)
+    metrics_path = Path(args.metrics) if args.metrics else None
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    metrics = Metrics() if metrics_path else DISABLED
+    # Pages that can not be scraped are set aside instead of stopping the run
+    quarantine = Quarantine()
+    options = dict(workers=args.workers, chunksize=args.chunksize,
+                   parser=args.parser, targeted=args.targeted, engine=args.engine,
+                   metrics=metrics, quarantine=quarantine)
+    cache = ParseCache.in_folder(output_path, args.cache_size) if args.cache else None
+
+    store = None
+    if input_path.is_file() and not single_page:
+        # Pages are already sorted by title in the store
+        store = PageStore(input_path)
+        page_count = len(store)
+        if cache is None:
+            city_infos = scrape_stored_pages(store, page_count, **options)
+        else:
+            # Only the titles of the missed pages are kept, each page is read
+            # again from the store when it is scraped
+            city_infos = scrape_with_cache(
+                cache, store,
+                lambda page: (content_hash(page[1].encode("utf-8")), page[0]),
+                lambda titles: scrape_stored_pages(((title, store.get(title)) for title in titles),
+                                                   len(titles), **options),
+                keep_miss=lambda page: page[0]
+            )
+    else:
+        # Sorted, so that the outputs are the same whatever the number of workers
+        file_paths = [input_path] if single_page else sorted(input_path.glob("*.html"))
+        page_count = len(file_paths)
+        if cache is None:
+            city_infos = scrape_city_files(file_paths, **options)
+        else:
+            city_infos = scrape_with_cache(
+                cache, file_paths,
+                lambda path: (cache.file_hash(path), path.stem),
+                lambda paths: scrape_city_files(paths, **options)
+            )
+
+    # The optional outputs are imported here, they need NumPy
+    if args.delta:
+        from bdmv.snapshots import DeltaOutput
+        output = DeltaOutput(output_path)
+    else:
+        output = open_output(output_path, args.format, args.row_group_size,
+                             compress=args.compress, buffer_size=args.buffer_size,
+                             flush_every=args.flush_every, fsync=args.fsync)
+    score_table = None
+    if args.score_table:
+        from bdmv.score_table import SCORE_TABLE_FILENAME, ScoreTableBuilder
+        score_table = ScoreTableBuilder()
+    autocomplete = None
+    if args.autocomplete:
+        from bdmv.autocomplete import AUTOCOMPLETE_FILENAME, PrefixIndexBuilder
+        autocomplete = PrefixIndexBuilder()
+    for city_info in (pbar := tqdm(city_infos, total=page_count)):
+        if city_info is None:
+            continue
+        pbar.set_description(f"Work on url \"{city_info.url}\"")
+        quarantine.count(city_info)
+
+        with metrics.stage("write"):
+            output.write(city_info)
+        if score_table is not None:
+            score_table.add(city_info)
+        if autocomplete is not None:
+            autocomplete.add(city_info)
+        show_metrics(pbar, metrics)
+
+    close_inputs(store, cache)
+    print(quarantine.summary())
+    quarantine.save(output_path / QUARANTINE_FILENAME)
+
+    # For the json format, this is where the csv is written
+    with metrics.stage("close_output"):
+        output.close()
+    if args.delta:
+        print(output.summary())
+    if score_table is not None:
+        with metrics.stage("score_table"):
+            score_table.build().save(output_path / SCORE_TABLE_FILENAME)
+    if autocomplete is not None:
+        with metrics.stage("autocomplete"):
+            autocomplete.build().save(output_path / AUTOCOMPLETE_FILENAME)
+    metrics.write_report(metrics_path)
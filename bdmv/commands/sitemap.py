@@ -0,0 +1,37 @@
+"""`bdmv sitemap`: the cities of a sitemap, counted or listed
+
+The list ("name<TAB>url" lines) can be piped to other tools, or split
+between machines with --shard.
+"""
+
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+import re
+
+from bdmv.sitemap import AVIS_SITEMAP_PATH, AVIS_URL_PATTERN, iter_sitemap_urls
+
+def add_arguments(parser: ArgumentParser):
+    parser.add_argument("--sitemap", default=str(AVIS_SITEMAP_PATH),
+                        help="The sitemap file (the one of the 'avis.html' pages by default)")
+    parser.add_argument("--pattern", default=AVIS_URL_PATTERN.pattern,
+                        help="The regex of the urls, its first group is the city name")
+    parser.add_argument("--list", action="store_true",
+                        help="Print the name and url of each city instead of their number")
+    parser.add_argument("--shard", metavar="INDEX/COUNT",
+                        help="Only the cities of this shard, e.g. 0/4 to 3/4 on 4 machines")
+
+def run(args: Namespace, parser: ArgumentParser):
+    websites = iter_sitemap_urls(Path(args.sitemap), re.compile(args.pattern))
+    if args.shard:
+        # Imported here, it brings the scrapping code with it
+        from bdmv.sharding import in_shard, parse_shard
+        try:
+            websites = in_shard(websites, parse_shard(args.shard))
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.list:
+        for name, url in websites:
+            print(f"{name}\t{url}")
+    else:
+        print(sum(1 for _ in websites))
@@ -0,0 +1,413 @@
+"""Concurrent download engine for the "avis.html" pages
+
+Pages are fetched by a pool of threads, with a global bound on the number
+of requests in flight and a second bound per host, so we can go fast without
+hammering a single server. The global bound can adapt to the errors of the
+website, and throttled pages can be retried (see `bdmv.rate_control`).
+
+The benchmark downloads the pages of a local copy of the website (see
+`bdmv.local_site`) with each bound on the requests in flight. The throttle
+check downloads them from a local copy that only serves a few requests at
+once, and checks that the retries and the adaptive concurrency get every
+page without hammering it (it exits with an error when a check fails).
+
+Usage:
+    python -m bdmv.download bench [--pages 400] [--delay 0.05] [--max-in-flight 1 4 16 64]
+    python -m bdmv.download throttle [--pages 300] [--capacity 10] [--max-in-flight 32]
+"""
+
+from argparse import ArgumentParser
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+import hashlib
+import heapq
+from itertools import count
+import os
+from pathlib import Path
+import sys
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+
+from bdmv.fetch import FetchSession
+from bdmv.manifest import CrawlManifest, has_local_copy
+from bdmv.metrics import DISABLED, Metrics
+from bdmv.page_store import PageStore
+from bdmv.rate_control import (THROTTLE_STATUSES, AdaptiveConcurrency, FixedConcurrency, 
+                               RetryPolicy, parse_retry_after)
+
+if TYPE_CHECKING:
+    from bdmv.local_site import ServedRequest
+
+DEFAULT_MAX_IN_FLIGHT = 16
+DEFAULT_PER_HOST = 8
+
+# Status of a page answered 304 even when fetched without conditional
+# headers: nothing to read back, but not a sign of an overloaded website
+NOT_MODIFIED_WITHOUT_COPY = -304
+
+@dataclass
+class DownloadResult:
+    name: str
+    url: str
+    status_code: int
+    output_path: Optional[Path] = None
+    error: Optional[str] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_hash: Optional[str] = None
+    # Only kept when asked, for the pipeline
+    html: Optional[str] = None
+    retry_after: Optional[float] = None
+    attempts: int = 1
+    
+    @property
+    def ok(self) -> bool:
+        return self.status_code in (200, 304)
+    
+    @property
+    def throttled(self) -> bool:
+        """The website is overloaded, the page can be tried again later
+        """
+        return self.status_code in THROTTLE_STATUSES
+
+class HostLimiter:
+    """Gives one semaphore per host, created on first use
+    """
+    def __init__(self, per_host: int):
+        self.per_host = per_host
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+        
+    def get(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.per_host)
+                self._semaphores[host] = semaphore
+            return semaphore
+
+def save_html(output_folder_path: Path, name: str, html_content: str) -> Path:
+    output_path = output_folder_path / f"{name}.html"
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    # Write then rename, a crash never leaves a truncated page behind
+    tmp_path = output_path.with_name(output_path.name + ".tmp")
+    with tmp_path.open("w", encoding="utf-8") as file:
+        file.write(html_content)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+def download_page(session: FetchSession, name: str, url: str, 
+                  output_folder_path: Optional[Path], limiter: HostLimiter,
+                  headers: Optional[Dict[str, str]] = None,
+                  store: Optional[PageStore] = None,
+                  metrics: Metrics = DISABLED,
+                  keep_html: bool = False) -> DownloadResult:
+    try:
+        with limiter.get(url), metrics.stage("fetch"):
+            response = session.get(url, headers=headers)
+    except requests.RequestException as e:
+        metrics.count("errors")
+        return DownloadResult(name, url, 0, error=str(e))
+    
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    
+    if response.status_code == 304:
+        if not has_local_copy(name, output_folder_path, store):
+            if headers:
+                # The local copy is gone since the headers were made, the page
+                # is fetched again in full
+                return download_page(session, name, url, output_folder_path, limiter,
+                                     None, store, metrics, keep_html)
+            # Nothing to read back, the page must not be recorded as done
+            metrics.count("errors")
+            return DownloadResult(name, url, NOT_MODIFIED_WITHOUT_COPY,
+                                  error=f"Not modified, but no local copy of {name}")
+        metrics.count("not_modified")
+        output_path = None
+        if store is None and output_folder_path is not None:
+            output_path = output_folder_path / f"{name}.html"
+        return DownloadResult(name, url, 304, output_path, 
+                              etag=etag, last_modified=last_modified)
+    
+    if response.status_code != 200:
+        metrics.count("errors")
+        return DownloadResult(name, url, response.status_code,
+                              retry_after=parse_retry_after(response.headers.get("Retry-After")))
+    
+    html_content = response.text
+    if len(html_content) == 0:
+        # Seen when the website is overloaded, handled like a network error
+        metrics.count("errors")
+        return DownloadResult(name, url, 0, error=f"No html content found in url {url}")
+    
+    output_path = None
+    with metrics.stage("save"):
+        if store is not None:
+            store.put(name, html_content)
+        elif output_folder_path is not None:
+            output_path = save_html(output_folder_path, name, html_content)
+    metrics.count("downloaded")
+    metrics.count("bytes", len(response.content))
+    content_hash = hashlib.sha256(response.content).hexdigest()
+    return DownloadResult(name, url, response.status_code, output_path, 
+                          etag=etag, last_modified=last_modified, content_hash=content_hash,
+                          html=html_content if keep_html else None)
+
+def download_pages(session: FetchSession,
+                   websites: Iterable[Tuple[str, str]], 
+                   output_folder_path: Optional[Path],
+                   max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+                   per_host: int = DEFAULT_PER_HOST,
+                   manifest: Optional[CrawlManifest] = None,
+                   store: Optional[PageStore] = None,
+                   metrics: Metrics = DISABLED,
+                   keep_html: bool = False,
+                   concurrency: Optional[AdaptiveConcurrency] = None,
+                   retry: Optional[RetryPolicy] = None) -> Iterator[DownloadResult]:
+    """Download all pages concurrently, each one written as "{name}.html"
+    in the output folder, or packed in the page store if one is given.
+    With no output folder and no store, pages are not saved at all.
+    
+    The websites are consumed lazily, so at most `max_in_flight` requests
+    are pending at any time. Results are yielded in completion order, the
+    caller is in charge of the progress bar and of handling failed statuses.
+    Requests that fail on the network side (timeout, connection reset...)
+    are returned with a status code of 0 and the error message.
+    
+    With an `AdaptiveConcurrency`, the number of requests in flight goes up
+    and down (up to `max_in_flight`) depending on the throttled responses.
+    With a `RetryPolicy`, throttled pages are tried again after a backoff
+    delay, and only yielded once they succeed or have no retry left.
+    
+    With a manifest, pages already known are fetched with a conditional GET
+    (an unchanged page comes back as a 304 and is not rewritten), and every
+    result is recorded before being yielded.
+    
+    The time spent fetching and saving each page is added to `metrics`.
+    With `keep_html`, the html of the downloaded pages is also returned in
+    the results.
+    
+    Args:
+        websites (Iterable[Tuple[str, str]]): Tuples containing
+            - The city name (key)
+            - The url
+    """
+    if max_in_flight < 1 or per_host < 1:
+        raise ValueError("max_in_flight and per_host must be at least 1")
+    if concurrency is None:
+        concurrency = FixedConcurrency(max_in_flight)
+    
+    limiter = HostLimiter(per_host)
+    websites = iter(websites)
+    # Future -> name, url, attempt and start time of the request
+    pending: Dict[Future, Tuple[str, str, int, float]] = {}
+    # Heap of the pages to try again: ready time, order, name, url, attempt
+    retries: List[Tuple[float, int, str, str, int]] = []
+    retry_order = count()
+    
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        def submit(name: str, url: str, attempt: int):
+            headers = (None if manifest is None
+                       else manifest.conditional_headers(name, output_folder_path, store))
+            future = executor.submit(download_page, session, name, url, 
+                                     output_folder_path, limiter, headers, store, metrics,
+                                     keep_html)
+            pending[future] = (name, url, attempt, time.monotonic())
+        
+        def has_room() -> bool:
+            return len(pending) < min(concurrency.limit, max_in_flight)
+        
+        def submit_next() -> bool:
+            # Pages to try again go first, when their delay is over
+            if retries and retries[0][0] <= time.monotonic():
+                _, _, name, url, attempt = heapq.heappop(retries)
+                submit(name, url, attempt)
+                return True
+            website = next(websites, None)
+            if website is None:
+                return False
+            name, url = website
+            submit(name, url, 1)
+            return True
+        
+        try:
+            while True:
+                while has_room() and submit_next():
+                    pass
+                if not pending and not retries:
+                    return
+                
+                # Wake up for the next retry, unless there is no room for it anyway
+                timeout = None
+                if retries and has_room():
+                    timeout = max(0.0, retries[0][0] - time.monotonic())
+                if not pending:
+                    time.sleep(timeout)
+                    continue
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, url, attempt, started_at = pending.pop(future)
+                    result = future.result()
+                    result.attempts = attempt
+                    if not result.throttled:
+                        concurrency.on_success()
+                    else:
+                        metrics.count("throttled")
+                        concurrency.on_throttle(started_at)
+                        if retry is not None and attempt <= retry.max_retries:
+                            metrics.count("retries")
+                            ready_at = time.monotonic() + retry.delay(attempt, result.retry_after)
+                            heapq.heappush(retries, (ready_at, next(retry_order), name, url, attempt + 1))
+                            continue
+                    
+                    if manifest is not None:
+                        with metrics.stage("record"):
+                            if store is not None and result.status_code == 200:
+                                # The page is committed first: after a crash, the
+                                # manifest never lists a page the store lost
+                                store.commit()
+                            manifest.record(result.name, result.url, result.status_code, 
+                                            result.etag, result.last_modified, result.content_hash)
+                    yield result
+        finally:
+            # Do not start anything new if the caller stopped early
+            for future in pending:
+                future.cancel()
+
+# ==== Benchmark ====
+
+def bench(page_count: int, delay: float, max_in_flights: List[int], seed: int = 0) -> List[dict]:
+    """Pages/sec of `download_pages` against a local copy of the website
+    answering each request after `delay` seconds, for each bound on the
+    requests in flight
+    """
+    # Imported here, the downloads of the real website do not need it
+    from bdmv.local_site import LocalSite
+    rows = []
+    with LocalSite.synthetic(page_count, seed, delay=delay) as site:
+        websites = site.websites()
+        for max_in_flight in max_in_flights:
+            start = time.perf_counter()
+            with FetchSession(max_in_flight) as session:
+                downloaded = sum(result.ok for result in download_pages(
+                    session, websites, None, max_in_flight, per_host=max_in_flight))
+            seconds = time.perf_counter() - start
+            rows.append({"max_in_flight": max_in_flight, "pages": downloaded, "seconds": seconds,
+                         "pages_per_sec": downloaded / seconds})
+    for row in rows:
+        row["speedup"] = row["pages_per_sec"] / rows[0]["pages_per_sec"]
+    return rows
+
+def check_retry_after(served: List["ServedRequest"], retry_after: float) -> List[str]:
+    """Pages tried again before the delay asked by their 429 answer
+    """
+    last_429: Dict[str, float] = {}
+    problems = []
+    for request in served:
+        answered_at = last_429.pop(request.path, None)
+        if answered_at is not None and request.at - answered_at < retry_after:
+            problems.append(f"{request.path} tried again after {request.at - answered_at:.2f}s "
+                            f"instead of {retry_after:g}s")
+        if request.status == 429:
+            last_429[request.path] = request.at
+    return problems
+
+def check_throttling(page_count: int, capacity: int, max_in_flight: int, delay: float,
+                     seed: int = 0) -> bool:
+    """Downloads the pages of a local copy of the website serving only
+    `capacity` requests at once, with a fixed concurrency (without and with
+    retries) and with an adaptive one. Prints the runs and the outcome of
+    each check, returns whether they all passed.
+    """
+    # Imported here, the downloads of the real website do not need them
+    from bdmv.bench_report import print_table
+    from bdmv.local_site import LocalSite
+    runs = {
+        "fixed, no retry": (None, None),
+        "fixed, retries": (None, RetryPolicy()),
+        "adaptive, retries": (AdaptiveConcurrency(max_in_flight), RetryPolicy()),
+    }
+    rows = []
+    served = {}
+    with LocalSite.synthetic(page_count, seed, delay=delay, capacity=capacity) as site:
+        websites = site.websites()
+        for name, (concurrency, retry) in runs.items():
+            first_request = len(site.requests)
+            start = time.perf_counter()
+            with FetchSession(max_in_flight) as session:
+                results = list(download_pages(session, websites, None, max_in_flight, per_host=max_in_flight,
+                                              concurrency=concurrency, retry=retry))
+            seconds = time.perf_counter() - start
+            served[name] = site.requests[first_request:]
+            rows.append({"run": name, "pages": sum(r.ok for r in results),
+                         "lost": sum(not r.ok for r in results), "seconds": seconds,
+                         "requests": len(served[name]),
+                         "throttled": sum(r.status != 200 for r in served[name]),
+                         "final_limit": max_in_flight if concurrency is None else concurrency.limit})
+    print(f"{page_count} pages, {capacity} requests served at once, "
+          f"{max_in_flight} requests in flight at most\n")
+    print_table(rows)
+
+    fixed, retried, adaptive = rows
+    adaptive_concurrency = runs["adaptive, retries"][0]
+    checks = {
+        "the website throttles": [] if fixed["lost"] else ["No page lost without retries, nothing is checked"],
+        "the retries get pages back": ([] if retried["lost"] < fixed["lost"]
+                                       else [f"{retried['lost']} pages lost, {fixed['lost']} without retries"]),
+        "the adaptive concurrency gets every page": [f"{adaptive['lost']} pages lost"] if adaptive["lost"] else [],
+        "the concurrency goes down": ([] if adaptive_concurrency.decreases and adaptive["final_limit"] < max_in_flight
+                                      else [adaptive_concurrency.summary()]),
+        "the adaptive concurrency is throttled less": (
+            [] if adaptive["throttled"] < retried["throttled"]
+            else [f"{adaptive['throttled']} throttled requests, {retried['throttled']} with a fixed one"]),
+        "Retry-After is respected": [problem for name in ("fixed, retries", "adaptive, retries")
+                                     for problem in check_retry_after(served[name], site.retry_after)],
+    }
+    for name, problems in checks.items():
+        print(f"{'ok' if not problems else 'FAILED'}  {name}")
+        for problem in problems[:10]:
+            print(f"    {problem}")
+    return not any(checks.values())
+
+def main():
+    parser = ArgumentParser("download")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    bench_parser = commands.add_parser("bench", help="Measure the pages/sec against a local copy of the website")
+    bench_parser.add_argument("--pages", type=int, default=400)
+    bench_parser.add_argument("--seed", type=int, default=0)
+    bench_parser.add_argument("--delay", type=float, default=0.05,
+                              help="The seconds before each answer of the local website")
+    bench_parser.add_argument("--max-in-flight", type=int, nargs="+", default=[1, 4, 16, 64])
+
+    throttle_parser = commands.add_parser("throttle", help="Check the downloads from an overloaded local website")
+    throttle_parser.add_argument("--pages", type=int, default=300)
+    throttle_parser.add_argument("--seed", type=int, default=0)
+    throttle_parser.add_argument("--delay", type=float, default=0.05,
+                                 help="The seconds before each answer of the local website")
+    throttle_parser.add_argument("--capacity", type=int, default=10,
+                                 help="The number of requests the local website serves at once")
+    throttle_parser.add_argument("--max-in-flight", type=int, default=32)
+    args = parser.parse_args()
+
+    if args.command == "throttle":
+        if not check_throttling(args.pages, args.capacity, args.max_in_flight, args.delay, args.seed):
+            sys.exit(1)
+        return
+
+    # Imported here, the downloads of the real website do not need it
+    from bdmv.bench_report import print_table
+    rows = bench(args.pages, args.delay, args.max_in_flight, args.seed)
+    print(f"{args.pages} pages, {args.delay * 1000:.0f} ms per request\n")
+    print_table(rows)
+    if any(row["pages"] != args.pages for row in rows):
+        sys.exit("Some pages were not downloaded")
+
+if __name__ == "__main__":
+    main()
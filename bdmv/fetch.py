@@ -0,0 +1,90 @@
+"""Shared fetch layer for the download scripts
+
+One pooled `requests.Session` is used for the whole run, so connections are
+kept alive between cities, compressed responses are negotiated, and every
+request has a connect and read timeout.
+"""
+
+from dataclasses import dataclass
+import threading
+from typing import Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+
+DEFAULT_POOL_SIZE = 16
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 30.0
+
+USER_AGENT = "bien-dans-ma-ville-scrapping"
+
+@dataclass
+class FetchStats:
+    requests: int = 0
+    new_connections: int = 0
+    bytes_on_wire: int = 0
+    bytes_decoded: int = 0
+    
+    @property
+    def reused_connections(self) -> int:
+        return max(self.requests - self.new_connections, 0)
+    
+    def summary(self) -> str:
+        ratio = self.bytes_decoded / self.bytes_on_wire if self.bytes_on_wire else 0.0
+        return (f"{self.requests} requests, "
+                f"{self.new_connections} new connections, "
+                f"{self.reused_connections} reused, "
+                f"{self.bytes_on_wire} bytes on wire "
+                f"({self.bytes_decoded} decoded, x{ratio:.1f})")
+
+class FetchSession:
+    """A pooled HTTP session, safe to share between download threads
+    """
+    def __init__(self, 
+                 pool_size: int = DEFAULT_POOL_SIZE,
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout: float = DEFAULT_READ_TIMEOUT):
+        self.timeout: Tuple[float, float] = (connect_timeout, read_timeout)
+        self._adapter = HTTPAdapter(pool_connections=pool_size, 
+                                    pool_maxsize=pool_size, 
+                                    pool_block=True)
+        self._session = requests.Session()
+        self._session.mount("http://", self._adapter)
+        self._session.mount("https://", self._adapter)
+        self._session.headers.update({
+            "User-Agent": USER_AGENT,
+            "Accept-Encoding": ACCEPT_ENCODING,
+            "Connection": "keep-alive",
+        })
+        self._stats = FetchStats()
+        self._lock = threading.Lock()
+        
+    def get(self, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        response = self._session.get(url, **kwargs)
+        # The body is already consumed, tell() gives the raw (compressed) size
+        with self._lock:
+            self._stats.requests += 1
+            self._stats.bytes_on_wire += response.raw.tell()
+            self._stats.bytes_decoded += len(response.content)
+        return response
+    
+    @property
+    def stats(self) -> FetchStats:
+        pools = self._adapter.poolmanager.pools
+        new_connections = sum(pools[key].num_connections for key in pools.keys())
+        with self._lock:
+            return FetchStats(self._stats.requests, 
+                              new_connections,
+                              self._stats.bytes_on_wire,
+                              self._stats.bytes_decoded)
+    
+    def close(self):
+        self._session.close()
+        
+    def __enter__(self) -> "FetchSession":
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
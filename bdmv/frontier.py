@@ -0,0 +1,194 @@
+"""Breadth first crawl of the city pages, following the nearby cities tables
+
+The sitemap misses cities, but every city page links to its neighbours.
+Starting from the sitemap, each scraped page adds its unseen nearby cities
+to the frontier, until no city is left to visit.
+
+The frontier is kept in a SQLite file, so a stopped crawl resumes where it
+was. The cities already seen are also kept in memory (a set of titles, a
+few MB for all the French cities) so discovered links are checked without
+any query.
+"""
+
+from pathlib import Path
+import sqlite3
+import sys
+from typing import Callable, Iterable, Iterator, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+from bdmv.download import (DEFAULT_MAX_IN_FLIGHT, DEFAULT_PER_HOST, DownloadResult,
+                           download_pages)
+from bdmv.fetch import FetchSession
+from bdmv.manifest import CrawlManifest
+from bdmv.metrics import DISABLED, Metrics
+from bdmv.page_store import PageStore
+from bdmv.pipeline import DEFAULT_QUEUE_SIZE, scrape_downloads
+from bdmv.rate_control import AdaptiveConcurrency, RetryPolicy
+from bdmv.scraping import CityInformation, get_insee_code, to_website_url
+from bdmv.triage import Quarantine
+
+FRONTIER_FILENAME = "!frontier.sqlite"
+
+QUEUED = 0
+DONE = 1
+FAILED = 2
+
+# Frontier changes are committed by batches
+COMMIT_EVERY = 100
+
+# Number of queued cities read at once from the frontier
+BATCH_SIZE = 256
+
+def title_from_url(url: str) -> Optional[str]:
+    """Returns the city title of a city url, or None if it is not a city url
+
+    Urls look like "https://www.bien-dans-ma-ville.fr/{title}/avis.html"
+    """
+    parts = [part for part in urlsplit(url).path.split("/") if part]
+    if not parts:
+        return None
+    try:
+        get_insee_code(parts[0])
+    except ValueError:
+        return None
+    return parts[0]
+
+class Frontier:
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS frontier (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL UNIQUE,
+                url TEXT NOT NULL,
+                depth INTEGER NOT NULL,
+                state INTEGER NOT NULL
+            )
+        """)
+        self._connection.execute("CREATE INDEX IF NOT EXISTS frontier_state ON frontier (state, seq)")
+        self._connection.commit()
+        self._uncommitted = 0
+
+        self._seen: Set[str] = {
+            sys.intern(row[0]) for row in self._connection.execute("SELECT name FROM frontier")
+        }
+
+    @classmethod
+    def in_folder(cls, folder_path: Path) -> "Frontier":
+        return cls(folder_path / FRONTIER_FILENAME)
+
+    def add(self, name: str, url: str, depth: int = 0) -> bool:
+        """Queue a city, returns False if it was already seen
+        """
+        if name in self._seen:
+            return False
+        self._seen.add(sys.intern(name))
+        self._connection.execute(
+            "INSERT INTO frontier (name, url, depth, state) VALUES (?, ?, ?, ?)",
+            (name, url, depth, QUEUED)
+        )
+        self._changed()
+        return True
+
+    def add_all(self, websites: Iterable[Tuple[str, str]], depth: int = 0) -> int:
+        return sum(self.add(name, url, depth) for name, url in websites)
+
+    def depth(self, name: str) -> int:
+        row = self._connection.execute("SELECT depth FROM frontier WHERE name = ?", (name,)).fetchone()
+        return 0 if row is None else row[0]
+
+    def mark(self, name: str, state: int):
+        self._connection.execute("UPDATE frontier SET state = ? WHERE name = ?", (state, name))
+        self._changed()
+
+    def requeue_failed(self) -> int:
+        cursor = self._connection.execute("UPDATE frontier SET state = ? WHERE state = ?", (QUEUED, FAILED))
+        self._connection.commit()
+        return cursor.rowcount
+
+    def iter_queued(self) -> Iterator[Tuple[str, str]]:
+        """Yields the queued cities in the order they were found (so breadth
+        first), including the ones added while iterating
+        """
+        last_seq = 0
+        while True:
+            rows = self._connection.execute(
+                "SELECT seq, name, url FROM frontier WHERE state = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (QUEUED, last_seq, BATCH_SIZE)
+            ).fetchall()
+            if not rows:
+                return
+            for seq, name, url in rows:
+                last_seq = seq
+                yield name, url
+
+    def count(self, state: int) -> int:
+        return self._connection.execute(
+            "SELECT COUNT(*) FROM frontier WHERE state = ?", (state,)
+        ).fetchone()[0]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._seen
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def _changed(self):
+        self._uncommitted += 1
+        if self._uncommitted >= COMMIT_EVERY:
+            self._connection.commit()
+            self._uncommitted = 0
+
+    def close(self):
+        self._connection.commit()
+        self._connection.close()
+
+    def __enter__(self) -> "Frontier":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def crawl(session: FetchSession, frontier: Frontier, output_folder_path: Path,
+          max_in_flight: int = DEFAULT_MAX_IN_FLIGHT, per_host: int = DEFAULT_PER_HOST,
+          manifest: Optional[CrawlManifest] = None, store: Optional[PageStore] = None,
+          workers: int = 1, queue_size: int = DEFAULT_QUEUE_SIZE, max_depth: Optional[int] = None,
+          to_url: Callable[[str], str] = to_website_url,
+          concurrency: Optional[AdaptiveConcurrency] = None, retry: Optional[RetryPolicy] = None,
+          metrics: Metrics = DISABLED, quarantine: Optional[Quarantine] = None,
+          **options) -> Iterator[Tuple[DownloadResult, Optional[CityInformation]]]:
+    """Download and scrape all the queued cities of the frontier, and the
+    cities found in their nearby cities tables, until the frontier is empty.
+
+    Pages are downloaded like with `download_pages` (with the same
+    concurrency and retries), and scraped like with `scrape_downloads`.
+    Failed pages are retried on the next crawl. Pages that can not be scraped
+    go to the quarantine (if any), their links are not followed.
+
+    Args:
+        max_depth (Optional[int]): Do not follow links further than this
+            number of pages from the seeds
+        to_url (Callable[[str], str]): Gives the url to fetch for a city title
+    """
+    frontier.requeue_failed()
+    # Cities found during a round are fetched in the same round, unless the
+    # round was already ending: they are left for the next one
+    while frontier.count(QUEUED) > 0:
+        results = download_pages(session, frontier.iter_queued(), output_folder_path,
+                                 max_in_flight, per_host, manifest, store, metrics, keep_html=True,
+                                 concurrency=concurrency, retry=retry)
+        for result, city_info in scrape_downloads(results, workers, queue_size, store, metrics, 
+                                                    quarantine, **options):
+            frontier.mark(result.name, DONE if result.ok else FAILED)
+            if city_info is not None:
+                depth = frontier.depth(result.name) + 1
+                if max_depth is None or depth <= max_depth:
+                    for nearby in city_info.nearby_cities:
+                        title = title_from_url(nearby.url)
+                        if title is not None and frontier.add(title, to_url(title), depth):
+                            metrics.count("discovered")
+            yield result, city_info
@@ -0,0 +1,124 @@
+"""All the cities in a single JSON Lines file, written in the background
+
+Instead of opening, writing and closing a json file per city, the cities
+are put in a bounded queue, and a thread encodes and writes them to
+"!cities.jsonl" (or "!cities.jsonl.gz" when compressed). The scrapping
+loop only waits on the disk when the queue is full.
+
+The file is flushed every `flush_every` cities. With the "flush" fsync
+policy, each flush is also synced to the disk, with "close" only the end
+of the file is, and with "never" it is left to the system.
+"""
+
+import gzip
+import json
+import os
+from pathlib import Path
+from queue import Queue
+import threading
+from typing import IO, Iterator, Optional
+
+from bdmv.scraping import CityInformation
+
+JSONL_FILENAME = "!cities.jsonl"
+COMPRESSED_JSONL_FILENAME = "!cities.jsonl.gz"
+
+DEFAULT_BUFFER_SIZE = 1024
+DEFAULT_FLUSH_EVERY = 1000
+
+FSYNC_POLICIES = ("never", "close", "flush")
+DEFAULT_FSYNC = "close"
+
+# Put in the queue by `close`, the thread stops when it gets it
+_END = None
+
+class JsonLinesOutput:
+    def __init__(self, output_folder_path: Path, compress: bool = False,
+                 buffer_size: int = DEFAULT_BUFFER_SIZE, flush_every: int = DEFAULT_FLUSH_EVERY,
+                 fsync: str = DEFAULT_FSYNC):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy {fsync}")
+        if flush_every < 1:
+            raise ValueError("flush_every must be at least 1")
+        output_folder_path.mkdir(parents=True, exist_ok=True)
+        self.path = output_folder_path / (COMPRESSED_JSONL_FILENAME if compress else JSONL_FILENAME)
+        self.flush_every = flush_every
+        self.fsync = fsync
+        self.count = 0
+
+        self._raw_file: IO[bytes] = open(self.path, "wb")
+        self._file: IO[bytes] = gzip.GzipFile(fileobj=self._raw_file, mode="wb") if compress else self._raw_file
+        self._queue: "Queue[Optional[CityInformation]]" = Queue(maxsize=buffer_size)
+        self._error: Optional[BaseException] = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="jsonl-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, info: CityInformation):
+        self._raise_error()
+        self._queue.put(info)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_END)
+        self._thread.join()
+        self._raise_error()
+
+    def _run(self):
+        ended = False
+        try:
+            unflushed = 0
+            while (info := self._queue.get()) is not _END:
+                self._file.write(json.dumps(info.to_json()).encode("utf-8") + b"\n")
+                self.count += 1
+                unflushed += 1
+                if unflushed >= self.flush_every:
+                    self._flush(self.fsync == "flush")
+                    unflushed = 0
+            ended = True
+            if self._file is not self._raw_file:
+                # Writes the end of the gzip stream, the raw file stays open
+                self._file.close()
+            self._raw_file.flush()
+            if self.fsync != "never":
+                os.fsync(self._raw_file.fileno())
+        except BaseException as e:
+            self._error = e
+            # Keep emptying the queue, so the writers are not blocked forever
+            while not ended and self._queue.get() is not _END:
+                pass
+        finally:
+            self._raw_file.close()
+
+    def _flush(self, sync: bool):
+        self._file.flush()
+        if self._file is not self._raw_file:
+            self._raw_file.flush()
+        if sync:
+            os.fsync(self._raw_file.fileno())
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise RuntimeError(f"Could not write {self.path}") from self._error
+
+    def __enter__(self) -> "JsonLinesOutput":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def jsonl_path(output_folder_path: Path) -> Optional[Path]:
+    """The JSON Lines file of a scrape output folder, if there is one
+    """
+    for filename in (JSONL_FILENAME, COMPRESSED_JSONL_FILENAME):
+        if (output_folder_path / filename).exists():
+            return output_folder_path / filename
+    return None
+
+def read_city_infos(path: Path) -> Iterator[CityInformation]:
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "rt", encoding="utf-8") as file:
+        for line in file:
+            yield CityInformation.from_json(json.loads(line))
@@ -0,0 +1,176 @@
+"""A local stand-in for the website, serving synthetic city pages
+
+Used to measure and check the download code offline: every page of a
+synthetic corpus (see `bdmv.synthetic`) is served at /<title>/avis.html,
+after a fixed delay standing for the latency of the website.
+
+With a `capacity`, the site is overloaded like the real one: above that
+number of requests at once, it answers 429 with a "Retry-After" or 503 at
+once. Every request is recorded with its time and status, so the checks
+can see how the downloads behaved.
+
+Usage:
+    python -m bdmv.local_site [--pages 1000] [--seed SEED] [--port 8000] [--delay 0.05] [--capacity 10]
+"""
+
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from bdmv.synthetic import generate_pages
+
+DEFAULT_PORT = 8000
+
+# Seconds before each answer, about the latency of the website
+DEFAULT_DELAY = 0.05
+
+# Seconds in the "Retry-After" header of the 429 answers
+DEFAULT_RETRY_AFTER = 1.0
+
+@dataclass
+class ServedRequest:
+    # time.monotonic() when it was answered
+    at: float
+    path: str
+    status: int
+
+class LocalSite(ThreadingHTTPServer):
+    """Serves `pages` (path -> html) from a background thread, between
+    `start` and `close` (or in a with block)
+    """
+    daemon_threads = True
+    # The default backlog of 5 drops the connections of a burst of clients
+    request_queue_size = 128
+
+    def __init__(self, pages: Dict[str, bytes], delay: float = DEFAULT_DELAY,
+                 capacity: Optional[int] = None, retry_after: float = DEFAULT_RETRY_AFTER,
+                 host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), LocalSiteHandler)
+        self.pages = pages
+        self.delay = delay
+        self.capacity = capacity
+        self.retry_after = retry_after
+        self.requests: List[ServedRequest] = []
+        self.in_flight = 0
+        self._refusals = 0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def synthetic(cls, page_count: int, seed: int = 0, **kwargs) -> "LocalSite":
+        pages = {f"/{title}/avis.html": html.encode("utf-8")
+                 for title, html in generate_pages(page_count, seed)}
+        return cls(pages, **kwargs)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_port}"
+
+    def websites(self) -> List[Tuple[str, str]]:
+        """The name and url of every page, as given to `download_pages`
+        """
+        return [(path.split("/")[1], self.url + path) for path in self.pages]
+
+    def enter(self) -> Optional[int]:
+        """Counts one more request in flight, or gives the status refusing
+        it when the site is full
+        """
+        with self._lock:
+            if self.capacity is not None and self.in_flight >= self.capacity:
+                self._refusals += 1
+                return 429 if self._refusals % 2 else 503
+            self.in_flight += 1
+            return None
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def record(self, path: str, status: int):
+        with self._lock:
+            self.requests.append(ServedRequest(time.monotonic(), path, status))
+
+    def start(self) -> "LocalSite":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        if self._thread is not None:
+            self.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.server_close()
+
+    def __enter__(self) -> "LocalSite":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class LocalSiteHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like the website
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    server: LocalSite
+
+    def do_GET(self):
+        site = self.server
+        refusal = site.enter()
+        if refusal is not None:
+            # Answered at once, the 429 ones tell when to come back
+            headers = {"Retry-After": f"{site.retry_after:g}"} if refusal == 429 else {}
+            site.record(self.path, refusal)
+            self.send_page(refusal, b"", headers)
+            return
+        try:
+            time.sleep(site.delay)
+            page = site.pages.get(self.path)
+            status = 404 if page is None else 200
+            site.record(self.path, status)
+            self.send_page(status, page or b"")
+        finally:
+            site.leave()
+
+    def send_page(self, status: int, content: bytes, headers: Optional[Dict[str, str]] = None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        # One line per request is too much under load
+        pass
+
+def main():
+    parser = ArgumentParser("local_site")
+    parser.add_argument("--pages", type=int, default=1000, help="The number of synthetic pages")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--delay", type=float, default=DEFAULT_DELAY,
+                        help="The seconds before each answer")
+    parser.add_argument("--capacity", type=int,
+                        help="The number of requests served at once, the others get 429 or 503")
+    parser.add_argument("--retry-after", type=float, default=DEFAULT_RETRY_AFTER,
+                        help="The seconds in the \"Retry-After\" header of the 429 answers")
+    args = parser.parse_args()
+
+    site = LocalSite.synthetic(args.pages, args.seed, delay=args.delay, capacity=args.capacity,
+                               retry_after=args.retry_after, host=args.host, port=args.port)
+    print(f"{len(site.pages)} pages served on {site.url}, like {site.websites()[0][1]}", flush=True)
+    try:
+        site.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        site.server_close()
+
+if __name__ == "__main__":
+    main()
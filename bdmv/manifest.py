@@ -0,0 +1,142 @@
+"""Persistent crawl manifest, in order to resume and refresh crawls
+
+Each downloaded page gets a row with its url, the validators sent back by
+the server (ETag / Last-Modified), the hash of its content, the last status
+and when it was fetched. Rows are committed as soon as a page is done, so a
+crashed run resumes where it stopped.
+"""
+
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+import sqlite3
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from bdmv.page_store import PageStore
+
+MANIFEST_FILENAME = "!manifest.sqlite"
+
+# 304 means that the page on disk is still the right one
+DONE_STATUSES = (200, 304)
+
+@dataclass
+class ManifestEntry:
+    name: str
+    url: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    content_hash: Optional[str]
+    status: int
+    fetched_at: str
+
+def has_local_copy(name: str, output_folder_path: Optional[Path],
+                   store: Optional[PageStore] = None) -> bool:
+    """The page was kept, in its html file (or in the store), so a 304 can be
+    read back from there
+    """
+    if store is not None:
+        return name in store
+    return output_folder_path is not None and (output_folder_path / f"{name}.html").exists()
+
+class CrawlManifest:
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                name TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT,
+                status INTEGER NOT NULL,
+                fetched_at TEXT NOT NULL
+            )
+        """)
+        self._connection.commit()
+        
+    @classmethod
+    def in_folder(cls, output_folder_path: Path) -> "CrawlManifest":
+        return cls(output_folder_path / MANIFEST_FILENAME)
+        
+    def get(self, name: str) -> Optional[ManifestEntry]:
+        row = self._connection.execute(
+            "SELECT name, url, etag, last_modified, content_hash, status, fetched_at "
+            "FROM pages WHERE name = ?", (name,)
+        ).fetchone()
+        return None if row is None else ManifestEntry(*row)
+    
+    def load_all(self) -> Dict[str, ManifestEntry]:
+        rows = self._connection.execute(
+            "SELECT name, url, etag, last_modified, content_hash, status, fetched_at FROM pages"
+        )
+        return {row[0]: ManifestEntry(*row) for row in rows}
+        
+    def pending(self, websites: Iterable[Tuple[str, str]], output_folder_path: Path,
+                store: Optional[PageStore] = None) -> Iterator[Tuple[str, str]]:
+        """Yields the websites that still have to be downloaded.
+        
+        A page is done when its html file exists (or it is in the page store)
+        and its last status was a success. Files already on disk without any
+        manifest row (downloaded before the manifest existed) are also
+        considered done.
+        """
+        entries = self.load_all()
+        def is_done(name: str) -> bool:
+            entry = entries.get(name)
+            if entry is not None and entry.status not in DONE_STATUSES:
+                return False
+            return has_local_copy(name, output_folder_path, store)
+        
+        return ((name, url) for name, url in websites if not is_done(name))
+        
+    def conditional_headers(self, name: str, output_folder_path: Optional[Path],
+                            store: Optional[PageStore] = None) -> Dict[str, str]:
+        """Returns the headers for a conditional GET of the page, empty if we
+        have nothing to validate against. Without the local copy of the page
+        (deleted since), a 304 would leave it missing: it is fetched again.
+        """
+        entry = self.get(name)
+        if entry is None or entry.status not in DONE_STATUSES:
+            return {}
+        if not has_local_copy(name, output_folder_path, store):
+            return {}
+        headers = {}
+        if entry.etag is not None:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified is not None:
+            headers["If-Modified-Since"] = entry.last_modified
+        return headers
+    
+    def record(self, name: str, url: str, status: int, 
+               etag: Optional[str] = None, 
+               last_modified: Optional[str] = None, 
+               content_hash: Optional[str] = None):
+        """Save the outcome of a fetch. Validators and hash that are not given
+        are kept from the previous row (on a 304 for example)
+        """
+        fetched_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        self._connection.execute("""
+            INSERT INTO pages (name, url, etag, last_modified, content_hash, status, fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET
+                url = excluded.url,
+                etag = COALESCE(excluded.etag, pages.etag),
+                last_modified = COALESCE(excluded.last_modified, pages.last_modified),
+                content_hash = COALESCE(excluded.content_hash, pages.content_hash),
+                status = excluded.status,
+                fetched_at = excluded.fetched_at
+        """, (name, url, etag, last_modified, content_hash, status, fetched_at))
+        self._connection.commit()
+        
+    def close(self):
+        self._connection.close()
+        
+    def __enter__(self) -> "CrawlManifest":
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,143 @@
+"""Lightweight stage timers and counters for the download and scrape scripts
+
+A disabled `Metrics` costs almost nothing: `stage()` returns a shared no-op
+context manager and counters are ignored, so the instrumentation can stay in
+the hot loops.
+"""
+
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass
+import json
+from pathlib import Path
+import threading
+import time
+from typing import ContextManager, Dict, Optional
+
+_NO_STAGE = nullcontext()
+
+# Number of pages between two updates of the rates in the progress bars
+METRICS_REFRESH_EVERY = 50
+
+@dataclass
+class StageStats:
+    count: int = 0
+    seconds: float = 0.0
+    max_seconds: float = 0.0
+
+    def add(self, seconds: float, count: int = 1):
+        self.count += count
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+class _Stage:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics: "Metrics", name: str):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+
+class Metrics:
+    """Thread safe stage timers and counters
+    """
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.started_at = time.perf_counter()
+        self.stages: Dict[str, StageStats] = {}
+        self.counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def stage(self, name: str) -> ContextManager:
+        """Times the block as one run of the stage
+        """
+        if not self.enabled:
+            return _NO_STAGE
+        return _Stage(self, name)
+
+    def record(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = StageStats()
+            stats.add(seconds)
+
+    def count(self, name: str, value: int = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def merge(self, other: "Metrics"):
+        """Adds the timings and counters of another instance (from a worker)
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            for name, stats in other.stages.items():
+                mine = self.stages.get(name)
+                if mine is None:
+                    mine = self.stages[name] = StageStats()
+                mine.count += stats.count
+                mine.seconds += stats.seconds
+                mine.max_seconds = max(mine.max_seconds, stats.max_seconds)
+            for name, value in other.counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def postfix(self) -> Dict[str, str]:
+        """Short live values for the tqdm postfix: mean time of each stage
+        and rate of each counter
+        """
+        elapsed = self.elapsed
+        with self._lock:
+            values = {name: f"{stats.seconds / stats.count * 1000:.2f}ms"
+                      for name, stats in self.stages.items() if stats.count}
+            values.update({name: f"{value / elapsed:.1f}/s" for name, value in self.counters.items()})
+        return values
+
+    def to_json(self) -> dict:
+        elapsed = self.elapsed
+        with self._lock:
+            return {
+                "elapsed_seconds": elapsed,
+                "stages": {
+                    name: {
+                        **asdict(stats),
+                        "mean_ms": stats.seconds / stats.count * 1000 if stats.count else 0.0,
+                        "share_of_elapsed": stats.seconds / elapsed if elapsed else 0.0,
+                    }
+                    for name, stats in self.stages.items()
+                },
+                "counters": {
+                    name: {"total": value, "per_second": value / elapsed if elapsed else 0.0}
+                    for name, value in self.counters.items()
+                },
+            }
+
+    def write_report(self, path: Optional[Path]):
+        if not self.enabled or path is None:
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.to_json(), file, indent=2)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+DISABLED = Metrics(enabled=False)
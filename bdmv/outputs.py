@@ -0,0 +1,97 @@
+"""Where the scrapping results go, shared by the scrape script and the pipeline
+
+    - "json": one json file per city, and all the cities in "!scores.csv"
+      once everything is scraped
+    - "parquet": a cities table and a nearby cities table (see `bdmv.columnar`)
+    - "jsonl": all the cities in a single JSON Lines file, written by a
+      background thread (see `bdmv.jsonl`)
+"""
+
+import json
+from pathlib import Path
+from typing import Iterator, List, Protocol
+
+from bdmv.jsonl import JsonLinesOutput, jsonl_path, read_city_infos as read_jsonl
+from bdmv.scraping import CityInformation, NearbyCityRegistry, get_file_content
+
+OUTPUT_FORMATS = ("json", "parquet", "jsonl")
+
+SCORES_FILENAME = "!scores.csv"
+
+# Number of rows of each parquet row group (see `bdmv.columnar`)
+DEFAULT_ROW_GROUP_SIZE = 4096
+
+class CityOutput(Protocol):
+    def write(self, info: CityInformation): ...
+    def close(self): ...
+
+def write_infos_file(info: CityInformation, folder_path: Path):
+    output_path = folder_path / f"{info.title}.json"
+    with open(output_path, "w", encoding="utf-8") as file:
+        json.dump(info.to_json(), file)
+
+class JsonOutput:
+    """Writes a json file per city as they come, and the csv when closed.
+
+    The cities are kept for the csv, with their nearby cities shared
+    through a `NearbyCityRegistry`. With `sort_by_title`, the csv rows are
+    sorted by city title instead of being in the order of arrival.
+    """
+    def __init__(self, output_folder_path: Path, sort_by_title: bool = False):
+        output_folder_path.mkdir(parents=True, exist_ok=True)
+        self.output_folder_path = output_folder_path
+        self.sort_by_title = sort_by_title
+        self.city_infos: List[CityInformation] = []
+        self._nearby_cities = NearbyCityRegistry()
+
+    def write(self, info: CityInformation):
+        write_infos_file(info, self.output_folder_path)
+        self.city_infos.append(self._nearby_cities.intern(info))
+
+    def close(self):
+        # Imported here, pandas takes longer to import than everything else
+        import pandas as pd
+        if self.sort_by_title:
+            self.city_infos.sort(key=lambda info: info.title)
+        # Put all city_infos in a beautiful csv
+        df = pd.json_normalize([c.to_json() for c in self.city_infos])
+        df.to_csv(self.output_folder_path / SCORES_FILENAME)
+
+    def __enter__(self) -> "JsonOutput":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def open_output(output_folder_path: Path, output_format: str, row_group_size: int,
+                sort_by_title: bool = False, **jsonl_options) -> CityOutput:
+    """`jsonl_options` are given to `JsonLinesOutput` (compression, flush and
+    fsync policies). The "jsonl" format writes the cities in the order of
+    arrival, whatever `sort_by_title`.
+    """
+    if output_format == "jsonl":
+        return JsonLinesOutput(output_folder_path, **jsonl_options)
+    if output_format == "parquet":
+        # Imported here, pyarrow is only needed for this format
+        from bdmv.columnar import ColumnarWriter
+        return ColumnarWriter(output_folder_path, row_group_size)
+    if output_format == "json":
+        return JsonOutput(output_folder_path, sort_by_title)
+    raise ValueError(f"Unknown output format {output_format}")
+
+def read_city_infos(output_folder_path: Path) -> Iterator[CityInformation]:
+    """Reads back the cities of a scrape output folder, whatever its format
+    """
+    # The cities table of `bdmv.columnar`, not imported unless needed (pyarrow)
+    if (output_folder_path / "!cities.parquet").exists():
+        from bdmv.columnar import read_city_infos as read_columnar
+        yield from read_columnar(output_folder_path)
+        return
+    path = jsonl_path(output_folder_path)
+    if path is not None:
+        yield from read_jsonl(path)
+        return
+    # The other files of the folder ("!scores.csv"...) start with a "!"
+    for path in sorted(output_folder_path.glob("*.json")):
+        if not path.name.startswith("!"):
+            yield CityInformation.from_json(json.loads(get_file_content(path)))
@@ -0,0 +1,138 @@
+"""Packed page archive, instead of one html file per city
+
+All the pages are kept in a single SQLite file, compressed with zlib and
+indexed by city title and INSEE code. Pages can be read one by one by key,
+or streamed in title order.
+"""
+
+from pathlib import Path
+import sqlite3
+import threading
+from typing import Iterator, Optional, Tuple
+import zlib
+
+from bdmv.scraping import get_insee_code
+
+PAGE_STORE_FILENAME = "!pages.sqlite"
+
+# The first bytes of every SQLite database file
+SQLITE_HEADER = b"SQLite format 3\x00"
+
+# Pages are committed by batches, it is much faster than one commit per page
+# (the downloads with a manifest still commit each page, see `commit`)
+COMMIT_EVERY = 100
+
+def compress_page(html: str) -> bytes:
+    return zlib.compress(html.encode("utf-8"))
+
+def decompress_page(data: bytes) -> str:
+    return zlib.decompress(data).decode("utf-8")
+
+def is_page_store(path: Path) -> bool:
+    """Whether the file is an SQLite database (opening anything else as a
+    store fails, and an empty file would become one)
+    """
+    with open(path, "rb") as file:
+        return file.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+
+class PageStore:
+    """A page archive that can be written by several download threads
+    """
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                title TEXT PRIMARY KEY,
+                insee_code TEXT,
+                content BLOB NOT NULL
+            )
+        """)
+        self._connection.execute("CREATE INDEX IF NOT EXISTS pages_insee_code ON pages (insee_code)")
+        self._connection.commit()
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+        
+    @classmethod
+    def in_folder(cls, folder_path: Path) -> "PageStore":
+        return cls(folder_path / PAGE_STORE_FILENAME)
+    
+    def put(self, title: str, html: str):
+        try:
+            insee_code = get_insee_code(title)
+        except ValueError:
+            insee_code = None
+        # Compress outside of the lock, zlib releases the GIL
+        content = compress_page(html)
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO pages (title, insee_code, content) VALUES (?, ?, ?)",
+                (title, insee_code, content)
+            )
+            self._uncommitted += 1
+            if self._uncommitted >= COMMIT_EVERY:
+                self._connection.commit()
+                self._uncommitted = 0
+    
+    def commit(self):
+        """Makes the pages put so far durable, before something else (like a
+        manifest row) says that they are stored
+        """
+        with self._lock:
+            if self._uncommitted:
+                self._connection.commit()
+                self._uncommitted = 0
+    
+    def get(self, title: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT content FROM pages WHERE title = ?", (title,)
+            ).fetchone()
+        return None if row is None else decompress_page(row[0])
+    
+    def get_by_insee_code(self, insee_code: str) -> Optional[Tuple[str, str]]:
+        """Returns the title and the page of the city with this INSEE code
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT title, content FROM pages WHERE insee_code = ?", (insee_code,)
+            ).fetchone()
+        return None if row is None else (row[0], decompress_page(row[1]))
+    
+    def __contains__(self, title: str) -> bool:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT 1 FROM pages WHERE title = ?", (title,)
+            ).fetchone()
+        return row is not None
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+    
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        """Yields the title and the page of each city, sorted by title
+        """
+        # A separate connection, so that the rows are streamed without
+        # keeping the lock (and without loading all pages at once)
+        self.commit()
+        connection = sqlite3.connect(self.path)
+        try:
+            for title, content in connection.execute("SELECT title, content FROM pages ORDER BY title"):
+                yield title, decompress_page(content)
+        finally:
+            connection.close()
+    
+    def close(self):
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+        
+    def __enter__(self) -> "PageStore":
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,188 @@
+"""Persistent cache of the scrapping results, so re-scrapes only parse changed pages
+
+Results are stored by the hash of the page content (with the city title),
+along with the version of the parsing code. When `bdmv/scraping.py`,
+`bdmv/stream_extract.py` or `bdmv/triage.py` (which decides how a page is
+read) change, all the entries are dropped.
+
+For html files, the hash is also remembered with the size and modification
+time of the file, so unchanged files are not even read again.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+import sqlite3
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+from bdmv import scraping, stream_extract, triage
+from bdmv.scraping import CityInformation
+
+PARSE_CACHE_FILENAME = "!parse_cache.sqlite"
+
+DEFAULT_MAX_ENTRIES = 200_000
+
+T = TypeVar("T")
+M = TypeVar("M")
+
+def extractor_version() -> str:
+    """Hash of the source code of the extraction modules
+    """
+    digest = hashlib.sha256()
+    for module in (scraping, stream_extract, triage):
+        with open(module.__file__, "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+def content_hash(content: bytes) -> str:
+    return hashlib.blake2b(content, digest_size=20).hexdigest()
+
+class ParseCache:
+    def __init__(self, path: Path, max_entries: int = DEFAULT_MAX_ENTRIES):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.version = extractor_version()
+        self.hits = 0
+        self.misses = 0
+
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                content_hash TEXT NOT NULL,
+                title TEXT NOT NULL,
+                version TEXT NOT NULL,
+                data TEXT NOT NULL,
+                last_used INTEGER NOT NULL,
+                PRIMARY KEY (content_hash, title)
+            );
+            CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                content_hash TEXT NOT NULL
+            );
+        """)
+        # The parsing code changed, nothing can be reused
+        self._connection.execute("DELETE FROM entries WHERE version != ?", (self.version,))
+        self._connection.commit()
+
+        # Each run gets a higher number, used to evict the least recently used entries
+        row = self._connection.execute("SELECT MAX(last_used) FROM entries").fetchone()
+        self._run = (row[0] or 0) + 1
+
+    @classmethod
+    def in_folder(cls, folder_path: Path, max_entries: int = DEFAULT_MAX_ENTRIES) -> "ParseCache":
+        return cls(folder_path / PARSE_CACHE_FILENAME, max_entries)
+
+    def file_hash(self, path: Path) -> str:
+        """Returns the content hash of the file, only reading it when its size
+        or modification time changed since the last time
+        """
+        stat = os.stat(path)
+        key = str(path.resolve())
+        row = self._connection.execute(
+            "SELECT size, mtime_ns, content_hash FROM files WHERE path = ?", (key,)
+        ).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+
+        with open(path, "rb") as file:
+            digest = content_hash(file.read())
+        self._connection.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, content_hash) VALUES (?, ?, ?, ?)",
+            (key, stat.st_size, stat.st_mtime_ns, digest)
+        )
+        return digest
+
+    def get(self, digest: str, title: str) -> Optional[CityInformation]:
+        row = self._connection.execute(
+            "SELECT data FROM entries WHERE content_hash = ? AND title = ?", (digest, title)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._connection.execute(
+            "UPDATE entries SET last_used = ? WHERE content_hash = ? AND title = ?",
+            (self._run, digest, title)
+        )
+        return CityInformation.from_json(json.loads(row[0]))
+
+    def put(self, digest: str, info: CityInformation):
+        self._connection.execute(
+            "INSERT OR REPLACE INTO entries (content_hash, title, version, data, last_used) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (digest, info.title, self.version, json.dumps(info.to_json()), self._run)
+        )
+
+    def evict(self):
+        """Drop the least recently used entries above `max_entries`
+        """
+        self._connection.execute("""
+            DELETE FROM entries WHERE rowid IN (
+                SELECT rowid FROM entries ORDER BY last_used DESC LIMIT -1 OFFSET ?
+            )
+        """, (self.max_entries,))
+
+    def close(self):
+        self.evict()
+        self._connection.commit()
+        self._connection.close()
+
+    def __enter__(self) -> "ParseCache":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def scrape_with_cache(cache: ParseCache, items: Iterable[T],
+                      key_of: Callable[[T], Tuple[str, str]],
+                      scrape_misses: Callable[[List[M]], Iterator[Optional[CityInformation]]],
+                      keep_miss: Callable[[T], M] = lambda item: item
+                      ) -> Iterator[Optional[CityInformation]]:
+    """Yields the results for all items, in the same order.
+
+    Cached results are used when possible, the other items are all given
+    at once to `scrape_misses` (so they can still go to several workers).
+    Pages it could not scrape (None) are not cached.
+
+    Only `keep_miss(item)` is kept for each missed item until it is
+    scraped: for the (title, html) pages of a store, the title, and
+    `scrape_misses` reads the pages again one by one. Otherwise the whole
+    corpus would be held in memory on a first run.
+
+    Args:
+        key_of (Callable[[T], Tuple[str, str]]): Gives the content hash and
+            the city title of an item
+    """
+    hits: Dict[int, CityInformation] = {}
+    missed_items: List[M] = []
+    missed_digests: List[str] = []
+    count = 0
+    for index, item in enumerate(items):
+        count += 1
+        digest, title = key_of(item)
+        cached = cache.get(digest, title)
+        if cached is not None:
+            hits[index] = cached
+        else:
+            missed_items.append(keep_miss(item))
+            missed_digests.append(digest)
+
+    missed_results = scrape_misses(missed_items)
+    missed_digests = iter(missed_digests)
+    for index in range(count):
+        cached = hits.pop(index, None)
+        if cached is not None:
+            yield cached
+            continue
+        info = next(missed_results)
+        digest = next(missed_digests)
+        if info is not None:
+            cache.put(digest, info)
+        yield info
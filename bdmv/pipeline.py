@@ -0,0 +1,105 @@
+"""Download and scrape in a single pass
+
+Instead of writing all the pages to disk and reading them back with the
+scrape script, the downloaded pages go straight to the parser workers. At
+most `queue_size` pages wait for a parser, so the downloads are slowed down
+when parsing can not keep up, and the memory stays bounded. The parsing
+overlaps with the network, and the results are streamed to the output as
+they arrive.
+
+Pages that did not change since the last crawl (304) are read back from
+the html files or the page store, when they were kept.
+"""
+
+from concurrent.futures import (FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+from functools import partial
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from bdmv.download import DownloadResult
+from bdmv.metrics import DISABLED, Metrics
+from bdmv.page_store import PageStore
+from bdmv.scraping import (CityInformation, get_file_content, scrape_or_quarantine, 
+                           scrape_stored_page, scrape_timed)
+from bdmv.triage import Quarantine, QuarantinedPage
+
+DEFAULT_QUEUE_SIZE = 64
+
+def read_unchanged_page(result: DownloadResult, store: Optional[PageStore] = None) -> Optional[str]:
+    """Returns the html kept from a previous crawl, if any
+    """
+    if store is not None:
+        return store.get(result.name)
+    if result.output_path is not None and result.output_path.exists():
+        return get_file_content(result.output_path)
+    return None
+
+def scrape_downloads(results: Iterable[DownloadResult], workers: int = 1,
+                     queue_size: int = DEFAULT_QUEUE_SIZE, store: Optional[PageStore] = None,
+                     metrics: Metrics = DISABLED, quarantine: Optional[Quarantine] = None,
+                     **options) -> Iterator[Tuple[DownloadResult, Optional[CityInformation]]]:
+    """Scrape the pages as they are downloaded, yielding each download result
+    with its city information, in the order the parsing ends.
+
+    The results must have their html (see `keep_html` of `download_pages`).
+    Failed downloads, and unchanged pages that were not kept, are yielded
+    right away with no city information. So are the pages that can not be
+    scraped, when there is a quarantine (see `scrape_all`).
+
+    With one worker, pages are parsed in a thread (the downloads mostly wait
+    on the network), otherwise in a pool of `workers` processes.
+    """
+    if queue_size < 1:
+        raise ValueError("queue_size must be at least 1")
+
+    scrape = scrape_stored_page
+    if quarantine is not None:
+        scrape = partial(scrape_or_quarantine, scrape)
+    if metrics.enabled:
+        scrape = partial(scrape_timed, scrape, **options)
+    else:
+        scrape = partial(scrape, **options)
+
+    executor: Executor = ThreadPoolExecutor(max_workers=1) if workers <= 1 \
+        else ProcessPoolExecutor(max_workers=workers)
+    pending: Dict[Future, DownloadResult] = {}
+
+    def collect(futures: Iterable[Future]) -> Iterator[Tuple[DownloadResult, Optional[CityInformation]]]:
+        for future in futures:
+            result = pending.pop(future)
+            info = future.result()
+            if metrics.enabled:
+                info, page_metrics = info
+                metrics.merge(page_metrics)
+            if isinstance(info, QuarantinedPage):
+                quarantine.add(info)
+                info = None
+            yield result, info
+
+    with executor:
+        try:
+            for result in results:
+                html = result.html
+                if result.status_code == 304:
+                    html = read_unchanged_page(result, store)
+                if html is None:
+                    yield result, None
+                    continue
+
+                # The queue is full, wait for the parsers to catch up
+                if len(pending) >= queue_size:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    yield from collect(done)
+                pending[executor.submit(scrape, (result.name, html))] = result
+                # The html is not needed anymore, do not keep it with the result
+                result.html = None
+
+                yield from collect([f for f in pending if f.done()])
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                yield from collect(done)
+        finally:
+            # Do not parse anything else if the caller stopped early
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,106 @@
+"""Adaptive concurrency and retries for the downloads
+
+When too many requests are sent, the website answers with 429 or 5xx
+errors, or stops answering. `AdaptiveConcurrency` looks for the highest
+number of requests in flight the website can take, like TCP does with its
+congestion window (AIMD): the limit grows by about one request for each
+full window of healthy responses, and is cut by half when a request is
+throttled.
+
+`RetryPolicy` gives the delay before trying a failed page again, with an
+exponential backoff and full jitter, so retries of many pages do not all
+hit the website at the same time.
+"""
+
+from dataclasses import dataclass
+import random
+import time
+from typing import Optional
+
+# Statuses meaning the website is overloaded, 0 is a network error or timeout
+THROTTLE_STATUSES = frozenset((0, 429, 500, 502, 503, 504))
+
+DEFAULT_MAX_RETRIES = 3
+
+@dataclass
+class RetryPolicy:
+    max_retries: int = DEFAULT_MAX_RETRIES
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Delay before the retry following the `attempt`-th try (from 1),
+        never shorter than the "Retry-After" of the website
+        """
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if retry_after is not None:
+            return max(backoff, min(retry_after, self.max_delay))
+        return backoff
+
+class AdaptiveConcurrency:
+    """Additive increase, multiplicative decrease of the number of requests
+    in flight, between `min_limit` and `max_limit`.
+
+    Only used from the thread submitting the requests, so it is not locked.
+    """
+    def __init__(self, max_limit: int, initial_limit: int = 4, min_limit: int = 1,
+                 decrease_factor: float = 0.5):
+        if not 1 <= min_limit <= max_limit:
+            raise ValueError("Limits must be such that 1 <= min_limit <= max_limit")
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self._limit = float(min(max(initial_limit, min_limit), max_limit))
+        self._last_decrease = float("-inf")
+        self.peak_limit = self.limit
+        self.decreases = 0
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def on_success(self):
+        # One more request in flight once a whole window went well
+        self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+        self.peak_limit = max(self.peak_limit, self.limit)
+
+    def on_throttle(self, started_at: float):
+        """Called when a request started at `started_at` (time.monotonic())
+        was throttled
+        """
+        # The requests sent before the last decrease were sent with a higher
+        # limit, their errors must not decrease it again
+        if started_at < self._last_decrease:
+            return
+        self._limit = max(self.min_limit, self._limit * self.decrease_factor)
+        self._last_decrease = time.monotonic()
+        self.decreases += 1
+
+    def summary(self) -> str:
+        return (f"Concurrency : {self.limit} requests in flight at the end, "
+                f"{self.peak_limit} at most, decreased {self.decreases} times")
+
+class FixedConcurrency:
+    """Same interface as `AdaptiveConcurrency`, with a constant limit
+    """
+    def __init__(self, limit: int):
+        self.limit = limit
+
+    def on_success(self):
+        pass
+
+    def on_throttle(self, started_at: float):
+        pass
+
+    def summary(self) -> str:
+        return f"Concurrency : {self.limit} requests in flight"
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Only the delay in seconds form of the header is used, not the date one
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
@@ -0,0 +1,229 @@
+"""All the scores of the scraped cities in a single NumPy array
+
+Instead of a `Scores` object per city, `ScoreTable` keeps the five scores
+of every city in one (cities x 5) float array, indexed by INSEE code, with
+a mask of the cities that have scores. Normalization, z-scores,
+per-department aggregates and rankings are computed on the whole array at
+once.
+
+The table is saved as three ".npy" files: the scores as one contiguous
+(cities x 5) float array, that can be opened memory mapped (only the pages
+that are read are loaded), and next to it the INSEE codes and the mask.
+
+Usage:
+    python -m bdmv.score_table <!scores.npy or !scores.csv> [--top N]
+"""
+
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from bdmv.scraping import CityInformation
+
+# The scores, the INSEE codes and the mask go next to it, in
+# "!scores.insee_codes.npy" and "!scores.mask.npy"
+SCORE_TABLE_FILENAME = "!scores.npy"
+
+SCORE_FIELDS = ("security", "education", "hobbies", "environment", "practicality")
+
+MAX_SCORE = 5.0
+
+# INSEE codes are 5 characters, like "01004" or "2A004" in Corsica
+INSEE_CODE_DTYPE = np.dtype("U5")
+
+def department_of(insee_codes: np.ndarray) -> np.ndarray:
+    """Department codes of an array of INSEE codes: the first 2 characters,
+    or 3 for the overseas departments ("971" to "976")
+    """
+    codes = insee_codes.astype(INSEE_CODE_DTYPE)
+    two = codes.astype("U2")
+    three = codes.astype("U3")
+    return np.where(two == "97", three, two)
+
+def companion_paths(path: Path) -> Tuple[Path, Path]:
+    """The files of the INSEE codes and of the mask of the table saved at `path`
+    """
+    stem = path.name[:-len(".npy")] if path.name.endswith(".npy") else path.name
+    return path.with_name(f"{stem}.insee_codes.npy"), path.with_name(f"{stem}.mask.npy")
+
+class ScoreTable:
+    """Scores of all cities: `scores[i]` are the five scores of the city
+    `insee_codes[i]`, and rows where `mask[i]` is False are NaN.
+    """
+    def __init__(self, insee_codes: np.ndarray, scores: np.ndarray, mask: np.ndarray):
+        if scores.shape != (len(insee_codes), len(SCORE_FIELDS)) or mask.shape != (len(insee_codes),):
+            raise ValueError("scores must be (cities x 5) and mask (cities,)")
+        self.insee_codes = insee_codes
+        self.scores = scores
+        self.mask = mask
+        self._index: Optional[Dict[str, int]] = None
+
+    # ==== Building, saving and loading ====
+
+    @classmethod
+    def from_city_infos(cls, infos: Iterable[CityInformation]) -> "ScoreTable":
+        builder = ScoreTableBuilder()
+        for info in infos:
+            builder.add(info)
+        return builder.build()
+
+    @classmethod
+    def from_scores_csv(cls, path: Path) -> "ScoreTable":
+        """Reads the "!scores.csv" of the scrape script
+        """
+        df = pd.read_csv(path, dtype={"insee_code": str},
+                         usecols=["insee_code", "contains_scores", *(f"scores.{f}" for f in SCORE_FIELDS)])
+        return cls.from_arrays(df["insee_code"].to_numpy(dtype=INSEE_CODE_DTYPE),
+                               df[[f"scores.{f}" for f in SCORE_FIELDS]].to_numpy(dtype=np.float64),
+                               df["contains_scores"].to_numpy(dtype=np.bool_))
+
+    @classmethod
+    def from_arrays(cls, insee_codes: np.ndarray, scores: np.ndarray, mask: np.ndarray) -> "ScoreTable":
+        """Copies the scores in a contiguous array, with NaN for the cities without scores
+        """
+        scores = np.array(scores, dtype=np.float64, order="C")
+        scores[~mask] = np.nan
+        return cls(insee_codes, scores, mask)
+
+    def save(self, path: Path):
+        """Writes the scores at `path`, the INSEE codes and the mask next to it
+        """
+        codes_path, mask_path = companion_paths(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.save(path, np.ascontiguousarray(self.scores, dtype=np.float64), allow_pickle=False)
+        np.save(codes_path, np.asarray(self.insee_codes, dtype=INSEE_CODE_DTYPE), allow_pickle=False)
+        np.save(mask_path, np.asarray(self.mask, dtype=np.bool_), allow_pickle=False)
+
+    @classmethod
+    def load(cls, path: Path, mmap: bool = True) -> "ScoreTable":
+        """With `mmap`, the scores are a read only, contiguous view of the file
+        """
+        codes_path, mask_path = companion_paths(path)
+        scores = np.load(path, mmap_mode="r" if mmap else None, allow_pickle=False)
+        return cls(np.load(codes_path, allow_pickle=False), scores, np.load(mask_path, allow_pickle=False))
+
+    # ==== Access ====
+
+    def __len__(self) -> int:
+        return len(self.insee_codes)
+
+    def index_of(self, insee_code: str) -> int:
+        if self._index is None:
+            self._index = {code: i for i, code in enumerate(self.insee_codes.tolist())}
+        return self._index[insee_code]
+
+    def row(self, insee_code: str) -> np.ndarray:
+        return self.scores[self.index_of(insee_code)]
+
+    @property
+    def departments(self) -> np.ndarray:
+        return department_of(self.insee_codes)
+
+    # ==== Statistics ====
+
+    def normalized(self, max_score: float = MAX_SCORE) -> np.ndarray:
+        return self.scores / max_score
+
+    def overall(self, weights: Optional[Sequence[float]] = None) -> np.ndarray:
+        """Weighted mean of the five scores of each city (NaN without scores)
+        """
+        if weights is None:
+            return self.scores.mean(axis=1)
+        weights = np.asarray(weights, dtype=np.float64)
+        return self.scores @ (weights / weights.sum())
+
+    def z_scores(self) -> np.ndarray:
+        """How far each score is from the mean of all the scored cities,
+        in standard deviations (all NaN when no city has scores)
+        """
+        if not np.any(self.mask):
+            return np.full(self.scores.shape, np.nan)
+        scored = self.scores[self.mask]
+        mean = scored.mean(axis=0)
+        std = scored.std(axis=0)
+        std[std == 0] = 1.0
+        return (self.scores - mean) / std
+
+    def department_aggregates(self) -> pd.DataFrame:
+        """Number of cities, number of scored cities and mean of each score,
+        by department
+        """
+        departments, inverse = np.unique(self.departments, return_inverse=True)
+        mask = np.asarray(self.mask)
+        scored_counts = np.bincount(inverse, weights=mask, minlength=len(departments))
+        df = pd.DataFrame({
+            "cities": np.bincount(inverse, minlength=len(departments)),
+            "scored_cities": scored_counts.astype(np.int64),
+        }, index=pd.Index(departments, name="department"))
+        values = np.where(mask[:, None], self.scores, 0.0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            for column, field in enumerate(SCORE_FIELDS):
+                sums = np.bincount(inverse, weights=values[:, column], minlength=len(departments))
+                df[f"mean_{field}"] = sums / scored_counts
+        return df
+
+    def ranks(self, values: Optional[np.ndarray] = None) -> np.ndarray:
+        """Rank of each city (1 for the best) by `values` (the overall score
+        by default), 0 for the cities without scores
+        """
+        if values is None:
+            values = self.overall()
+        mask = np.asarray(self.mask)
+        order = np.flatnonzero(mask)[np.argsort(-values[mask], kind="stable")]
+        ranks = np.zeros(len(self), dtype=np.int64)
+        ranks[order] = np.arange(1, len(order) + 1)
+        return ranks
+
+    def top(self, count: int, values: Optional[np.ndarray] = None) -> np.ndarray:
+        """Indices of the `count` best cities, best first
+        """
+        if values is None:
+            values = self.overall()
+        mask = np.asarray(self.mask)
+        scored = np.flatnonzero(mask)
+        count = min(count, len(scored))
+        if count == 0:
+            return scored
+        best = scored[np.argpartition(-values[scored], count - 1)[:count]]
+        return best[np.argsort(-values[best], kind="stable")]
+
+class ScoreTableBuilder:
+    """Collects the scores of the cities as they are scraped
+    """
+    def __init__(self):
+        self.insee_codes: List[str] = []
+        self.values: List[float] = []
+        self.mask: List[bool] = []
+
+    def add(self, info: CityInformation):
+        self.insee_codes.append(info.insee_code)
+        self.mask.append(info.contains_scores)
+        scores = info.scores
+        self.values.extend((scores.security, scores.education, scores.hobbies,
+                            scores.environment, scores.practicality))
+
+    def build(self) -> ScoreTable:
+        return ScoreTable.from_arrays(np.array(self.insee_codes, dtype=INSEE_CODE_DTYPE),
+                                      np.array(self.values, dtype=np.float64).reshape(-1, len(SCORE_FIELDS)),
+                                      np.array(self.mask, dtype=np.bool_))
+
+def main():
+    parser = ArgumentParser("score_table")
+    parser.add_argument("path", help="A score table, or the !scores.csv of the scrape script")
+    parser.add_argument("--top", type=int, default=10, help="The number of best cities to show")
+    args = parser.parse_args()
+
+    path = Path(args.path)
+    table = ScoreTable.from_scores_csv(path) if path.suffix == ".csv" else ScoreTable.load(path)
+    print(f"{len(table)} cities, {int(np.count_nonzero(table.mask))} with scores\n")
+    print(table.department_aggregates().to_string(float_format="{:.2f}".format))
+    print()
+    overall = table.overall()
+    for rank, index in enumerate(table.top(args.top, overall), 1):
+        print(f"{rank:>3}. {table.insee_codes[index]}  {overall[index]:.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,484 @@
+"""Data classes and scrapping functions for the city pages
+
+They live in a module (and not in the scripts) so that they can be pickled
+by the worker processes of `bdmv scrape`.
+"""
+
+from collections import deque
+from dataclasses import dataclass
+from functools import partial
+from itertools import islice
+from pathlib import Path
+import re
+import sys
+from typing import (TYPE_CHECKING, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Sequence,
+                    Tuple, Union)
+
+from bdmv.metrics import DISABLED, Metrics
+from bdmv.stream_extract import TemplateMismatch, scan_city_page
+from bdmv.triage import (MALFORMED, UNSCORED, MalformedPage, Quarantine, QuarantinedPage, 
+                         classify_page)
+
+if TYPE_CHECKING:
+    from concurrent.futures import Executor, Future
+
+    from bs4 import BeautifulSoup, Tag
+
+WEBSITE_ROOT = "https://www.bien-dans-ma-ville.fr"
+
+# "lxml" is much faster but optional, it has to be installed separately
+PARSERS = ("html.parser", "lxml")
+DEFAULT_PARSER = "html.parser"
+
+# "soup" builds a BeautifulSoup tree, "stream" reads the values in one pass
+# and falls back to "soup" for pages that do not match the template
+ENGINES = ("soup", "stream")
+DEFAULT_ENGINE = "soup"
+
+# The only parts of the page read by the find_* functions
+EXTRACTED_CLASSES = ("bloc_notemoyenne", "bloc_chiffre", "tab_compare")
+
+# Classes are slotted: a full corpus keeps tens of thousands of them alive
+
+@dataclass(slots=True)
+class Scores:
+    security: float = -1.0
+    education: float = -1.0
+    hobbies: float = -1.0
+    environment: float = -1.0
+    practicality: float = -1.0
+    
+    def normalize(self, max: float = 5.0) -> "Scores":
+        return Scores(self.security / max, 
+                      self.education / max, 
+                      self.hobbies / max, 
+                      self.environment / max, 
+                      self.practicality / max
+        )
+        
+    def to_json(self):
+        return {
+            "security": self.security,
+            "education": self.education,
+            "hobbies": self.hobbies,
+            "environment": self.environment,
+            "practicality": self.practicality
+            
+        }
+    
+    @classmethod
+    def from_json(cls, data: dict) -> "Scores":
+        return cls(data["security"], 
+                   data["education"], 
+                   data["hobbies"], 
+                   data["environment"], 
+                   data["practicality"])
+        
+@dataclass(slots=True, frozen=True)
+class NearbyCity:
+    url: str
+    name: str
+    contains_scores: bool
+    
+    def to_json(self) -> dict:
+        return {
+            "url": self.url,
+            "name": self.name,
+            "contains_scores": self.contains_scores
+        }
+    
+    @classmethod
+    def from_json(cls, data: dict) -> "NearbyCity":
+        return cls(data["url"], data["name"], data["contains_scores"])
+    
+@dataclass(slots=True)
+class CityInformation:
+    url: str
+    title: str
+    name: str
+    postal_code: str
+    insee_code: str
+    contains_scores: bool
+    scores: Scores
+    nearby_cities: Sequence[NearbyCity]
+    
+    @property
+    def normalized_scores(self) -> Scores:
+        # Computed when needed instead of being kept for every city
+        if not self.contains_scores:
+            return Scores()
+        return self.scores.normalize()
+    
+    def to_json(self) -> dict:
+        return {
+            "url": self.url,
+            "title": self.title,
+            "name": self.name,
+            "postal_code": self.postal_code,
+            "insee_code": self.insee_code,
+            "contains_scores": self.contains_scores,
+            "scores": self.scores.to_json(),
+            "normalized_scores": self.normalized_scores.to_json(),
+            "nearby_cities": [n.to_json() for n in self.nearby_cities]
+        }
+    
+    @classmethod
+    def from_json(cls, data: dict) -> "CityInformation":
+        # The normalized scores are computed from the scores, no need to read them
+        return cls(data["url"],
+                   data["title"],
+                   data["name"],
+                   data["postal_code"],
+                   data["insee_code"],
+                   data["contains_scores"],
+                   Scores.from_json(data["scores"]),
+                   [NearbyCity.from_json(n) for n in data["nearby_cities"]])
+    
+class NearbyCityRegistry:
+    """Shares the nearby cities between all cities.
+    
+    The same neighbours appear in the tables of many cities, the registry
+    keeps a single instance of each one (and of its strings), that every
+    city references.
+    """
+    def __init__(self):
+        self._cities: Dict[NearbyCity, NearbyCity] = {}
+        
+    def __len__(self) -> int:
+        return len(self._cities)
+    
+    def get(self, nearby: NearbyCity) -> NearbyCity:
+        shared = self._cities.get(nearby)
+        if shared is None:
+            shared = NearbyCity(sys.intern(nearby.url), sys.intern(nearby.name), nearby.contains_scores)
+            self._cities[shared] = shared
+        return shared
+    
+    def intern(self, info: CityInformation) -> CityInformation:
+        info.nearby_cities = tuple(self.get(n) for n in info.nearby_cities)
+        return info
+    
+def to_website_url(city_title: str) -> str:
+    return f"{WEBSITE_ROOT}/{city_title}/avis.html"
+
+def get_insee_code(city_title: str) -> int:
+    m = re.search(r"(\d{5}|\d[A-Z]\d{3})", city_title)
+    if m is None:
+        raise ValueError(f"No INSEE code found in title {city_title}")
+    return m.group(1)
+
+def insee_code_from_url(url: str) -> Optional[str]:
+    # Urls look like "https://www.bien-dans-ma-ville.fr/{title}/avis.html"
+    try:
+        return get_insee_code(url.rstrip("/").rsplit("/", 2)[-2])
+    except (ValueError, IndexError):
+        return None
+
+def get_file_content(path: Path) -> str:
+    with open(path, "r", encoding="utf-8") as file:
+        return file.read()
+
+# ==== Scrapping functions ====
+
+def is_extracted_tag(name: str, attrs: Dict[str, str]) -> bool:
+    if name == "h1":
+        return True
+    classes = attrs.get("class")
+    if not classes:
+        return False
+    # Depending on the parser, we get the raw attribute or a list of classes
+    if isinstance(classes, str):
+        classes = classes.split()
+    return any(c in EXTRACTED_CLASSES for c in classes)
+
+def slice_extracted_regions(html: str) -> str:
+    """Cuts the page down to the regions read by the find_* functions: from
+    the h1 to the end of the scores table, then the nearby cities table.
+    The whole page is returned when one of them is not found.
+    """
+    # The head can hold "<h1" or the classes in scripts and styles
+    body = html.find("<body")
+    h1 = html.find("<h1", body) if body >= 0 else -1
+    scores = html.find("bloc_chiffre", h1) if h1 >= 0 else -1
+    scores_end = html.find("</table>", scores) if scores >= 0 else -1
+    compare = html.find("tab_compare", scores_end) if scores_end >= 0 else -1
+    compare_start = html.rfind("<table", scores_end, compare) if compare >= 0 else -1
+    compare_end = html.find("</table>", compare) if compare_start >= 0 else -1
+    if compare_end < 0:
+        return html
+    table_end = len("</table>")
+    return html[h1:scores_end + table_end] + html[compare_start:compare_end + table_end]
+
+def load_soup(html: str, parser: str = DEFAULT_PARSER, targeted: bool = False) -> "BeautifulSoup":
+    """Parse the page with the given parser backend.
+    
+    When targeted, the page is first cut down to the regions read by the
+    find_* functions (html.parser tokenizes everything it is given), and
+    only their subtrees are built (the h1 and the elements with one of the
+    EXTRACTED_CLASSES).
+    """
+    # Imported here, bs4 is slow to import and not needed by the stream
+    # engine, nor by the downloads
+    from bs4 import BeautifulSoup, SoupStrainer
+    if not targeted:
+        return BeautifulSoup(html, parser)
+    return BeautifulSoup(slice_extracted_regions(html), parser,
+                         parse_only=SoupStrainer(is_extracted_tag))
+
+def check_page_contains_scores(soup: "BeautifulSoup") -> bool:
+    h3 = soup.select_one(".bloc_notemoyenne > h3")
+    if h3 is None:
+        raise ValueError("No 'bloc_notemoyenne > h3', this should never happen normally")
+    return h3.text != "Pas encore d'avis..."
+
+def find_city(soup: "BeautifulSoup") -> str:
+    # We have something like "Avis Gergny ", we have to clean it
+    return (soup.select_one("h1")
+            .find(string=True, recursive=False)
+            .removeprefix("Avis")
+            .strip()
+    )
+
+def find_postal_code(soup: "BeautifulSoup") -> str:
+    return soup.select_one("h1 > small").text
+
+def find_scores(soup: "BeautifulSoup") -> Tuple[bool, Scores, Scores]:
+    """Returns a tuple with:
+        - a flag indicating if the scores were found
+        - the scores object
+        - the normalized scores object
+    
+    Raises:
+        MalformedPage: The scores table does not have exactly 5 scores
+    """
+    contains_scores = check_page_contains_scores(soup)
+    if not contains_scores:
+        return False, Scores(), Scores()
+    
+    score_spans = soup.select("table.bloc_chiffre td:nth-child(2) > span:nth-child(1)")
+    # Like the stream engine, anything but the 5 scores is not a page we know
+    if len(score_spans) != 5:
+        raise MalformedPage(f"Expected 5 scores, found {len(score_spans)}")
+    score_values = [float(s.text) for s in score_spans]
+    scores = Scores(*score_values)
+    
+    return True, scores, scores.normalize()
+
+def find_nearby_cities(soup: "BeautifulSoup") -> List[NearbyCity]:
+    # Find the table that contains the elements
+    rows = soup.select(".tab_compare tbody tr")
+    # For each row, we have 7 elements, containing all the information wanted
+    def find_infos_for_row(row: "Tag") -> NearbyCity:
+        tds = row.select("td")
+        # The first td contains the city's url
+        url = tds[0].find("a", href=True)['href']
+        tds = [td.text for td in tds]
+        
+        return to_nearby_city(url, tds[0])
+    
+    return [find_infos_for_row(row) for row in rows]
+
+def to_nearby_city(url: str, name: str) -> NearbyCity:
+    # From the city name, we can see if we have any score
+    m = re.match(r"(.*) \(.*\)", name)
+    contains_scores = m is not None
+    if contains_scores:
+        name = m.group(1)
+    
+    return NearbyCity(url, name, contains_scores)
+
+def load_file_soup(path: Path, parser: str = DEFAULT_PARSER, targeted: bool = False) -> "BeautifulSoup":
+    with open(path, "r", encoding="utf-8") as file:
+        data = file.read()
+        return load_soup(data, parser, targeted)
+
+def scrape_city_page(city_title: str, html: str, parser: str = DEFAULT_PARSER, 
+                     targeted: bool = False, engine: str = DEFAULT_ENGINE,
+                     metrics: Metrics = DISABLED) -> CityInformation:
+    """Unscored pages are always read with the stream engine (falling back
+    to the soup one without parsing the scores), there is little to read.
+    
+    Raises:
+        MalformedPage: The page has no scores block, it is not a city page
+    """
+    url = to_website_url(city_title)
+    insee_code = get_insee_code(city_title)
+    
+    with metrics.stage("classify"):
+        page_class = classify_page(html)
+    if page_class == MALFORMED:
+        raise MalformedPage("No '.bloc_notemoyenne' in the page")
+    
+    streamed = None
+    if engine == "stream" or page_class == UNSCORED:
+        try:
+            with metrics.stage("scan"):
+                streamed = scan_city_page(html)
+        except TemplateMismatch:
+            metrics.count("template_mismatch")
+    
+    if streamed is not None:
+        city = streamed.name
+        postal_code = streamed.postal_code
+        contains_scores = streamed.contains_scores
+        scores = Scores(*streamed.score_values)
+        nearby_cities = [to_nearby_city(u, n) for u, n in streamed.nearby_rows]
+    else:
+        with metrics.stage("load_soup"):
+            soup = load_soup(html, parser, targeted)
+        
+        with metrics.stage("find_city"):
+            city = find_city(soup)
+        with metrics.stage("find_postal_code"):
+            postal_code = find_postal_code(soup)
+        if page_class == UNSCORED:
+            contains_scores, scores = False, Scores()
+        else:
+            with metrics.stage("find_scores"):
+                contains_scores, scores, _ = find_scores(soup)
+        with metrics.stage("find_nearby_cities"):
+            nearby_cities = find_nearby_cities(soup)
+    
+    metrics.count("scraped")
+    return CityInformation(
+        url,
+        city_title,
+        city,
+        postal_code,
+        insee_code,
+        contains_scores,
+        scores,
+        nearby_cities
+    )
+
+def scrape_city_file(path: Path, metrics: Metrics = DISABLED, **options) -> CityInformation:
+    with metrics.stage("read_file"):
+        html = get_file_content(path)
+    return scrape_city_page(path.stem, html, metrics=metrics, **options)
+
+def scrape_stored_page(page: Tuple[str, str], **options) -> CityInformation:
+    city_title, html = page
+    return scrape_city_page(city_title, html, **options)
+
+def default_chunksize(file_count: int, workers: int) -> int:
+    # A few chunks per worker keeps them all busy until the end,
+    # without paying the inter-process cost for each page
+    return max(1, min(64, file_count // (workers * 4)))
+
+# Number of chunks sent to the workers and not yet read back, per worker:
+# enough to keep them busy, without reading all the pages in advance
+PENDING_CHUNKS_PER_WORKER = 2
+
+def scrape_chunk(scrape: Callable, chunk: List) -> List:
+    return [scrape(item) for item in chunk]
+
+def scrape_in_order(executor: "Executor", scrape: Callable, items: Iterable, chunksize: int,
+                    max_pending: int) -> Iterator:
+    """The results of `scrape` on each item, in order, computed by chunks of
+    `chunksize` items on the executor.
+
+    Unlike `Executor.map`, which reads all the items before returning
+    anything, at most `max_pending` chunks are submitted and not yet
+    yielded, so the pages are read as they are needed.
+    """
+    items = iter(items)
+    pending: Deque["Future"] = deque()
+    try:
+        while True:
+            while len(pending) < max_pending:
+                chunk = list(islice(items, chunksize))
+                if not chunk:
+                    break
+                pending.append(executor.submit(scrape_chunk, scrape, chunk))
+            if not pending:
+                return
+            yield from pending.popleft().result()
+    finally:
+        # Do not parse anything else if the caller stopped early
+        for future in pending:
+            future.cancel()
+
+def scrape_timed(scrape: Callable[..., CityInformation], item, 
+                 **options) -> Tuple[CityInformation, Metrics]:
+    """Scrape one item with its own metrics, so that they can be sent back
+    from a worker process
+    """
+    metrics = Metrics()
+    return scrape(item, metrics=metrics, **options), metrics
+
+def item_title(item) -> str:
+    # Items are html files or (title, html) pages
+    return item.stem if isinstance(item, Path) else item[0]
+
+def scrape_or_quarantine(scrape: Callable[..., CityInformation], item, 
+                         **options) -> Union[CityInformation, QuarantinedPage]:
+    try:
+        return scrape(item, **options)
+    except (ValueError, AttributeError, IndexError) as e:
+        # What the find_* functions raise when the page is not as expected
+        return QuarantinedPage(item_title(item), f"{type(e).__name__}: {e}")
+
+def scrape_all(scrape: Callable[..., CityInformation], items: Iterable, count: int, 
+               workers: int = 1, chunksize: int = 0, metrics: Metrics = DISABLED,
+               quarantine: Optional[Quarantine] = None,
+               **options) -> Iterator[Optional[CityInformation]]:
+    """Scrape all items, yielding the results in the same order as `items`.
+    
+    With more than one worker, items are sent by batches of `chunksize`
+    to a pool of processes (0 for an automatic chunk size). The items are
+    read lazily, a few batches ahead of the results. The stage timings of
+    all workers are added to `metrics`.
+    
+    With a quarantine, the pages that can not be scraped are added to it
+    and yielded as None, instead of raising.
+    """
+    if quarantine is not None:
+        scrape = partial(scrape_or_quarantine, scrape)
+    if metrics.enabled:
+        scrape = partial(scrape_timed, scrape, **options)
+    else:
+        scrape = partial(scrape, **options)
+    
+    if workers <= 1:
+        results = map(scrape, items)
+        executor = None
+    else:
+        if chunksize <= 0:
+            chunksize = default_chunksize(count, workers)
+        # Imported here, the process pool machinery is slow to import
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = scrape_in_order(executor, scrape, items, chunksize,
+                                  workers * PENDING_CHUNKS_PER_WORKER)
+    
+    try:
+        for info in results:
+            if metrics.enabled:
+                info, page_metrics = info
+                metrics.merge(page_metrics)
+            if isinstance(info, QuarantinedPage):
+                quarantine.add(info)
+                info = None
+            yield info
+    finally:
+        if executor is not None:
+            # Cancels the chunks not started yet
+            results.close()
+            executor.shutdown()
+
+def scrape_city_files(paths: List[Path], workers: int = 1, chunksize: int = 0,
+                      parser: str = DEFAULT_PARSER, targeted: bool = False,
+                      engine: str = DEFAULT_ENGINE, metrics: Metrics = DISABLED,
+                      quarantine: Optional[Quarantine] = None) -> Iterator[Optional[CityInformation]]:
+    return scrape_all(scrape_city_file, paths, len(paths), workers, chunksize, metrics, quarantine,
+                      parser=parser, targeted=targeted, engine=engine)
+
+def scrape_stored_pages(pages: Iterable[Tuple[str, str]], count: int, 
+                        workers: int = 1, chunksize: int = 0,
+                        parser: str = DEFAULT_PARSER, targeted: bool = False,
+                        engine: str = DEFAULT_ENGINE, metrics: Metrics = DISABLED,
+                        quarantine: Optional[Quarantine] = None) -> Iterator[Optional[CityInformation]]:
+    """Same as `scrape_city_files`, with the (title, html) pages of a page store
+    """
+    return scrape_all(scrape_stored_page, pages, count, workers, chunksize, metrics, quarantine,
+                      parser=parser, targeted=targeted, engine=engine)
@@ -0,0 +1,314 @@
+"""Local HTTP/JSON service to look up the scraped cities
+
+Serves a `CityDatabase` (see `bdmv.city_db`), with the most requested
+cities kept in memory by an LRU cache:
+
+    GET  /cities/<insee code>          a city, 404 if unknown
+    GET  /cities?title=<title>         the city with this title
+    GET  /cities?postal_code=<code>    the list of cities with this postal code
+    POST /cities/batch                 {"insee_codes": [...]} gives
+                                       {"cities": [...], "missing": [...]}
+    GET  /stats                        number of cities and cache statistics
+
+Only the standard library is used for the server. The json of the cities is
+sent as stored, it is never decoded.
+
+Usage:
+    python -m bdmv.service build <scrape output folder> [--db !cities.sqlite]
+    python -m bdmv.service serve <database> [--port 8000] [--cache-size 10000]
+    python -m bdmv.service bench <database> [--clients 8] [--requests 5000]
+"""
+
+from argparse import ArgumentParser
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from pathlib import Path
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+from bdmv.bench_report import latency_report, print_table
+from bdmv.city_db import CITY_DB_FILENAME, CityDatabase
+from bdmv.outputs import read_city_infos
+
+DEFAULT_PORT = 8000
+
+DEFAULT_CACHE_SIZE = 10_000
+
+# Larger batches are refused, so one request can not hold a server thread for long
+MAX_BATCH_SIZE = 1000
+
+class LRUCache:
+    """The json of the last `max_entries` cities that were looked up, by INSEE
+    code. Shared by the threads of the server.
+    """
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: Sequence[str],
+                 load: Callable[[Sequence[str]], Dict[str, str]]) -> Dict[str, str]:
+        """The cached values of `keys`, the others are loaded at once and
+        cached. Keys that `load` does not find are not returned.
+        """
+        found: Dict[str, str] = {}
+        missing: List[str] = []
+        with self._lock:
+            for key in keys:
+                value = self._entries.get(key)
+                if value is None:
+                    missing.append(key)
+                else:
+                    self._entries.move_to_end(key)
+                    found[key] = value
+            self.hits += len(found)
+            self.misses += len(missing)
+        if not missing:
+            return found
+
+        loaded = load(missing)
+        found.update(loaded)
+        with self._lock:
+            self._entries.update(loaded)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return found
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "max_entries": self.max_entries,
+                "hits": self.hits, "misses": self.misses}
+
+class CityLookup:
+    def __init__(self, database: CityDatabase, cache_size: int = DEFAULT_CACHE_SIZE):
+        self.database = database
+        self.cache = LRUCache(cache_size)
+        self.city_count = len(database)
+
+    def get_many(self, insee_codes: Sequence[str]) -> Dict[str, str]:
+        return self.cache.get_many(insee_codes, self.database.get_many)
+
+    def get(self, insee_code: str) -> Optional[str]:
+        return self.get_many([insee_code]).get(insee_code)
+
+class CityServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], lookup: CityLookup):
+        super().__init__(address, CityRequestHandler)
+        self.lookup = lookup
+
+class CityRequestHandler(BaseHTTPRequestHandler):
+    # Keep-alive, clients do not open a connection per request
+    protocol_version = "HTTP/1.1"
+    # The headers and the body are two writes, Nagle would hold the body
+    # until the client acknowledges the headers (40 ms with delayed ACKs)
+    disable_nagle_algorithm = True
+    server: CityServer
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        lookup = self.server.lookup
+        if url.path == "/stats":
+            self.send_json(200, json.dumps({"cities": lookup.city_count, "cache": lookup.cache.stats()}))
+        elif url.path.startswith("/cities/"):
+            city = lookup.get(url.path[len("/cities/"):])
+            if city is None:
+                self.send_error_json(404, "Unknown INSEE code")
+            else:
+                self.send_json(200, city)
+        elif url.path == "/cities":
+            query = parse_qs(url.query)
+            if "title" in query:
+                insee_code = lookup.database.insee_code_of_title(query["title"][0])
+                city = None if insee_code is None else lookup.get(insee_code)
+                if city is None:
+                    self.send_error_json(404, "Unknown title")
+                else:
+                    self.send_json(200, city)
+            elif "postal_code" in query:
+                insee_codes = lookup.database.insee_codes_of_postal_code(query["postal_code"][0])
+                cities = lookup.get_many(insee_codes)
+                self.send_json(200, "[" + ",".join(cities[code] for code in insee_codes) + "]")
+            else:
+                self.send_error_json(400, "Expected a title or a postal_code")
+        else:
+            self.send_error_json(404, "Unknown path")
+
+    def do_POST(self):
+        if urlsplit(self.path).path != "/cities/batch":
+            self.send_error_json(404, "Unknown path")
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            insee_codes = [str(code) for code in body["insee_codes"]]
+        except (ValueError, KeyError, TypeError):
+            self.send_error_json(400, "Expected {\"insee_codes\": [...]}")
+            return
+        if len(insee_codes) > MAX_BATCH_SIZE:
+            self.send_error_json(400, f"At most {MAX_BATCH_SIZE} cities per batch")
+            return
+
+        cities = self.server.lookup.get_many(insee_codes)
+        found = ",".join(cities[code] for code in insee_codes if code in cities)
+        missing = [code for code in insee_codes if code not in cities]
+        self.send_json(200, f"{{\"cities\": [{found}], \"missing\": {json.dumps(missing)}}}")
+
+    def send_json(self, status: int, text: str):
+        content = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_error_json(self, status: int, message: str):
+        self.send_json(status, json.dumps({"error": message}))
+
+    def log_message(self, format, *args):
+        # One line per request is too much under load
+        pass
+
+def serve(database_path: Path, host: str, port: int, cache_size: int):
+    lookup = CityLookup(CityDatabase(database_path), cache_size)
+    with CityServer((host, port), lookup) as server:
+        print(f"{lookup.city_count} cities served on http://{host}:{server.server_port}", flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+# ==== Load test ====
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(database_path: Path, cache_size: int) -> Tuple[subprocess.Popen, str]:
+    """Starts a server in another process, so it does not share the GIL with the clients
+    """
+    port = free_port()
+    process = subprocess.Popen([sys.executable, "-m", "bdmv.service", "serve", str(database_path),
+                                "--port", str(port), "--cache-size", str(cache_size)],
+                               stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            requests.get(f"{url}/stats", timeout=1)
+            return process, url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("The server did not start")
+
+def run_load(name: str, send: Callable[[requests.Session, int], requests.Response],
+             request_count: int, clients: int) -> dict:
+    """Sends `request_count` requests from `clients` threads, each with its
+    own connection
+    """
+    def client(indices: range) -> List[float]:
+        durations = []
+        with requests.Session() as session:
+            for i in indices:
+                start = time.perf_counter()
+                response = send(session, i)
+                durations.append((time.perf_counter() - start) * 1000)
+                if response.status_code != 200:
+                    raise RuntimeError(f"{name} : status {response.status_code}")
+        return durations
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        parts = executor.map(client, [range(c, request_count, clients) for c in range(clients)])
+        durations = [d for part in parts for d in part]
+    seconds = time.perf_counter() - start
+    return {**asdict(latency_report(name, durations)), "requests_per_sec": request_count / seconds}
+
+def bench(database_path: Path, url: Optional[str], request_count: int, clients: int,
+          batch_size: int, cache_size: int, hot_fraction: float, seed: int = 0):
+    database = CityDatabase(database_path)
+    cities = database.keys()
+    database.close()
+
+    rnd = random.Random(seed)
+    # Most requests are for a few popular cities, like a real search
+    hot = rnd.sample(cities, max(1, int(len(cities) * hot_fraction)))
+    picks = [rnd.choice(hot if rnd.random() < 0.8 else cities) for _ in range(request_count)]
+    batches = [[rnd.choice(cities)[0] for _ in range(batch_size)] for _ in range(request_count // 10)]
+
+    process = None
+    if url is None:
+        process, url = start_server(database_path, cache_size)
+    try:
+        print(f"{len(cities)} cities, {request_count} requests, {clients} clients on {url}\n")
+        loads = [
+            ("GET /cities/<insee code>",
+             lambda s, i: s.get(f"{url}/cities/{picks[i][0]}"), request_count),
+            ("GET /cities?title=",
+             lambda s, i: s.get(f"{url}/cities", params={"title": picks[i][1]}), request_count),
+            ("GET /cities?postal_code=",
+             lambda s, i: s.get(f"{url}/cities", params={"postal_code": picks[i][2]}), request_count),
+            (f"POST /cities/batch ({batch_size} cities)",
+             lambda s, i: s.post(f"{url}/cities/batch", json={"insee_codes": batches[i]}), len(batches)),
+        ]
+        # There is one batch per 10 requests, none with less than 10 requests
+        print_table([run_load(name, send, count, clients) for name, send, count in loads if count > 0])
+        print()
+        print(requests.get(f"{url}/stats").json())
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+def main():
+    parser = ArgumentParser("service")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = commands.add_parser("build", help="Build the database from the output of the scrape script")
+    build_parser.add_argument("scrape_output_path")
+    build_parser.add_argument("--db", help=f"The database file ({CITY_DB_FILENAME} in the scrape output by default)")
+
+    serve_parser = commands.add_parser("serve", help="Serve a database over HTTP")
+    serve_parser.add_argument("database_path")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE,
+                              help="The number of cities kept in memory")
+
+    bench_parser = commands.add_parser("bench", help="Measure the latency and throughput of the service")
+    bench_parser.add_argument("database_path")
+    bench_parser.add_argument("--url", help="A running server (one is started by default)")
+    bench_parser.add_argument("--requests", type=int, default=5000)
+    bench_parser.add_argument("--clients", type=int, default=8)
+    bench_parser.add_argument("--batch-size", type=int, default=50)
+    bench_parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE)
+    bench_parser.add_argument("--hot-fraction", type=float, default=0.05,
+                              help="The share of cities that get 80%% of the requests")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        output_path = Path(args.scrape_output_path)
+        database_path = Path(args.db) if args.db else output_path / CITY_DB_FILENAME
+        database = CityDatabase.build(database_path, read_city_infos(output_path))
+        print(f"{len(database)} cities in {database_path}")
+    elif args.command == "serve":
+        serve(Path(args.database_path), args.host, args.port, args.cache_size)
+    else:
+        bench(Path(args.database_path), args.url, args.requests, args.clients,
+              args.batch_size, args.cache_size, args.hot_fraction)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""Split the cities between several machines, and merge their outputs
+
+Each city belongs to a shard given by a hash of its INSEE code, so every
+machine computes the same split from the same list of cities (the sitemap
+or the wget folders), without talking to the others. A shard is given as
+"INDEX/COUNT", from "0/4" to "3/4" for 4 machines.
+
+Each machine downloads and scrapes its shard in its own folders (with its
+own manifest), then the outputs are merged into a single one. Cities found
+in several outputs are written once: the first output wins, and the
+duplicates are listed in "!duplicates.csv", with whether they differ.
+
+The check runs a process per shard, standing for the machines, against a
+local copy of the website (see `bdmv.local_site`): each one downloads and
+scrapes its shard, then the merged output is compared to the one of a
+single machine, and duplicated cities are added to see them detected.
+
+Usage:
+    python -m bdmv.sharding merge <output folder> <shard output folder>... [--format json]
+    python -m bdmv.sharding check [--pages 400] [--shards 4]
+"""
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+import csv
+from dataclasses import dataclass
+import json
+import multiprocessing
+from pathlib import Path
+import sys
+import tempfile
+from typing import Dict, Iterable, Iterator, List, Tuple, TypeVar
+import zlib
+
+from bdmv.outputs import (DEFAULT_ROW_GROUP_SIZE, OUTPUT_FORMATS, JsonOutput, open_output,
+                          read_city_infos)
+from bdmv.scraping import get_insee_code
+
+DUPLICATES_FILENAME = "!duplicates.csv"
+
+T = TypeVar("T")
+
+def parse_shard(text: str) -> Tuple[int, int]:
+    """"2/8" -> (2, 8)
+    """
+    try:
+        index, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise ValueError(f"A shard looks like INDEX/COUNT, not {text}") from None
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"The shard index must be between 0 and {count - 1}")
+    return index, count
+
+def shard_of(name: str, shard_count: int) -> int:
+    """The shard of a city, from the INSEE code in its name (or the name
+    itself when it has none). CRC32 does not change from one run or one
+    machine to another, unlike `hash`.
+    """
+    try:
+        key = get_insee_code(name)
+    except ValueError:
+        key = name
+    return zlib.crc32(key.encode("utf-8")) % shard_count
+
+def in_shard(websites: Iterable[Tuple[str, T]], shard: Tuple[int, int]) -> Iterator[Tuple[str, T]]:
+    """The (name, url) pairs of the cities of the shard, lazily
+    """
+    index, count = shard
+    return (website for website in websites if shard_of(website[0], count) == index)
+
+@dataclass
+class Duplicate:
+    insee_code: str
+    title: str
+    kept_from: Path
+    found_in: Path
+    identical: bool
+
+def merge_shards(shard_output_paths: List[Path], output_path: Path,
+                 output_format: str = "json") -> Tuple[int, List[Duplicate]]:
+    """Writes the cities of all the shard outputs to `output_path`, each one
+    once. Returns the number of cities written and the duplicates.
+    """
+    # Imported here, the downloads only need the split (and not numpy)
+    from bdmv.snapshots import city_fingerprint
+    # INSEE code -> (fingerprint, title, output it was taken from)
+    seen: Dict[str, Tuple[int, str, Path]] = {}
+    duplicates: List[Duplicate] = []
+    with open_output(output_path, output_format, DEFAULT_ROW_GROUP_SIZE, sort_by_title=True) as output:
+        for shard_output_path in shard_output_paths:
+            for info in read_city_infos(shard_output_path):
+                fingerprint = city_fingerprint(info)
+                previous = seen.get(info.insee_code)
+                if previous is not None:
+                    previous_fingerprint, previous_title, kept_from = previous
+                    identical = previous_fingerprint == fingerprint and previous_title == info.title
+                    duplicates.append(Duplicate(info.insee_code, info.title, kept_from,
+                                                shard_output_path, identical))
+                    continue
+                seen[info.insee_code] = (fingerprint, info.title, shard_output_path)
+                output.write(info)
+
+    if duplicates:
+        with open(output_path / DUPLICATES_FILENAME, "w", encoding="utf-8", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(("insee_code", "title", "kept_from", "found_in", "identical"))
+            writer.writerows((d.insee_code, d.title, d.kept_from, d.found_in, d.identical)
+                             for d in duplicates)
+    return len(seen), duplicates
+
+# ==== Check ====
+
+def run_node(websites: List[Tuple[str, str]], shard: Tuple[int, int], node_path: Path) -> List[str]:
+    """What a machine does for its shard: downloads the pages (with its own
+    manifest) in `node_path`/pages, and scrapes them to `node_path`/data.
+    Returns the names of the downloaded cities.
+    """
+    # Imported here, only the check downloads from this module
+    from bdmv.download import download_pages
+    from bdmv.fetch import FetchSession
+    from bdmv.manifest import CrawlManifest
+    from bdmv.scraping import scrape_city_files
+    pages_path = node_path / "pages"
+    pages_path.mkdir(parents=True, exist_ok=True)
+    manifest = CrawlManifest.in_folder(pages_path)
+    with FetchSession() as session:
+        names = [result.name for result in download_pages(session, in_shard(websites, shard), pages_path,
+                                                          manifest=manifest) if result.ok]
+    manifest.close()
+    with JsonOutput(node_path / "data", sort_by_title=True) as output:
+        for info in scrape_city_files(sorted(pages_path.glob("*.html"))):
+            output.write(info)
+    return names
+
+def read_output_files(output_path: Path) -> Dict[str, bytes]:
+    return {path.name: path.read_bytes() for path in output_path.iterdir() if path.name != DUPLICATES_FILENAME}
+
+def check_sharding(page_count: int, shard_count: int, seed: int = 0) -> bool:
+    """Runs the shards on as many processes against a local copy of the
+    website, merges their outputs and checks them. Prints the outcome of
+    each check, returns whether they all passed.
+    """
+    # Imported here, only the check serves pages
+    from bdmv.local_site import LocalSite
+    checks: Dict[str, List[str]] = {}
+    with tempfile.TemporaryDirectory() as tmp_folder, \
+            LocalSite.synthetic(page_count, seed, delay=0.01) as site:
+        tmp_path = Path(tmp_folder)
+        websites = site.websites()
+        node_paths = [tmp_path / f"node-{index}" for index in range(shard_count)]
+        # Spawned, like separate machines sharing nothing with this process
+        spawn = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=shard_count, mp_context=spawn) as executor:
+            shard_names = list(executor.map(run_node, [websites] * shard_count,
+                                            [(index, shard_count) for index in range(shard_count)], node_paths))
+        single_names = run_node(websites, (0, 1), tmp_path / "single")
+        print(f"{len(websites)} cities, shards of {', '.join(str(len(names)) for names in shard_names)} cities\n")
+
+        all_names = {name for name, _ in websites}
+        problems = []
+        if sum(len(names) for names in shard_names) != len(all_names):
+            problems.append(f"{sum(len(names) for names in shard_names)} cities downloaded, "
+                            f"{len(all_names)} expected")
+        if set().union(*shard_names) != all_names:
+            problems.append(f"{len(all_names - set().union(*shard_names))} cities downloaded by no shard")
+        if set(single_names) != all_names:
+            problems.append(f"{len(all_names - set(single_names))} cities not downloaded by the single node")
+        checks["the shards are disjoint and cover every city"] = problems
+
+        shard_outputs = [node_path / "data" for node_path in node_paths]
+        merged_path = tmp_path / "merged"
+        city_count, duplicates = merge_shards(shard_outputs, merged_path)
+        single, merged = read_output_files(tmp_path / "single" / "data"), read_output_files(merged_path)
+        different = sorted(name for name in single.keys() | merged.keys() if single.get(name) != merged.get(name))
+        problems = []
+        if different:
+            problems.append(f"{len(different)} files differ from the single node output, like {different[0]}")
+        if duplicates:
+            problems.append(f"{len(duplicates)} duplicates without any city in two shards")
+        checks["the merge writes the files of a single node"] = problems
+
+        # A city of the first shard also found by the second one, and by the
+        # third one with another postal code
+        first, second = sorted(shard_outputs[0].glob("*.json"))[:2]
+        (shard_outputs[1] / first.name).write_bytes(first.read_bytes())
+        changed = json.loads(second.read_text(encoding="utf-8"))
+        changed["postal_code"] = "99999"
+        (shard_outputs[2] / second.name).write_text(json.dumps(changed), encoding="utf-8")
+        city_count, duplicates = merge_shards(shard_outputs, tmp_path / "merged-duplicates")
+        found = sorted((d.title, d.identical) for d in duplicates)
+        expected = sorted([(first.stem, True), (second.stem, False)])
+        problems = [] if found == expected else [f"Found {found}, expected {expected}"]
+        if city_count != len(all_names):
+            problems.append(f"{city_count} cities merged, {len(all_names)} expected")
+        if read_output_files(tmp_path / "merged-duplicates").get(second.name) != single.get(second.name):
+            problems.append(f"{second.name} was not taken from the first shard")
+        checks["the duplicates are found, the first shard wins"] = problems
+
+    for name, problems in checks.items():
+        print(f"{'ok' if not problems else 'FAILED'}  {name}")
+        for problem in problems:
+            print(f"    {problem}")
+    return not any(checks.values())
+
+def main():
+    parser = ArgumentParser("sharding")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    merge_parser = commands.add_parser("merge", help="Merge the scrape outputs of the shards")
+    merge_parser.add_argument("output_path")
+    merge_parser.add_argument("shard_output_paths", nargs="+")
+    merge_parser.add_argument("--format", choices=OUTPUT_FORMATS, default="json",
+                              help="The format of the merged output, the shards can be in any format")
+
+    check_parser = commands.add_parser("check", help="Check the shards and their merge, with a process per shard")
+    check_parser.add_argument("--pages", type=int, default=400)
+    check_parser.add_argument("--shards", type=int, default=4)
+    check_parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "check":
+        if args.shards < 3:
+            parser.error("The check needs at least 3 shards")
+        if not check_sharding(args.pages, args.shards, args.seed):
+            sys.exit(1)
+        return
+
+    output_path = Path(args.output_path)
+    shard_output_paths = [Path(p) for p in args.shard_output_paths]
+    if output_path in shard_output_paths:
+        parser.error("The merged output must be a new folder")
+    city_count, duplicates = merge_shards(shard_output_paths, output_path, args.format)
+    conflicts = sum(not d.identical for d in duplicates)
+    print(f"{city_count} cities merged from {len(shard_output_paths)} shards, "
+          f"{len(duplicates)} duplicates ({conflicts} different)")
+    if duplicates:
+        print(f"The duplicates are listed in {output_path / DUPLICATES_FILENAME}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""Cities most like a given city, by their five scores
+
+`SimilarCityIndex` keeps the scores of the scored cities in a (cities x 5)
+float32 array, and answers k nearest neighbours queries (euclidean distance)
+by batches: the distances of a whole batch of queries to all the cities are
+computed with a single matrix product, and the k best are picked with
+`argpartition`. With only 5 dimensions and a few tens of thousands of cities,
+this is faster than walking a KD-tree from Python, and needs nothing but NumPy.
+
+Queries can also be limited to the nearby cities of each city, kept as
+sparse rows (CSR) of city indices.
+
+Usage:
+    python -m bdmv.similar build <scrape output folder> [--output !similar_cities.npz]
+    python -m bdmv.similar query <index> <insee code>... [-k 10] [--nearby-only]
+    python -m bdmv.similar bench [--cities 35000] [--queries 1000] [--batch-size 256]
+"""
+
+from argparse import ArgumentParser
+from dataclasses import asdict
+from pathlib import Path
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from bdmv.bench_report import latency_report, print_table
+from bdmv.outputs import read_city_infos
+from bdmv.scraping import CityInformation, insee_code_from_url
+
+SIMILAR_INDEX_FILENAME = "!similar_cities.npz"
+
+DEFAULT_K = 10
+
+# Number of queries whose distances are computed at once: 256 x 35k cities
+# is about 36 MB of float32
+DEFAULT_BATCH_SIZE = 256
+
+# A list of (INSEE code, distance), closest first
+Neighbours = List[Tuple[str, float]]
+
+class SimilarCityIndex:
+    def __init__(self, insee_codes: np.ndarray, points: np.ndarray,
+                 nearby_indptr: np.ndarray, nearby_indices: np.ndarray):
+        self.insee_codes = insee_codes
+        self.points = np.ascontiguousarray(points, dtype=np.float32)
+        self.nearby_indptr = nearby_indptr
+        self.nearby_indices = nearby_indices
+        self._norms = np.einsum("ij,ij->i", self.points, self.points)
+        self._index: Dict[str, int] = {code: i for i, code in enumerate(insee_codes.tolist())}
+
+    @classmethod
+    def from_city_infos(cls, infos: Iterable[CityInformation]) -> "SimilarCityIndex":
+        """Only the cities with scores are indexed
+        """
+        insee_codes: List[str] = []
+        points: List[Tuple[float, ...]] = []
+        nearby_codes: List[List[str]] = []
+        for info in infos:
+            if not info.contains_scores:
+                continue
+            scores = info.scores
+            insee_codes.append(info.insee_code)
+            points.append((scores.security, scores.education, scores.hobbies,
+                           scores.environment, scores.practicality))
+            nearby_codes.append([insee_code_from_url(n.url) for n in info.nearby_cities])
+
+        index = {code: i for i, code in enumerate(insee_codes)}
+        indptr = [0]
+        indices: List[int] = []
+        for codes in nearby_codes:
+            # Nearby cities without scores (or never scraped) are not in the index
+            indices.extend(index[code] for code in codes if code in index)
+            indptr.append(len(indices))
+        return cls(np.array(insee_codes, dtype="U5"),
+                   np.array(points, dtype=np.float32).reshape(-1, 5),
+                   np.array(indptr, dtype=np.int64),
+                   np.array(indices, dtype=np.int64))
+
+    @classmethod
+    def from_scrape_output(cls, output_folder_path: Path) -> "SimilarCityIndex":
+        return cls.from_city_infos(read_city_infos(output_folder_path))
+
+    def save(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(path, insee_codes=self.insee_codes, points=self.points,
+                 nearby_indptr=self.nearby_indptr, nearby_indices=self.nearby_indices)
+
+    @classmethod
+    def load(cls, path: Path) -> "SimilarCityIndex":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["insee_codes"], data["points"], data["nearby_indptr"], data["nearby_indices"])
+
+    def __len__(self) -> int:
+        return len(self.insee_codes)
+
+    def __contains__(self, insee_code: str) -> bool:
+        return insee_code in self._index
+
+    def nearby(self, row: int) -> np.ndarray:
+        return self.nearby_indices[self.nearby_indptr[row]:self.nearby_indptr[row + 1]]
+
+    # ==== Queries ====
+
+    def query(self, insee_codes: Sequence[str], k: int = DEFAULT_K, nearby_only: bool = False,
+              batch_size: int = DEFAULT_BATCH_SIZE) -> List[Neighbours]:
+        """The `k` cities most like each of the given cities (not counting the
+        city itself), closest first.
+
+        Raises:
+            KeyError: A city is not in the index (unknown or without scores)
+        """
+        rows = np.array([self._index[code] for code in insee_codes], dtype=np.int64)
+        if nearby_only:
+            return [self._query_nearby(row, k) for row in rows]
+
+        results: List[Neighbours] = []
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            best, distances = self._knn(self.points[batch], k, exclude=batch)
+            results.extend(self._to_neighbours(b, d) for b, d in zip(best, distances))
+        return results
+
+    def query_points(self, points: np.ndarray, k: int = DEFAULT_K,
+                     batch_size: int = DEFAULT_BATCH_SIZE) -> List[Neighbours]:
+        """The `k` cities closest to each row of scores (a (n x 5) array)
+        """
+        points = np.asarray(points, dtype=np.float32).reshape(-1, 5)
+        results: List[Neighbours] = []
+        for start in range(0, len(points), batch_size):
+            best, distances = self._knn(points[start:start + batch_size], k)
+            results.extend(self._to_neighbours(b, d) for b, d in zip(best, distances))
+        return results
+
+    def _knn(self, queries: np.ndarray, k: int,
+             exclude: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        # |q - p|^2 = |q|^2 + |p|^2 - 2 q.p, for all the pairs at once
+        squared = (np.einsum("ij,ij->i", queries, queries)[:, None]
+                   + self._norms[None, :] - 2 * queries @ self.points.T)
+        if exclude is not None:
+            squared[np.arange(len(queries)), exclude] = np.inf
+        k = min(k, len(self) - (exclude is not None))
+        if k <= 0:
+            empty = np.empty((len(queries), 0), dtype=np.int64)
+            return empty, empty.astype(np.float32)
+        best = np.argpartition(squared, k - 1, axis=1)[:, :k]
+        best_squared = np.take_along_axis(squared, best, axis=1)
+        order = np.argsort(best_squared, axis=1, kind="stable")
+        best = np.take_along_axis(best, order, axis=1)
+        distances = np.sqrt(np.maximum(np.take_along_axis(best_squared, order, axis=1), 0))
+        return best, distances
+
+    def _query_nearby(self, row: int, k: int) -> Neighbours:
+        candidates = self.nearby(row)
+        candidates = candidates[candidates != row]
+        distances = np.linalg.norm(self.points[candidates] - self.points[row], axis=1)
+        order = np.argsort(distances, kind="stable")[:k]
+        return self._to_neighbours(candidates[order], distances[order])
+
+    def _to_neighbours(self, rows: np.ndarray, distances: np.ndarray) -> Neighbours:
+        return list(zip(self.insee_codes[rows].tolist(), distances.astype(float).tolist()))
+
+def query_lines(index: SimilarCityIndex, insee_codes: Sequence[str], k: int = DEFAULT_K,
+                nearby_only: bool = False) -> List[str]:
+    """A line per given city, with its most similar cities, or saying it is
+    not in the index
+    """
+    indexed = [code for code in insee_codes if code in index]
+    results = dict(zip(indexed, index.query(indexed, k, nearby_only)))
+    lines = []
+    for code in insee_codes:
+        if code in results:
+            lines.append(f"{code} : " + ", ".join(f"{c} ({d:.2f})" for c, d in results[code]))
+        else:
+            # Only the cities with scores are indexed
+            lines.append(f"{code} : not indexed (unknown city, or no scores)")
+    return lines
+
+# ==== Benchmark ====
+
+def random_index(city_count: int, seed: int = 0) -> SimilarCityIndex:
+    """An index of random scores, with 10 random nearby cities per city
+    """
+    rng = np.random.default_rng(seed)
+    insee_codes = np.array([f"{i // 1000 % 100:02d}{i % 1000:03d}" for i in range(city_count)], dtype="U5")
+    points = rng.uniform(1, 5, (city_count, 5)).astype(np.float32)
+    indices = rng.integers(0, city_count, city_count * 10)
+    indptr = np.arange(0, city_count * 10 + 1, 10)
+    return SimilarCityIndex(insee_codes, points, indptr, indices)
+
+def bench(city_count: int, query_count: int, k: int, batch_size: int):
+    index = random_index(city_count)
+    codes = index.insee_codes[np.random.default_rng(1).integers(0, city_count, query_count)].tolist()
+    print(f"{city_count} cities, {query_count} queries, k = {k}\n")
+
+    reports = []
+    for label, nearby_only in (("query", False), ("query --nearby-only", True)):
+        durations = []
+        for code in codes:
+            start = time.perf_counter()
+            index.query([code], k, nearby_only)
+            durations.append((time.perf_counter() - start) * 1000)
+        reports.append(latency_report(f"{label} (one city)", durations))
+
+    durations = []
+    for start_index in range(0, query_count, batch_size):
+        start = time.perf_counter()
+        index.query(codes[start_index:start_index + batch_size], k, batch_size=batch_size)
+        durations.append((time.perf_counter() - start) * 1000 / len(codes[start_index:start_index + batch_size]))
+    reports.append(latency_report(f"query (batches of {batch_size}, per city)", durations))
+    print_table([asdict(r) for r in reports])
+
+def main():
+    parser = ArgumentParser("similar")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = commands.add_parser("build", help="Build the index from the output of the scrape script")
+    build_parser.add_argument("scrape_output_path")
+    build_parser.add_argument("--output", help=f"The index file ({SIMILAR_INDEX_FILENAME} in the scrape output by default)")
+
+    query_parser = commands.add_parser("query", help="Show the cities most like the given ones")
+    query_parser.add_argument("index_path")
+    query_parser.add_argument("insee_codes", nargs="+")
+    query_parser.add_argument("-k", type=int, default=DEFAULT_K)
+    query_parser.add_argument("--nearby-only", action="store_true",
+                              help="Only look at the nearby cities of each city")
+
+    bench_parser = commands.add_parser("bench", help="Measure the query latency on random scores")
+    bench_parser.add_argument("--cities", type=int, default=35000)
+    bench_parser.add_argument("--queries", type=int, default=1000)
+    bench_parser.add_argument("-k", type=int, default=DEFAULT_K)
+    bench_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        output_path = Path(args.scrape_output_path)
+        index = SimilarCityIndex.from_scrape_output(output_path)
+        index_path = Path(args.output) if args.output else output_path / SIMILAR_INDEX_FILENAME
+        index.save(index_path)
+        print(f"{len(index)} cities with scores indexed in {index_path}")
+    elif args.command == "query":
+        index = SimilarCityIndex.load(Path(args.index_path))
+        for line in query_lines(index, args.insee_codes, args.k, args.nearby_only):
+            print(line)
+    else:
+        bench(args.cities, args.queries, args.k, args.batch_size)
+
+if __name__ == "__main__":
+    main()
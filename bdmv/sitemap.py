@@ -0,0 +1,55 @@
+"""Streaming reader for the sitemaps
+
+The sitemaps are not real xml files, they contain a single long string with
+all the urls glued together. Instead of reading the whole file and building
+the full list of urls, we scan it by chunks and yield every url as soon as
+it is found.
+"""
+
+from pathlib import Path
+import re
+from typing import Iterator, Set, Tuple
+
+DEFAULT_CHUNK_SIZE = 1 << 16
+
+# Longest text kept between two chunks when nothing matched,
+# no url of the sitemap is that long
+MAX_MATCH_LENGTH = 4096
+
+# The sitemap of the "avis.html" pages, and the pattern of its urls
+AVIS_SITEMAP_PATH = Path("data/sitemap-villeavis.xml")
+AVIS_URL_PATTERN = re.compile(r"https:\/\/www.bien-dans-ma-ville.fr\/(.*?)\/avis.html")
+
+def iter_sitemap_urls(path: Path, pattern: re.Pattern,
+                      chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Tuple[str, str]]:
+    """Yields each url of the sitemap only once, in the order of the file.
+    
+    Matches can be split between two chunks: the text after the last match
+    of a chunk is kept and scanned again with the next one.
+    
+    Args:
+        pattern (re.Pattern): The url pattern, its first group is the city name
+    
+    Returns:
+        Iterator[Tuple[str, str]]: Tuples containing
+            - The city name (key)
+            - The url
+    """
+    seen: Set[str] = set()
+    leftover = ""
+    with open(path, "r", encoding="utf-8") as file:
+        while True:
+            chunk = file.read(chunk_size)
+            buffer = leftover + chunk
+            last_end = 0
+            for m in pattern.finditer(buffer):
+                last_end = m.end()
+                url = m.group()
+                if url in seen:
+                    continue
+                seen.add(url)
+                yield m.group(1), url
+            
+            if not chunk:
+                return
+            leftover = buffer[max(last_end, len(buffer) - MAX_MATCH_LENGTH):]
@@ -0,0 +1,247 @@
+"""Versioned snapshots of the scraped cities, and deltas between them
+
+A `Snapshot` keeps, for each city of a scrape, its INSEE code, its title and
+a 64 bits fingerprint of what consumers care about: the postal code, the
+scores and the set of nearby cities. Sorted by INSEE code, the arrays of
+35k cities take a few hundred KB once compressed.
+
+Snapshots are numbered in the "!snapshots" folder of the scrape output.
+Next to each one, "NNNN.delta.jsonl" has a line per city that was added,
+changed or removed since the previous snapshot, so a refresh can be
+ingested by reading only what changed. The first delta has all the cities.
+
+Usage:
+    python -m bdmv.snapshots take <scrape output folder>
+    python -m bdmv.snapshots list <scrape output folder>
+    python -m bdmv.snapshots diff <scrape output folder> [old version] [new version]
+"""
+
+from argparse import ArgumentParser
+from dataclasses import dataclass
+import hashlib
+import json
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, TextIO
+
+import numpy as np
+
+from bdmv.outputs import read_city_infos, write_infos_file
+from bdmv.scraping import CityInformation, insee_code_from_url
+
+SNAPSHOTS_FOLDER = "!snapshots"
+
+ADDED = "added"
+CHANGED = "changed"
+REMOVED = "removed"
+
+def city_fingerprint(info: CityInformation) -> int:
+    """Hash of the postal code, the scores and the nearby cities (as a set)
+    """
+    scores = info.scores
+    key = json.dumps([
+        info.postal_code,
+        info.contains_scores,
+        [scores.security, scores.education, scores.hobbies, scores.environment, scores.practicality],
+        sorted({insee_code_from_url(n.url) for n in info.nearby_cities}),
+    ])
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+class Snapshot:
+    """`fingerprints[i]` is the fingerprint of the city `insee_codes[i]`,
+    sorted by INSEE code
+    """
+    def __init__(self, version: int, insee_codes: np.ndarray, titles: np.ndarray, fingerprints: np.ndarray):
+        self.version = version
+        self.insee_codes = insee_codes
+        self.titles = titles
+        self.fingerprints = fingerprints
+        self._index: Optional[Dict[str, int]] = None
+
+    @classmethod
+    def from_lists(cls, version: int, insee_codes: List[str], titles: List[str],
+                   fingerprints: List[int]) -> "Snapshot":
+        """Sorts the cities by INSEE code, the last one wins when a city is there twice
+        """
+        codes = np.array(insee_codes, dtype="U5")
+        # Reversed, so that `np.unique` keeps the last occurrence of each code
+        codes, first = np.unique(codes[::-1], return_index=True)
+        rows = len(insee_codes) - 1 - first
+        return cls(version, codes, np.array(titles, dtype=str)[rows],
+                   np.array(fingerprints, dtype=np.uint64)[rows])
+
+    def save(self, path: Path):
+        np.savez_compressed(path, insee_codes=self.insee_codes, titles=self.titles,
+                            fingerprints=self.fingerprints)
+
+    @classmethod
+    def load(cls, version: int, path: Path) -> "Snapshot":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(version, data["insee_codes"], data["titles"], data["fingerprints"])
+
+    def __len__(self) -> int:
+        return len(self.insee_codes)
+
+    def fingerprint_of(self, insee_code: str) -> Optional[int]:
+        if self._index is None:
+            self._index = {code: i for i, code in enumerate(self.insee_codes.tolist())}
+        row = self._index.get(insee_code)
+        return None if row is None else int(self.fingerprints[row])
+
+@dataclass
+class Delta:
+    """INSEE codes of the cities added, changed and removed between two snapshots
+    """
+    added: np.ndarray
+    changed: np.ndarray
+    removed: np.ndarray
+
+    def summary(self) -> str:
+        return f"{len(self.added)} added, {len(self.changed)} changed, {len(self.removed)} removed cities"
+
+def diff(old: Snapshot, new: Snapshot) -> Delta:
+    """Merge of the two sorted code arrays, with a binary search of each new
+    code in the old ones
+    """
+    if len(old) == 0:
+        empty = new.insee_codes[:0]
+        return Delta(new.insee_codes, empty, empty)
+    rows = np.minimum(np.searchsorted(old.insee_codes, new.insee_codes), len(old) - 1)
+    found = old.insee_codes[rows] == new.insee_codes
+    changed = found & (old.fingerprints[rows] != new.fingerprints)
+    kept = np.zeros(len(old), dtype=np.bool_)
+    kept[rows[found]] = True
+    return Delta(new.insee_codes[~found], new.insee_codes[changed], old.insee_codes[~kept])
+
+class SnapshotStore:
+    """The numbered snapshots and deltas of a scrape output folder
+    """
+    def __init__(self, folder_path: Path):
+        self.folder_path = folder_path
+
+    @classmethod
+    def in_folder(cls, output_folder_path: Path) -> "SnapshotStore":
+        return cls(output_folder_path / SNAPSHOTS_FOLDER)
+
+    def versions(self) -> List[int]:
+        if not self.folder_path.exists():
+            return []
+        return sorted(int(path.stem) for path in self.folder_path.glob("*.npz"))
+
+    def snapshot_path(self, version: int) -> Path:
+        return self.folder_path / f"{version:04d}.npz"
+
+    def delta_path(self, version: int) -> Path:
+        return self.folder_path / f"{version:04d}.delta.jsonl"
+
+    def load(self, version: int) -> Snapshot:
+        return Snapshot.load(version, self.snapshot_path(version))
+
+    def latest(self) -> Optional[Snapshot]:
+        versions = self.versions()
+        return self.load(versions[-1]) if versions else None
+
+class DeltaOutput:
+    """Keeps only what changed since the latest snapshot.
+
+    Only the json files of the added and changed cities are written (with
+    `write_files`), and the delta lines of the next version as the cities
+    come. When closed, the removed cities are added to the delta (and their
+    json files deleted, with `write_files`) and the new snapshot is saved.
+    """
+    def __init__(self, output_folder_path: Path, write_files: bool = True):
+        self.output_folder_path = output_folder_path
+        self.write_files = write_files
+        self.store = SnapshotStore.in_folder(output_folder_path)
+        self.store.folder_path.mkdir(parents=True, exist_ok=True)
+        self.previous = self.store.latest()
+        self.version = 1 if self.previous is None else self.previous.version + 1
+        self.counts: Dict[str, int] = {ADDED: 0, CHANGED: 0, REMOVED: 0}
+
+        self._insee_codes: List[str] = []
+        self._titles: List[str] = []
+        self._fingerprints: List[int] = []
+        self._delta_file: TextIO = open(self.store.delta_path(self.version), "w", encoding="utf-8")
+
+    def write(self, info: CityInformation):
+        fingerprint = city_fingerprint(info)
+        self._insee_codes.append(info.insee_code)
+        self._titles.append(info.title)
+        self._fingerprints.append(fingerprint)
+
+        previous = None if self.previous is None else self.previous.fingerprint_of(info.insee_code)
+        if previous == fingerprint:
+            return
+        change = ADDED if previous is None else CHANGED
+        self._write_line({"change": change, "city": info.to_json()})
+        if self.write_files:
+            write_infos_file(info, self.output_folder_path)
+
+    def close(self):
+        snapshot = Snapshot.from_lists(self.version, self._insee_codes, self._titles, self._fingerprints)
+        if self.previous is not None:
+            removed = ~np.isin(self.previous.insee_codes, snapshot.insee_codes, assume_unique=True)
+            for insee_code, title in zip(self.previous.insee_codes[removed].tolist(),
+                                         self.previous.titles[removed].tolist()):
+                self._write_line({"change": REMOVED, "insee_code": insee_code, "title": title})
+                if self.write_files:
+                    # Otherwise the readers of the folder would still find the city
+                    (self.output_folder_path / f"{title}.json").unlink(missing_ok=True)
+        self._delta_file.close()
+        # Saved last, so an interrupted run does not become the reference of the next one
+        snapshot.save(self.store.snapshot_path(self.version))
+
+    def summary(self) -> str:
+        return (f"Snapshot {self.version} : {self.counts[ADDED]} added, {self.counts[CHANGED]} changed, "
+                f"{self.counts[REMOVED]} removed cities")
+
+    def _write_line(self, line: dict):
+        self.counts[line["change"]] += 1
+        self._delta_file.write(json.dumps(line) + "\n")
+
+    def __enter__(self) -> "DeltaOutput":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def take_snapshot(output_folder_path: Path, infos: Iterable[CityInformation]) -> DeltaOutput:
+    """Snapshots the cities of an existing output, without writing their files again
+    """
+    with DeltaOutput(output_folder_path, write_files=False) as output:
+        for info in infos:
+            output.write(info)
+    return output
+
+def main():
+    parser = ArgumentParser("snapshots")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    take_parser = commands.add_parser("take", help="Snapshot the cities of a scrape output folder")
+    take_parser.add_argument("output_path")
+
+    list_parser = commands.add_parser("list", help="Show the snapshots of a scrape output folder")
+    list_parser.add_argument("output_path")
+
+    diff_parser = commands.add_parser("diff", help="Count the cities changed between two snapshots")
+    diff_parser.add_argument("output_path")
+    diff_parser.add_argument("old", type=int, nargs="?", help="The previous to last snapshot by default")
+    diff_parser.add_argument("new", type=int, nargs="?", help="The last snapshot by default")
+    args = parser.parse_args()
+
+    output_path = Path(args.output_path)
+    store = SnapshotStore.in_folder(output_path)
+    if args.command == "take":
+        print(take_snapshot(output_path, read_city_infos(output_path)).summary())
+    elif args.command == "list":
+        for version in store.versions():
+            print(f"{version:>4}  {len(store.load(version))} cities")
+    else:
+        versions = store.versions()
+        if len(versions) < 2 and (args.old is None or args.new is None):
+            parser.error("Two snapshots are needed")
+        old = args.old if args.old is not None else versions[-2]
+        new = args.new if args.new is not None else versions[-1]
+        print(diff(store.load(old), store.load(new)).summary())
+
+if __name__ == "__main__":
+    main()
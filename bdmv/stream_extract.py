@@ -0,0 +1,209 @@
+"""Single pass extractor for the city pages, without building any tree
+
+The city pages all come from the same template, so we can read the few
+values we need while the page is being tokenized, with a small state
+machine on top of `html.parser.HTMLParser`. It mimics the selectors of the
+find_* functions of `bdmv.scraping`:
+    - h1 (first direct text) and h1 > small
+    - .bloc_notemoyenne > h3
+    - table.bloc_chiffre td:nth-child(2) > span:nth-child(1)
+    - .tab_compare tbody tr (first td text and its first a[href])
+
+When the page does not look like the template, `TemplateMismatch` is raised
+and the caller should use the BeautifulSoup path instead.
+"""
+
+from dataclasses import dataclass
+from html.parser import HTMLParser
+from typing import Dict, List, Optional, Tuple
+
+NO_SCORES_TEXT = "Pas encore d'avis..."
+
+# Elements that never have an end tag
+VOID_ELEMENTS = frozenset((
+    "area", "base", "br", "col", "embed", "hr", "img", "input",
+    "link", "meta", "param", "source", "track", "wbr",
+))
+
+class TemplateMismatch(ValueError):
+    pass
+
+@dataclass
+class StreamedCity:
+    name: str
+    postal_code: str
+    contains_scores: bool
+    score_values: List[float]
+    # Tuples of the url and the text of the first cell of each row
+    nearby_rows: List[Tuple[str, str]]
+
+@dataclass
+class _Frame:
+    tag: str
+    classes: Tuple[str, ...]
+    parent_index: int
+    child_count: int = 0
+    is_score_table: bool = False
+    is_compare: bool = False
+    is_compare_tbody: bool = False
+
+class _Capture:
+    """Text of an element, collected until its frame is closed
+    """
+    def __init__(self, depth: int):
+        self.depth = depth
+        self.parts: List[str] = []
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+@dataclass
+class _Row:
+    depth: int
+    td_count: int = 0
+    first_td: Optional[_Capture] = None
+    url: Optional[str] = None
+
+class CityPageScanner(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.stack: List[_Frame] = [_Frame("[document]", (), 0)]
+        self.captures: List[_Capture] = []
+
+        self.h1_depth: Optional[int] = None
+        self.city_text: Optional[str] = None
+        self.postal_code: Optional[_Capture] = None
+        self.average: Optional[_Capture] = None
+        self.score_spans: List[_Capture] = []
+        self.rows: List[Tuple[str, str]] = []
+        self.row: Optional[_Row] = None
+        self.mismatch: Optional[str] = None
+
+        # Number of open elements of each kind, to check ancestors quickly
+        self.open_score_tables = 0
+        self.open_compare = 0
+        self.open_compare_tbody = 0
+
+    # ==== Tree tracking ====
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]):
+        parent = self.stack[-1]
+        parent.child_count += 1
+        attributes: Dict[str, str] = {k: ("" if v is None else v) for k, v in attrs}
+        classes = tuple(attributes.get("class", "").split())
+        frame = _Frame(tag, classes, parent.child_count)
+        self.stack.append(frame)
+        depth = len(self.stack) - 1
+
+        if tag == "h1" and self.h1_depth is None and self.city_text is None:
+            self.h1_depth = depth
+        elif tag == "small" and parent.tag == "h1" and self.postal_code is None:
+            self.postal_code = self.start_capture(depth)
+        elif tag == "h3" and "bloc_notemoyenne" in parent.classes and self.average is None:
+            self.average = self.start_capture(depth)
+        elif (tag == "span" and frame.parent_index == 1 and parent.tag == "td"
+              and parent.parent_index == 2 and self.open_score_tables > 0):
+            self.score_spans.append(self.start_capture(depth))
+
+        frame.is_score_table = tag == "table" and "bloc_chiffre" in classes
+        frame.is_compare = "tab_compare" in classes
+        frame.is_compare_tbody = tag == "tbody" and self.open_compare > 0
+        self.open_score_tables += frame.is_score_table
+        self.open_compare += frame.is_compare
+        self.open_compare_tbody += frame.is_compare_tbody
+
+        if tag == "tr" and self.open_compare_tbody > 0:
+            if self.row is not None:
+                self.mismatch = "Nested rows in the nearby cities table"
+            self.row = _Row(depth)
+        elif self.row is not None:
+            if tag == "td":
+                self.row.td_count += 1
+                if self.row.td_count == 1:
+                    self.row.first_td = self.start_capture(depth)
+            elif (tag == "a" and "href" in attributes and self.row.url is None
+                  and self.row.first_td in self.captures):
+                self.row.url = attributes["href"]
+
+        if tag in VOID_ELEMENTS:
+            self.pop_to(depth)
+
+    def handle_startendtag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            self.pop_to(len(self.stack) - 1)
+
+    def handle_endtag(self, tag: str):
+        # Like BeautifulSoup, close up to the last open element with this name,
+        # or ignore the end tag if there is none
+        for depth in range(len(self.stack) - 1, 0, -1):
+            if self.stack[depth].tag == tag:
+                self.pop_to(depth)
+                return
+
+    def pop_to(self, depth: int):
+        while len(self.stack) > depth:
+            closed_depth = len(self.stack) - 1
+            frame = self.stack.pop()
+
+            self.open_score_tables -= frame.is_score_table
+            self.open_compare -= frame.is_compare
+            self.open_compare_tbody -= frame.is_compare_tbody
+            if self.row is not None and self.row.depth == closed_depth:
+                self.end_row()
+            if self.h1_depth == closed_depth:
+                self.h1_depth = None
+                if self.city_text is None:
+                    self.city_text = ""
+                    self.mismatch = "No text directly in the h1"
+
+            self.captures = [c for c in self.captures if c.depth < closed_depth]
+
+    # ==== Data ====
+
+    def start_capture(self, depth: int) -> _Capture:
+        capture = _Capture(depth)
+        self.captures.append(capture)
+        return capture
+
+    def handle_data(self, data: str):
+        if self.h1_depth is not None and self.h1_depth == len(self.stack) - 1 and self.city_text is None:
+            self.city_text = data
+        for capture in self.captures:
+            capture.parts.append(data)
+
+    def end_row(self):
+        row = self.row
+        self.row = None
+        if row.first_td is None or row.url is None:
+            self.mismatch = "Nearby city row without a td or a link"
+            return
+        self.rows.append((row.url, row.first_td.text))
+
+    def result(self) -> StreamedCity:
+        self.close()
+        self.pop_to(1)
+        if self.mismatch is not None:
+            raise TemplateMismatch(self.mismatch)
+        if self.city_text is None or self.postal_code is None or self.average is None:
+            raise TemplateMismatch("Missing h1, h1 > small or .bloc_notemoyenne > h3")
+
+        contains_scores = self.average.text != NO_SCORES_TEXT
+        score_values = []
+        if contains_scores:
+            if len(self.score_spans) != 5:
+                raise TemplateMismatch(f"Expected 5 scores, found {len(self.score_spans)}")
+            try:
+                score_values = [float(s.text) for s in self.score_spans]
+            except ValueError as e:
+                raise TemplateMismatch(str(e)) from e
+
+        # We have something like "Avis Gergny ", we have to clean it
+        name = self.city_text.removeprefix("Avis").strip()
+        return StreamedCity(name, self.postal_code.text, contains_scores, score_values, self.rows)
+
+def scan_city_page(html: str) -> StreamedCity:
+    scanner = CityPageScanner()
+    scanner.feed(html)
+    return scanner.result()
@@ -0,0 +1,175 @@
+"""Synthetic city pages, following the template of the website
+
+Used to measure the scrapping code offline: pages are generated from a seed,
+so the same corpus can be built again to compare two runs. The corpus mixes
+pages with scores, pages with "Pas encore d'avis..." and nearby cities
+tables of various lengths. With `broken`, a few pages that can not be
+scraped are added, they must end up in the quarantine.
+
+Usage:
+    python -m bdmv.synthetic <output_folder> <page_count> [--seed SEED] [--broken]
+"""
+
+from argparse import ArgumentParser
+from dataclasses import dataclass
+from itertools import chain
+from pathlib import Path
+import random
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
+import unicodedata
+
+from bdmv.scraping import WEBSITE_ROOT
+from bdmv.stream_extract import NO_SCORES_TEXT
+
+SCORED_RATIO = 0.6
+MAX_NEARBY_CITIES = 30
+
+SCORE_LABELS = ("Sécurité", "Éducation", "Sports et loisirs", "Environnement", "Vie pratique")
+
+NAME_PREFIXES = ("Saint", "Sainte", "Le", "La", "Les", "Villeneuve", "Mont", "Bourg")
+NAME_ROOTS = ("Étienne", "Germain", "Martin", "Œuvre", "Aubin", "Forêt", "Rivière",
+              "Château", "Bois", "Pré", "Chêne", "Côte", "Val", "Fontaine", "Hélène")
+NAME_SUFFIXES = ("", "", "", "sur-Mer", "en-Bresse", "lès-Bains", "d'Azur", "sous-Bois")
+
+@dataclass
+class SyntheticCity:
+    title: str
+    name: str
+    postal_code: str
+    insee_code: str
+
+def slugify(name: str) -> str:
+    # "Saint-Étienne-d'Œuvre" -> "saint-etienne-d-oeuvre"
+    name = name.replace("œ", "oe").replace("Œ", "Oe")
+    name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
+
+def generate_cities(count: int, seed: int = 0) -> List[SyntheticCity]:
+    rnd = random.Random(seed)
+    cities = []
+    for i in range(count):
+        parts = [rnd.choice(NAME_ROOTS)]
+        if rnd.random() < 0.5:
+            parts.insert(0, rnd.choice(NAME_PREFIXES))
+        suffix = rnd.choice(NAME_SUFFIXES)
+        if suffix:
+            parts.append(suffix)
+        name = "-".join(parts)
+        department = 1 + i % 95
+        insee_code = f"{department:02d}{i // 95 % 1000:03d}"
+        postal_code = f"{department:02d}{rnd.randrange(0, 1000, 10):03d}"
+        cities.append(SyntheticCity(f"{slugify(name)}-{insee_code}", name, postal_code, insee_code))
+    return cities
+
+def render_page(city: SyntheticCity, cities: List[SyntheticCity], rnd: random.Random,
+                scored: Optional[bool] = None) -> str:
+    if scored is None:
+        scored = rnd.random() < SCORED_RATIO
+    average = f"{rnd.uniform(1, 5):.1f}/5" if scored else NO_SCORES_TEXT
+
+    score_rows = ""
+    if scored:
+        score_rows = "".join(
+            f'<tr><td class="label">{label}</td>'
+            f'<td><span class="note">{rnd.uniform(1, 5):.1f}</span><span>/5</span></td>'
+            f'<td><div class="barre"></div></td></tr>'
+            for label in SCORE_LABELS
+        )
+
+    nearby_rows = []
+    for nearby in rnd.sample(cities, min(len(cities), rnd.randint(0, MAX_NEARBY_CITIES))):
+        note = f" ({rnd.uniform(1, 5):.1f})" if rnd.random() < SCORED_RATIO else ""
+        cells = "".join(f"<td>{rnd.randint(0, 100)}</td>" for _ in range(6))
+        nearby_rows.append(
+            f'<tr><td><a href="{WEBSITE_ROOT}/{nearby.title}/avis.html">{nearby.name}{note}</a></td>{cells}</tr>'
+        )
+
+    reviews = "".join(
+        f'<div class="avis"><p class="auteur">Habitant {k}</p>'
+        f'<p>{"Ville agréable, commerces à proximité & transports. " * rnd.randint(2, 12)}</p></div>'
+        for k in range(rnd.randint(0, 8))
+    )
+    menu = "".join(f'<li><a href="/departement-{d:02d}.html">Département {d:02d}</a></li>' for d in range(1, 40))
+
+    return f"""<!DOCTYPE html>
+<html lang="fr">
+<head>
+<meta charset="utf-8">
+<title>Avis {city.name} ({city.postal_code})</title>
+<link rel="stylesheet" href="/css/style.css">
+<script>window.dataLayer = window.dataLayer || []; var tag = "<h1>";</script>
+<style>.bloc_notemoyenne h3 {{ color: #333; }}</style>
+</head>
+<body>
+<header><nav><ul>{menu}</ul></nav></header>
+<div id="contenu">
+<h1>Avis {city.name} <small>{city.postal_code}</small></h1>
+<!-- Note moyenne -->
+<div class="bloc_notemoyenne"><h3>{average}</h3><p>Basée sur les avis des habitants</p></div>
+<table class="bloc_chiffre"><tbody>{score_rows}</tbody></table>
+<section class="liste_avis">{reviews}</section>
+<h2>Comparer avec les villes proches</h2>
+<table class="tab_compare">
+<thead><tr><th>Ville</th><th>Sécurité</th><th>Éducation</th><th>Loisirs</th><th>Environnement</th><th>Pratique</th><th>Habitants</th></tr></thead>
+<tbody>{"".join(nearby_rows)}</tbody>
+</table>
+</div>
+<footer><p>&copy; bien-dans-ma-ville.fr<br>Mentions légales</p></footer>
+</body>
+</html>
+"""
+
+def generate_pages(count: int, seed: int = 0) -> Iterator[Tuple[str, str]]:
+    """Yields the title and the html of `count` city pages
+    """
+    cities = generate_cities(count, seed)
+    rnd = random.Random(seed + 1)
+    for city in cities:
+        yield city.title, render_page(city, cities, rnd)
+
+def render_broken_pages(seed: int = 0) -> Dict[str, str]:
+    """Scored pages damaged in the ways seen on the website, by title (in an
+    INSEE code range that the generated cities do not use)
+    """
+    city = generate_cities(1, seed)[0]
+    html = render_page(city, [city], random.Random(seed), scored=True)
+    scores_table = '<table class="bloc_chiffre">'
+    extra_row = '<tr><td class="label">Santé</td><td><span class="note">3.0</span><span>/5</span></td></tr>'
+    return {
+        # An error page served instead of the city, with the same stylesheet
+        "sans-bloc-99001": html.replace('class="bloc_notemoyenne"', 'class="bloc_erreur"'),
+        # A sixth score, not in the 5 fields of `Scores`
+        "six-notes-99002": html.replace("</tbody></table>", extra_row + "</tbody></table>", 1),
+        # A download cut right after the average score
+        "tronquee-99003": html[:html.index(scores_table)],
+    }
+
+def write_corpus(output_folder_path: Path, count: int, seed: int = 0,
+                 broken: bool = False) -> List[Path]:
+    output_folder_path.mkdir(parents=True, exist_ok=True)
+    paths = []
+    pages = generate_pages(count, seed)
+    if broken:
+        pages = chain(pages, render_broken_pages(seed).items())
+    for title, html in pages:
+        path = output_folder_path / f"{title}.html"
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(html)
+        paths.append(path)
+    return paths
+
+def main():
+    parser = ArgumentParser("synthetic")
+    parser.add_argument("output_path", help="The folder where the pages will go")
+    parser.add_argument("count", type=int, help="The number of pages")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--broken", action="store_true",
+                        help="Also write a few pages that can not be scraped")
+    args = parser.parse_args()
+
+    paths = write_corpus(Path(args.output_path), args.count, args.seed, args.broken)
+    print(f"Wrote {len(paths)} pages in {args.output_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Cheap classification of the city pages, before parsing them
+
+Many pages have no scores yet ("Pas encore d'avis..."). Looking at the raw
+text around ".bloc_notemoyenne" is enough to tell them apart, so they can
+skip the parsing of the scores. Pages without this block can not be
+scraped at all: with a `Quarantine`, they (and any page that fails to
+parse) are set aside with the reason, instead of stopping the whole run.
+"""
+
+from collections import Counter
+import csv
+from dataclasses import dataclass
+from pathlib import Path
+import re
+from typing import TYPE_CHECKING, List
+
+from bdmv.stream_extract import NO_SCORES_TEXT
+
+if TYPE_CHECKING:
+    from bdmv.scraping import CityInformation
+
+SCORED = "scored"
+UNSCORED = "unscored"
+MALFORMED = "malformed"
+
+QUARANTINE_FILENAME = "!quarantine.csv"
+
+# The class attribute of the block, not the class name alone: the
+# stylesheets of the page mention it too
+SCORES_BLOCK_MARKER = re.compile(r"""class=["'](?:[^"']*\s)?bloc_notemoyenne[\s"']""")
+
+class MalformedPage(ValueError):
+    pass
+
+def classify_page(html: str) -> str:
+    """Returns SCORED, UNSCORED or MALFORMED from the raw text of the page.
+
+    Only says UNSCORED when the ".bloc_notemoyenne > h3" text is exactly
+    the "no scores" one, anything unusual is SCORED so the page is fully
+    parsed. MALFORMED pages have no ".bloc_notemoyenne" at all.
+    """
+    match = SCORES_BLOCK_MARKER.search(html)
+    if match is None:
+        return MALFORMED
+    block = match.start()
+    h3 = html.find("<h3", block)
+    block_end = html.find("</div", block)
+    if h3 < 0 or (0 <= block_end < h3):
+        return SCORED
+    text_start = html.find(">", h3) + 1
+    text_end = html.find("</h3>", text_start)
+    if text_start <= 0 or text_end < 0:
+        return SCORED
+    return UNSCORED if html[text_start:text_end] == NO_SCORES_TEXT else SCORED
+
+@dataclass
+class QuarantinedPage:
+    title: str
+    reason: str
+
+class Quarantine:
+    """The pages that could not be scraped, and the number of pages of each class
+    """
+    def __init__(self):
+        self.pages: List[QuarantinedPage] = []
+        self.counts: Counter = Counter({SCORED: 0, UNSCORED: 0, MALFORMED: 0})
+
+    def add(self, page: QuarantinedPage):
+        self.pages.append(page)
+        self.counts[MALFORMED] += 1
+
+    def count(self, info: "CityInformation"):
+        self.counts[SCORED if info.contains_scores else UNSCORED] += 1
+
+    def summary(self) -> str:
+        return ", ".join(f"{count} {name}" for name, count in self.counts.items()) + " pages"
+
+    def save(self, path: Path):
+        """Writes the quarantined pages, if there are any
+        """
+        if not self.pages:
+            return
+        with open(path, "w", encoding="utf-8", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(("title", "reason"))
+            writer.writerows((page.title, page.reason) for page in self.pages)